@@ -20,6 +20,10 @@ from nxdrive.client.common import FILE_BUFFER_SIZE_NO_RATE_LIMIT, FILE_BUFFER_SI
 from nxdrive.client.common import DEFAULT_IGNORED_PREFIXES
 from nxdrive.client.common import DEFAULT_IGNORED_SUFFIXES
 from nxdrive.client.common import safe_filename
+from nxdrive.client.connection_pool import ConnectionPool
+from nxdrive.client.connection_pool import get_handlers as get_keep_alive_handlers
+from nxdrive.client.operation_cache import OperationCache
+from nxdrive.client.segmented_download import SegmentedDownload, SEGMENTED_DOWNLOAD_THRESHOLD
 from nxdrive.engine.activity import Action, FileAction
 from nxdrive.utils import DEVICE_DESCRIPTIONS
 from nxdrive.utils import TOKEN_PERMISSION
@@ -75,6 +79,8 @@ NUMBER_OF_PROCESSORS = {
 }
 
 MAX_NUMBER_PROCESSORS = max([sum(v) for v in NUMBER_OF_PROCESSORS.values()])
+# Idle connections kept by host: one for each processor and for the remote watcher
+CONNECTION_POOL_SIZE = MAX_NUMBER_PROCESSORS + 5
 
 
 def _get_rate_step(rate):
@@ -747,6 +753,13 @@ class FileTransferStats(object):
         with self.lock:
             return self.stats[thread_id]
 
+    def get_rates(self, thread_ids):
+        # Total instant rate and number of the transfers in progress in these threads
+        with self.lock:
+            rates = [self.stats[thread_id].get_instant_rate() for thread_id in thread_ids
+                     if thread_id in self.stats and self.stats[thread_id].in_progress()]
+            return sum(rates), len(rates)
+
     def clear(self, thread_id):
         try:
             # update stats for this processor
@@ -766,6 +779,27 @@ class FileTransferStats(object):
         return '\n'.join(['thread=%s, stats=%s' % (item[0], str(item[1])) for item in self.stats.items()])
 
 
+class LatencyStats(object):
+    WEIGHT = 0.2  # of the last call in the moving average
+
+    def __init__(self):
+        self.average = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def update(self, duration):
+        with self.lock:
+            if self.count == 0:
+                self.average = duration
+            else:
+                self.average += (duration - self.average) * LatencyStats.WEIGHT
+            self.count += 1
+
+    def get_average(self):
+        with self.lock:
+            return self.average
+
+
 class BaseAutomationClient(BaseClient):
     """Client for the Nuxeo Content Automation HTTP API
 
@@ -797,6 +831,15 @@ class BaseAutomationClient(BaseClient):
     download_stats = FileTransferStats(name='download')
     # upload transfer stats
     upload_stats = FileTransferStats(name='upload')
+    # response time of the Automation calls, in seconds
+    latency_stats = LatencyStats()
+    # keep-alive connections shared by the openers of all the clients
+    connection_pool = ConnectionPool(CONNECTION_POOL_SIZE)
+    # operations of the servers, shared by the clients
+    operation_cache = OperationCache()
+    # number of ranges downloaded concurrently for the files from segmented_download_threshold bytes
+    download_segments = 1
+    segmented_download_threshold = SEGMENTED_DOWNLOAD_THRESHOLD
 
     @staticmethod
     def get_upload_rate_limit():
@@ -891,10 +934,12 @@ class BaseAutomationClient(BaseClient):
                                           url=self.server_url)
 
         # Build URL openers
-        self.opener = urllib2.build_opener(cookie_processor, proxy_handler)
+        self.opener = urllib2.build_opener(cookie_processor, proxy_handler,
+                                           *get_keep_alive_handlers(self.connection_pool))
         self.streaming_opener = urllib2.build_opener(cookie_processor,
                                                      proxy_handler,
-                                                     *get_handlers())
+                                                     *(get_handlers() + get_keep_alive_handlers(
+                                                         self.connection_pool, streaming=True)))
 
         # Set Proxy flag
         self.is_proxy = False
@@ -914,7 +959,12 @@ class BaseAutomationClient(BaseClient):
 
         self.fetch_api()
 
-    def fetch_api(self):
+    def fetch_api(self, use_cache=True):
+        if use_cache:
+            operations = self.operation_cache.get(self.server_url)
+            if operations is not None:
+                self._set_operations(operations, cached=True)
+                return
         base_error_message = (
                                  "Failed to connect to Nuxeo server %s"
                              ) % (self.server_url)
@@ -968,13 +1018,11 @@ class BaseAutomationClient(BaseClient):
                 msg = msg + ": " + e.msg
             e.msg = msg
             raise e
-        self.operations = {}
-        for operation in response["operations"]:
-            self.operations[operation['id']] = operation
-            op_aliases = operation.get('aliases')
-            if op_aliases:
-                for op_alias in op_aliases:
-                    self.operations[op_alias] = operation
+        self._set_operations(self.operation_cache.put(self.server_url, response["operations"]))
+
+    def _set_operations(self, operations, cached=False):
+        self.operations = operations
+        self._cached_operations = cached
 
         # Is event log id available in change summary?
         # See https://jira.nuxeo.com/browse/NXP-14826
@@ -1028,7 +1076,9 @@ class BaseAutomationClient(BaseClient):
         req = urllib2.Request(url, data, headers)
         timeout = self.timeout if timeout == -1 else timeout
         try:
+            tick = time.time()
             resp = self.opener.open(req, timeout=timeout)
+            BaseAutomationClient.latency_stats.update(time.time() - tick)
         except Exception as e:
             log_details = self._log_details(e)
             if isinstance(log_details, tuple):
@@ -1365,6 +1415,9 @@ class BaseAutomationClient(BaseClient):
         return list(self.cookie_jar) if self.cookie_jar is not None else []
 
     def _check_operation(self, command):
+        if command not in self.operations and self._cached_operations:
+            # Maybe deployed since the operations were cached
+            self.fetch_api(use_cache=False)
         if command not in self.operations:
             if command.startswith('NuxeoDrive.'):
                 raise AddonNotInstalled(
@@ -1483,6 +1536,10 @@ class BaseAutomationClient(BaseClient):
             yield r
 
     def do_get(self, url, file_out=None, digest=None, digest_algorithm=None):
+        """Download the content of url to file_out or in memory, checking it against digest when given
+
+        Return the content, file_out and the digest computed while downloading, None without digest.
+        """
         log.trace('Downloading file from %r to %r with digest=%s, digest_algorithm=%s', url, file_out, digest,
                   digest_algorithm)
         h = None
@@ -1516,27 +1573,37 @@ class BaseAutomationClient(BaseClient):
                 # filename = os.path.basename(file_out)
                 filename = os.path.basename(file_out.encode('utf-8'))
                 locker = self.unlock_path(file_out)
+                segmented = None
                 try:
                     with open(file_out, "wb") as f:
                         BaseAutomationClient.download_stats.start(total_size=total_size, filename=filename)
-                        while True:
+                        # Bytes to read from this response, all of them when not segmented
+                        remaining = None
+                        if self._use_segmented_download(response, total_size):
+                            f.truncate(total_size)
+                            segmented = SegmentedDownload(self.opener, url, headers, file_out, total_size,
+                                                          BaseAutomationClient.download_segments, self.blob_timeout,
+                                                          self.get_download_buffer(),
+                                                          BaseAutomationClient._consume_download_tokens)
+                            segmented.start()
+                            remaining = segmented.segments[0].end
+                            log.trace('Downloading %r in %d segments', file_out, len(segmented.segments))
+                        while remaining is None or remaining > 0:
                             # Check if synchronization thread was suspended
                             if self.check_suspended is not None:
                                 self.check_suspended('File download: %s'
                                                      % file_out)
 
-                            buffer_ = response.read(self.get_download_buffer())
+                            buffer_size = self.get_download_buffer()
+                            if remaining is not None:
+                                buffer_size = min(buffer_size, remaining)
+                            buffer_ = response.read(buffer_size)
                             if buffer_ == '':
                                 break
+                            if remaining is not None:
+                                remaining -= len(buffer_)
 
-                            if BaseAutomationClient.use_download_rate_limit():
-                                size = int(math.ceil(len(buffer_) / 1000.0))
-                                wait_time = BaseAutomationClient.download_token_bucket.consume(size)
-                                while wait_time > 0:
-                                    log.trace('waiting to download: %s sec [rate=%d]', wait_time,
-                                              BaseAutomationClient.download_token_bucket.get_fill_rate())
-                                    time.sleep(wait_time)
-                                    wait_time = BaseAutomationClient.download_token_bucket.consume(size)
+                            BaseAutomationClient._consume_download_tokens(len(buffer_))
 
                             if current_action:
                                 current_action.progress += len(buffer_)
@@ -1545,6 +1612,13 @@ class BaseAutomationClient(BaseClient):
                                 h.update(buffer_)
                                 if BaseAutomationClient.use_download_rate_limit():
                                     self.update_download_transfer_rate(len(buffer_))
+                    if remaining:
+                        raise IOError("Download of %s ended %d bytes early" % (url, remaining))
+                    if segmented is not None:
+                        # The rest of the first segment is not read
+                        response.close()
+                        self._wait_segments(segmented, file_out, h, current_action)
+                    actual_digest = None
                     if digest is not None:
                         actual_digest = h.hexdigest()
                         if digest != actual_digest:
@@ -1552,17 +1626,20 @@ class BaseAutomationClient(BaseClient):
                                 os.remove(file_out)
                             raise CorruptedFile("Corrupted file %r: expected digest = %s, actual digest = %s"
                                                 % (file_out, digest, actual_digest))
-                    return None, file_out
+                    return None, file_out, actual_digest
                 except Exception as e:
                     e.msg = 'error downloading file: ' + e.message
                     error = e
                     raise e
                 finally:
+                    if segmented is not None:
+                        segmented.cancel()
                     self.lock_path(file_out, locker)
                     if BaseAutomationClient.use_download_rate_limit():
                         self.update_download_transfer_rate(0)
             else:
                 result = response.read()
+                actual_digest = None
                 if h is not None:
                     h.update(result)
                     if digest is not None:
@@ -1570,7 +1647,7 @@ class BaseAutomationClient(BaseClient):
                         if digest != actual_digest:
                             raise CorruptedFile("Corrupted file: expected digest = %s, actual digest = %s"
                                                 % (digest, actual_digest))
-                return result, None
+                return result, None, actual_digest
         except urllib2.HTTPError as e:
             if e.code == 401 or e.code == 403:
                 raise Unauthorized(self.server_url, self.user_id, e.code)
@@ -1584,6 +1661,52 @@ class BaseAutomationClient(BaseClient):
                 e.msg = base_error_message + ": " + e.msg
             raise
 
+    def _use_segmented_download(self, response, total_size):
+        if (BaseAutomationClient.download_segments < 2 or total_size < self.segmented_download_threshold
+                or response.getcode() != 200):
+            return False
+        info = response.info()
+        # Ranges of the encoded content would not match its size
+        return (info.getheader('Accept-Ranges', '').lower() == 'bytes'
+                and info.getheader('Content-Encoding') is None)
+
+    def _wait_segments(self, segmented, file_out, h, current_action):
+        # Hash the segments after the first one in order, as soon as downloaded
+        def check():
+            if self.check_suspended is not None:
+                self.check_suspended('File download: %s' % file_out)
+            if current_action:
+                current_action.progress = segmented.segments[0].end + segmented.get_downloaded()
+
+        for segment in segmented.segments[1:]:
+            segmented.wait(segment, check=check)
+            if h is None:
+                continue
+            # Opened for each segment, a read ahead would give the next one before its download
+            with open(file_out, 'rb') as f:
+                f.seek(segment.start)
+                remaining = segment.end - segment.start
+                while remaining > 0:
+                    buffer_ = f.read(min(FILE_BUFFER_SIZE_NO_RATE_LIMIT, remaining))
+                    if buffer_ == '':
+                        break
+                    h.update(buffer_)
+                    remaining -= len(buffer_)
+        if current_action:
+            current_action.progress = segmented.segments[-1].end
+
+    @staticmethod
+    def _consume_download_tokens(size):
+        if not BaseAutomationClient.use_download_rate_limit():
+            return
+        size = int(math.ceil(size / 1000.0))
+        wait_time = BaseAutomationClient.download_token_bucket.consume(size)
+        while wait_time > 0:
+            log.trace('waiting to download: %s sec [rate=%d]', wait_time,
+                      BaseAutomationClient.download_token_bucket.get_fill_rate())
+            time.sleep(wait_time)
+            wait_time = BaseAutomationClient.download_token_bucket.consume(size)
+
     @staticmethod
     def get_download_buffer():
         rate = BaseAutomationClient.download_token_bucket.get_fill_rate()
@@ -0,0 +1,246 @@
+'''
+Keep-alive HTTP connections shared by the URL openers of the remote clients
+'''
+import errno
+import httplib
+import select
+import socket
+import urllib2
+from collections import defaultdict
+from threading import Lock
+from poster.streaminghttp import StreamingHTTPConnection
+if hasattr(httplib, 'HTTPS'):
+    from poster.streaminghttp import StreamingHTTPSConnection
+from nxdrive.logging_config import get_logger
+
+log = get_logger(__name__)
+
+# Errors of a connection closed by the server while idle in the pool
+STALE_CONNECTION_ERRORS = (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE)
+
+
+def is_dropped(connection):
+    # An idle connection is only readable once closed by the server
+    if connection.sock is None:
+        return True
+    try:
+        return len(select.select([connection.sock], [], [], 0)[0]) > 0
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class ConnectionPool(object):
+    '''
+    Idle connections by connection class and host, at most max_idle per host. A connection
+    only goes back to the pool once its response is fully read.
+    '''
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._lock = Lock()
+        self._idle = defaultdict(list)
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+        self.discarded = 0
+        self.stale = 0
+
+    def get(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if not connections:
+                return None
+            self.reused += 1
+            # Most recently used first, the less likely to have been closed by the server
+            return connections.pop()
+
+    def put(self, key, connection):
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(connection)
+                self.released += 1
+                return
+            self.discarded += 1
+        connection.close()
+
+    def discard(self, connection, stale=False):
+        with self._lock:
+            if stale:
+                self.stale += 1
+            else:
+                self.discarded += 1
+        connection.close()
+
+    def clear(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    def get_idle_count(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def get_metrics(self):
+        metrics = dict()
+        metrics["http_connections_created"] = self.created
+        metrics["http_connections_reused"] = self.reused
+        metrics["http_connections_released"] = self.released
+        metrics["http_connections_discarded"] = self.discarded
+        metrics["http_connections_stale"] = self.stale
+        metrics["http_connections_idle"] = self.get_idle_count()
+        return metrics
+
+
+class PooledResponseReader(object):
+    '''
+    Socket like reader of a response giving its connection back to the pool at the end of the body
+    '''
+
+    def __init__(self, pool, key, connection, response):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        if response.length == 0:
+            # Nothing to read, as for a 204 response
+            response.close()
+        self._release()
+
+    def recv(self, amt):
+        data = self._response.read(amt)
+        self._release()
+        return data
+
+    def _release(self):
+        if self._connection is None or not self._response.isclosed():
+            return
+        connection, self._connection = self._connection, None
+        if self._response.will_close:
+            self._pool.discard(connection)
+        else:
+            self._pool.put(self._key, connection)
+
+    def close(self):
+        if self._connection is None:
+            return
+        # Body left unread: the connection cannot be used for another request
+        connection, self._connection = self._connection, None
+        self._response.close()
+        self._pool.discard(connection)
+
+
+class KeepAliveHandlerMixin:
+
+    def _open_pooled(self, connection_class, req, **http_conn_args):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        if req._tunnel_host:
+            # Tunnelled through a proxy: one connection per request
+            return self.do_open(connection_class, req, **http_conn_args)
+        key = (connection_class, host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Connection'] = 'keep-alive'
+        connection = self._pool.get(key)
+        while connection is not None and is_dropped(connection):
+            log.trace("Idle connection to %s closed by the server", host)
+            self._pool.discard(connection, stale=True)
+            connection = self._pool.get(key)
+        if connection is not None:
+            sent = False
+            try:
+                self._request(connection, req, headers)
+                sent = True
+                return self._get_response(key, connection, req)
+            except (socket.error, httplib.HTTPException) as e:
+                if not self._is_stale(e) or not self._can_replay(req, sent):
+                    self._pool.discard(connection)
+                    if isinstance(e, socket.error):
+                        raise urllib2.URLError(e)
+                    raise
+                log.trace("Idle connection to %s closed by the server, opening a new one: %r", host, e)
+                self._pool.discard(connection, stale=True)
+        connection = connection_class(host, timeout=req.timeout, **http_conn_args)
+        with self._pool._lock:
+            self._pool.created += 1
+        try:
+            self._request(connection, req, headers)
+            return self._get_response(key, connection, req)
+        except (socket.error, httplib.HTTPException) as e:
+            self._pool.discard(connection)
+            if isinstance(e, socket.error):
+                raise urllib2.URLError(e)
+            raise
+
+    @staticmethod
+    def _is_stale(error):
+        # Only retry when the server closed the connection, not on a timeout of a running request
+        if isinstance(error, httplib.BadStatusLine):
+            return True
+        return (isinstance(error, socket.error) and not isinstance(error, socket.timeout)
+                and error.errno in STALE_CONNECTION_ERRORS)
+
+    @staticmethod
+    def _can_replay(req, sent):
+        # A streamed body cannot be sent again and a request received by the server must not run twice
+        if req.data is None:
+            return True
+        return isinstance(req.data, basestring) and not sent
+
+    @staticmethod
+    def _request(connection, req, headers):
+        if req.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            connection.timeout = req.timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(req.timeout)
+        connection.request(req.get_method(), req.get_selector(), req.data, headers)
+
+    def _get_response(self, key, connection, req):
+        response = connection.getresponse(buffering=True)
+        fp = socket._fileobject(PooledResponseReader(self._pool, key, connection, response), close=True)
+        resp = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+    # Ahead of the default and the streaming handlers
+    handler_order = urllib2.HTTPHandler.handler_order - 2
+
+    def __init__(self, pool, connection_class=httplib.HTTPConnection):
+        urllib2.HTTPHandler.__init__(self)
+        self._pool = pool
+        self._connection_class = connection_class
+
+    def http_open(self, req):
+        return self._open_pooled(self._connection_class, req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
+    handler_order = urllib2.HTTPSHandler.handler_order - 2
+
+    def __init__(self, pool, connection_class=httplib.HTTPSConnection):
+        urllib2.HTTPSHandler.__init__(self)
+        self._pool = pool
+        self._connection_class = connection_class
+
+    def https_open(self, req):
+        context = getattr(self, '_context', None)
+        if context is not None:
+            return self._open_pooled(self._connection_class, req, context=context)
+        return self._open_pooled(self._connection_class, req)
+
+
+def get_handlers(pool, streaming=False):
+    handlers = [KeepAliveHTTPHandler(pool, StreamingHTTPConnection if streaming else httplib.HTTPConnection)]
+    if hasattr(httplib, 'HTTPS'):
+        if streaming:
+            handlers.append(KeepAliveHTTPSHandler(pool, StreamingHTTPSConnection))
+        else:
+            handlers.append(KeepAliveHTTPSHandler(pool))
+    return handlers
@@ -460,6 +460,9 @@ class LocalClient(BaseClient):
                         check_suspended=self.check_suspended,
                         remote_ref=remote_ref, size=size)
 
+    def get_digest_func(self):
+        return self._digest_func
+
     def is_equal_digests(self, local_digest, remote_digest, local_path, remote_digest_algorithm=None):
         if local_digest == remote_digest:
             return True
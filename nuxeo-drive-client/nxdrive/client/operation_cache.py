@@ -0,0 +1,134 @@
+'''
+Automation operation registries shared by the clients of a server
+'''
+import json
+import os
+import time
+from threading import Lock
+from nxdrive.logging_config import get_logger
+
+log = get_logger(__name__)
+
+# Seconds before fetching again the operations of a server
+DEFAULT_OPERATION_CACHE_TTL = 3600
+
+
+def build_operations(listing):
+    # Operations by id and alias
+    operations = dict()
+    for operation in listing:
+        operations[operation['id']] = operation
+        op_aliases = operation.get('aliases')
+        if op_aliases:
+            for op_alias in op_aliases:
+                operations[op_alias] = operation
+    return operations
+
+
+class OperationCache(object):
+    '''
+    Operations of each server URL and version, kept ttl seconds. The version of a server is given
+    by its engines once known, a new version dropping the operations of the previous one. With a
+    path, the listings are saved to be reused by the next starts, only when they change. A ttl of 0
+    disables the cache.
+    '''
+
+    def __init__(self, ttl=DEFAULT_OPERATION_CACHE_TTL, path=None, clock=time.time):
+        self.ttl = ttl
+        self.path = path
+        self._clock = clock
+        self._lock = Lock()
+        # Server URL to version
+        self._versions = dict()
+        # (server URL, version) to (fetch time, listing, operations)
+        self._entries = dict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and ttl > 0:
+            self._load()
+
+    @staticmethod
+    def _get_url(server_url):
+        return server_url if server_url.endswith('/') else server_url + '/'
+
+    def set_server_version(self, server_url, version):
+        server_url = self._get_url(server_url)
+        with self._lock:
+            previous = self._versions.get(server_url)
+            if previous == version:
+                return
+            self._versions[server_url] = version
+            # An upgrade can bring new operations
+            self._entries.pop((server_url, previous), None)
+        self._save()
+
+    def get(self, server_url):
+        server_url = self._get_url(server_url)
+        with self._lock:
+            key = (server_url, self._versions.get(server_url))
+            entry = self._entries.get(key)
+            if entry is None or self._clock() - entry[0] >= self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def put(self, server_url, listing):
+        server_url = self._get_url(server_url)
+        operations = build_operations(listing)
+        if self.ttl <= 0:
+            return operations
+        with self._lock:
+            key = (server_url, self._versions.get(server_url))
+            previous = self._entries.get(key)
+            self._entries[key] = (self._clock(), listing, operations)
+        if previous is None or previous[1] != listing:
+            self._save()
+        return operations
+
+    def invalidate(self, server_url):
+        server_url = self._get_url(server_url)
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == server_url]
+            for key in keys:
+                del self._entries[key]
+        if keys:
+            self._save()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                content = json.load(f)
+            self._versions = content['versions']
+            for server_url, version, fetch_time, listing in content['entries']:
+                self._entries[(server_url, version)] = (fetch_time, listing, build_operations(listing))
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            log.debug("Cannot load the cached operations from %s: %r", self.path, e)
+            self._versions = dict()
+            self._entries = dict()
+
+    def _save(self):
+        if self.path is None or self.ttl <= 0:
+            return
+        with self._lock:
+            content = {
+                'versions': self._versions,
+                'entries': [[key[0], key[1], entry[0], entry[1]] for key, entry in self._entries.iteritems()],
+            }
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    json.dump(content, f)
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(tmp_path, self.path)
+            except (IOError, OSError) as e:
+                log.debug("Cannot save the cached operations to %s: %r", self.path, e)
+
+    def get_metrics(self):
+        metrics = dict()
+        metrics["operation_cache_hits"] = self.hits
+        metrics["operation_cache_misses"] = self.misses
+        return metrics
@@ -9,7 +9,9 @@ from nxdrive.client.common import NotFound
 from nxdrive.client.base_automation_client import BaseAutomationClient
 from nxdrive.client.base_automation_client import DOWNLOAD_TMP_FILE_PREFIX
 from nxdrive.client.base_automation_client import DOWNLOAD_TMP_FILE_SUFFIX
+from nxdrive.client.remote_info_cache import RemoteInfoCache
 from nxdrive.engine.activity import FileAction
+from nxdrive.utils import guess_digest_algorithm
 from threading import current_thread
 
 
@@ -34,7 +36,8 @@ BaseRemoteFileInfo = namedtuple('RemoteFileInfo', [
     'can_create_child',  # True is can create child
     'lock_owner',  # lock owner
     'lock_created',  # lock creation time
-    'can_scroll_descendants'  # True if the API to scroll through the descendants can be used
+    'can_scroll_descendants',  # True if the API to scroll through the descendants can be used
+    'size',  # size of the content of a file, None if not given by the server
 ])
 
 
@@ -51,6 +54,8 @@ class RemoteFileSystemClient(BaseAutomationClient):
 
     Uses the FileSystemItem API.
     """
+    # file infos received by the clients, to download their content
+    info_cache = RemoteInfoCache()
 
     #
     # API common with the local client API
@@ -83,7 +88,7 @@ class RemoteFileSystemClient(BaseAutomationClient):
         download_url = self.server_url + fs_item_info.download_url
         FileAction("Download", None,
                                         fs_item_info.name, 0)
-        content, _ = self.do_get(download_url, digest=fs_item_info.digest, digest_algorithm=fs_item_info.digest_algorithm)
+        content, _, _ = self.do_get(download_url, digest=fs_item_info.digest, digest_algorithm=fs_item_info.digest_algorithm)
         self.end_action()
         return content
 
@@ -94,6 +99,16 @@ class RemoteFileSystemClient(BaseAutomationClient):
         Raises NotFound if file system item with id fs_item_id
         cannot be found
         """
+        return self.stream_content_with_digest(fs_item_id, file_path, parent_fs_item_id=parent_fs_item_id,
+                                               fs_item_info=fs_item_info, file_out=file_out)[0]
+
+    def stream_content_with_digest(self, fs_item_id, file_path, parent_fs_item_id=None,
+                                   fs_item_info=None, file_out=None):
+        """Stream the binary content of a file system item to a tmp file
+
+        Return the tmp file, the digest algorithm and the digest of the content
+        computed while downloading it.
+        """
         if fs_item_info is None:
             fs_item_info = self.get_info(fs_item_id,
                                      parent_fs_item_id=parent_fs_item_id)
@@ -103,16 +118,24 @@ class RemoteFileSystemClient(BaseAutomationClient):
             file_dir = os.path.dirname(file_path)
             file_out = os.path.join(file_dir, DOWNLOAD_TMP_FILE_PREFIX + file_name
                                                     + str(current_thread().ident) + DOWNLOAD_TMP_FILE_SUFFIX)
+        digest_algorithm = fs_item_info.digest_algorithm
+        if digest_algorithm is None and fs_item_info.digest is not None:
+            digest_algorithm = guess_digest_algorithm(fs_item_info.digest)
         FileAction("Download", file_out, file_name, 0)
         try:
-            _, tmp_file = self.do_get(download_url, file_out=file_out, digest=fs_item_info.digest, digest_algorithm=fs_item_info.digest_algorithm)
+            _, tmp_file, digest = self.do_get(download_url, file_out=file_out, digest=fs_item_info.digest,
+                                              digest_algorithm=digest_algorithm)
         except Exception as e:
             if os.path.exists(file_out):
                 os.remove(file_out)
             raise e
         finally:
             self.end_action()
-        return tmp_file
+        return tmp_file, digest_algorithm, digest
+
+    def get_cached_info(self, fs_item_id, digest):
+        """Return the latest info received for the content of the given digest, None if not known"""
+        return self.info_cache.get(self.server_url, fs_item_id, digest)
 
     def get_children_info(self, fs_item_id):
         children = self.execute("NuxeoDrive.GetChildren", id=fs_item_id)
@@ -218,6 +241,7 @@ class RemoteFileSystemClient(BaseAutomationClient):
             digest_algorithm = None
             download_url = None
             can_update = False
+            size = None
             can_create_child = fs_item['canCreateChild']
             # Scroll API availability
             can_scroll = fs_item.get('canScrollDescendants')
@@ -234,6 +258,7 @@ class RemoteFileSystemClient(BaseAutomationClient):
                 digest_algorithm = None
             download_url = fs_item['downloadURL']
             can_update = fs_item['canUpdate']
+            size = fs_item.get('size')
             can_create_child = False
             can_scroll_descendants = False
 
@@ -252,11 +277,14 @@ class RemoteFileSystemClient(BaseAutomationClient):
         name = fs_item['name']
         if name is not None:
             name = unicodedata.normalize('NFC', name)
-        return RemoteFileInfo(
+        info = RemoteFileInfo(
             name, fs_item['id'], fs_item['parentId'],
             fs_item['path'], folderish, last_update, last_contributor, digest, digest_algorithm,
             download_url, fs_item['canRename'], fs_item['canDelete'],
-            can_update, can_create_child, lock_owner, lock_created, can_scroll_descendants)
+            can_update, can_create_child, lock_owner, lock_created, can_scroll_descendants, size)
+        if download_url is not None:
+            self.info_cache.put(self.server_url, info)
+        return info
 
     #
     # API specific to the remote file system client
@@ -0,0 +1,54 @@
+'''
+Latest file infos received from the servers, to download without fetching them again
+'''
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Seconds an info can be used to download its content
+DEFAULT_INFO_CACHE_TTL = 300
+DEFAULT_INFO_CACHE_SIZE = 10000
+
+
+class RemoteInfoCache(object):
+    '''
+    Infos of the files by server URL and id, the least recently received dropped above size. An info
+    is only given back for the digest of the content to download.
+    '''
+
+    def __init__(self, ttl=DEFAULT_INFO_CACHE_TTL, size=DEFAULT_INFO_CACHE_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.size = size
+        self._clock = clock
+        self._lock = Lock()
+        # (server URL, id) to (reception time, info)
+        self._infos = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, server_url, info):
+        key = (server_url, info.uid)
+        with self._lock:
+            self._infos.pop(key, None)
+            self._infos[key] = (self._clock(), info)
+            if len(self._infos) > self.size:
+                self._infos.popitem(last=False)
+
+    def get(self, server_url, uid, digest):
+        with self._lock:
+            entry = self._infos.get((server_url, uid))
+            if (entry is None or digest is None or entry[1].digest != digest
+                    or self._clock() - entry[0] >= self.ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def __len__(self):
+        return len(self._infos)
+
+    def get_metrics(self):
+        metrics = dict()
+        metrics["info_cache_hits"] = self.hits
+        metrics["info_cache_misses"] = self.misses
+        return metrics
@@ -0,0 +1,100 @@
+'''
+Download of the content of a file in ranges fetched concurrently
+'''
+import threading
+import urllib2
+from nxdrive.logging_config import get_logger
+
+log = get_logger(__name__)
+
+# Files from this size are downloaded in segments when enabled
+SEGMENTED_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+# Seconds between the checks of the waiting thread
+WAIT_INTERVAL = 0.5
+
+
+class Segment(object):
+
+    def __init__(self, start, end):
+        # Bytes from start to end excluded
+        self.start = start
+        self.end = end
+        self.downloaded = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return "Segment[%d-%d]" % (self.start, self.end)
+
+
+class SegmentedDownload(object):
+    '''
+    Download of the segments of a file but the first one to file_out, already sized, each on its
+    own thread with a Range request. The first segment is left to the caller, read from the
+    response of the initial request. consume is called with the size of each read buffer, to
+    respect the rate limit.
+    '''
+
+    def __init__(self, opener, url, headers, file_out, total_size, count, timeout, buffer_size, consume):
+        self._opener = opener
+        self._url = url
+        self._headers = headers
+        self._file_out = file_out
+        self._timeout = timeout
+        self._buffer_size = buffer_size
+        self._consume = consume
+        self._cancelled = False
+        self._threads = []
+        segment_size = -(-total_size // count)
+        self.segments = [Segment(start, min(start + segment_size, total_size))
+                         for start in range(0, total_size, segment_size)]
+
+    def start(self):
+        for segment in self.segments[1:]:
+            thread = threading.Thread(target=self._run, args=(segment,), name="Segment %d" % segment.start)
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self, segment):
+        try:
+            headers = dict(self._headers)
+            headers['Range'] = 'bytes=%d-%d' % (segment.start, segment.end - 1)
+            response = self._opener.open(urllib2.Request(self._url, headers=headers), timeout=self._timeout)
+            try:
+                if response.getcode() != 206:
+                    raise IOError("Range %r of %s answered with HTTP %d" % (segment, self._url, response.getcode()))
+                with open(self._file_out, 'r+b') as f:
+                    f.seek(segment.start)
+                    remaining = segment.end - segment.start
+                    while remaining > 0 and not self._cancelled:
+                        buffer_ = response.read(min(self._buffer_size, remaining))
+                        if buffer_ == '':
+                            raise IOError("Range %r of %s ended %d bytes early" % (segment, self._url, remaining))
+                        self._consume(len(buffer_))
+                        f.write(buffer_)
+                        remaining -= len(buffer_)
+                        segment.downloaded += len(buffer_)
+            finally:
+                response.close()
+        except Exception as e:
+            log.debug("Failed to download %r of %s: %r", segment, self._url, e)
+            segment.error = e
+        finally:
+            segment.done.set()
+
+    def wait(self, segment, check=None):
+        # check is called regularly until the segment is downloaded
+        while not segment.done.wait(WAIT_INTERVAL):
+            if check is not None:
+                check()
+        if segment.error is not None:
+            raise segment.error
+
+    def get_downloaded(self):
+        return sum(segment.downloaded for segment in self.segments[1:])
+
+    def cancel(self):
+        self._cancelled = True
+        for thread in self._threads:
+            thread.join()
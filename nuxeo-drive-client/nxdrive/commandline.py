@@ -13,6 +13,7 @@ except ImportError:
     debugger = pdb
 
 from nxdrive.client.common import DEFAULT_REPOSITORY_NAME
+from nxdrive.client.operation_cache import DEFAULT_OPERATION_CACHE_TTL
 from nxdrive.osi.daemon import daemonize
 from nxdrive.utils import default_nuxeo_drive_folder, normalized_path
 from nxdrive.logging_config import configure
@@ -181,6 +182,46 @@ class CliHandler(object):
             "--max-errors", default=self.default_max_errors, type=int,
             help="Maximum number of tries before giving up synchronization of"
             " a file in error.")
+        common_parser.add_argument(
+            "--file-scheduling", default='fifo', choices=('fifo', 'priority'),
+            help="Order of the file synchronization: fifo, or priority to"
+            " handle the small files before the large ones.")
+        common_parser.add_argument(
+            "--autoscale-processors", default=False, action="store_true",
+            help="Adapt the number of file processors to the queues, transfer rates"
+            " and server latency, up to the number given by the rate limits.")
+        common_parser.add_argument(
+            "--folder-creation-threads", default=0, type=int,
+            help="Number of threads creating ahead the remote folders of the"
+            " queued local folders, 0 to create them one by one.")
+        common_parser.add_argument(
+            "--download-segments", default=1, type=int,
+            help="Number of ranges of the large files downloaded concurrently"
+            " when the server accepts them, 1 to download them in one stream.")
+        common_parser.add_argument(
+            "--operation-cache-ttl", default=DEFAULT_OPERATION_CACHE_TTL, type=int,
+            help="Number of seconds the Automation operations of a server are"
+            " reused by the new clients, 0 to fetch them for each client.")
+        common_parser.add_argument(
+            "--db-journal-mode",
+            help="SQLite journal mode of the databases (WAL by default)."
+        )
+        common_parser.add_argument(
+            "--db-synchronous",
+            help="SQLite synchronous setting of the databases (NORMAL by default)."
+        )
+        common_parser.add_argument(
+            "--db-mmap-size", type=int,
+            help="SQLite memory map size in bytes of each database connection."
+        )
+        common_parser.add_argument(
+            "--db-cache-size", type=int,
+            help="SQLite page cache of each database connection, in pages or in KiB if negative."
+        )
+        common_parser.add_argument(
+            "--db-temp-store",
+            help="SQLite storage of the temporary tables (MEMORY by default)."
+        )
         common_parser.add_argument(
             "-v", "--version", action="version", version=self.get_version(),
             help="Print the current version of the Nuxeo Drive client."
@@ -635,13 +676,19 @@ class CliHandler(object):
             # List the test modules explicitly as recursive discovery is broken
             # when the app is frozen.
             argv += [
+                "nxdrive.tests.test_autoscaler",
                 "nxdrive.tests.test_bind_server",
                 "nxdrive.tests.test_blacklist_queue",
+                "nxdrive.tests.test_coalescing_queue",
                 "nxdrive.tests.test_commandline",
+                "nxdrive.tests.test_connection_pool",
                 "nxdrive.tests.test_conflicts",
                 "nxdrive.tests.test_copy",
+                "nxdrive.tests.test_dao_performance",
                 "nxdrive.tests.test_direct_edit",
+                "nxdrive.tests.test_download_digest",
                 "nxdrive.tests.test_encoding",
+                "nxdrive.tests.test_folder_pipeline",
                 "nxdrive.tests.test_engine_dao",
                 "nxdrive.tests.test_concurrent_synchronization",
                 "nxdrive.tests.test_integration_local_root_deletion",
@@ -657,6 +704,9 @@ class CliHandler(object):
                 "nxdrive.tests.test_manager_dao",
                 "nxdrive.tests.test_model_filters",
                 "nxdrive.tests.test_multiple_files",
+                "nxdrive.tests.test_operation_cache",
+                "nxdrive.tests.test_parent_scheduling",
+                "nxdrive.tests.test_path_registry",
                 "nxdrive.tests.test_permission_hierarchy",
                 "nxdrive.tests.test_readonly",
                 "nxdrive.tests.test_reinit_database",
@@ -664,14 +714,17 @@ class CliHandler(object):
                 "nxdrive.tests.test_remote_deletion",
                 "nxdrive.tests.test_remote_document_client",
                 "nxdrive.tests.test_remote_file_system_client",
+                "nxdrive.tests.test_remote_info_cache",
                 "nxdrive.tests.test_remote_move_and_rename",
                 "nxdrive.tests.test_report",
                 "nxdrive.tests.test_security_updates",
+                "nxdrive.tests.test_segmented_download",
                 "nxdrive.tests.test_shared_folders",
                 "nxdrive.tests.test_sync_roots",
                 "nxdrive.tests.test_synchronization",
                 "nxdrive.tests.test_synchronization_dedup",
                 "nxdrive.tests.test_synchronization_dedup_case_sensitive",
+                "nxdrive.tests.test_tracing",
                 "nxdrive.tests.test_translator",
                 "nxdrive.tests.test_updater",
                 "nxdrive.tests.test_utils",
@@ -679,6 +732,7 @@ class CliHandler(object):
                 "nxdrive.tests.test_volume",
                 "nxdrive.tests.test_watchers",
                 "nxdrive.tests.test_windows",
+                "nxdrive.tests.test_workers",
             ]
         else:
             argv.extend(['nxdrive.tests.' + test for test in os.environ["TESTS"].strip().split(",")])
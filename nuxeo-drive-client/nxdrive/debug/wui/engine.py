@@ -25,6 +25,7 @@ class DebugDriveApi(WebDriveApi):
     def _export_engine(self, engine):
         result = super(DebugDriveApi, self)._export_engine(engine)
         result["queue"]["metrics"] = engine.get_queue_manager().get_metrics()
+        result["queue"]["traces"] = engine.get_queue_manager().get_traces()
         result["queue"]["local_folder_enable"] = engine.get_queue_manager()._local_folder_enable
         result["queue"]["local_file_enable"] = engine.get_queue_manager()._local_file_enable
         result["queue"]["remote_folder_enable"] = engine.get_queue_manager()._remote_folder_enable
@@ -122,6 +123,15 @@ class DebugDriveApi(WebDriveApi):
             log.exception(e)
             return None
 
+    @QtCore.pyqtSlot(str, result=str)
+    def get_traces(self, uid):
+        try:
+            engine = self._get_engine(uid)
+            return self._json(engine.get_queue_manager().get_traces())
+        except Exception as e:
+            log.exception(e)
+            return None
+
     @QtCore.pyqtSlot(str)
     def resume_remote_watcher(self, uid):
         try:
@@ -15,7 +15,6 @@ from nxdrive.osi import parse_protocol_url
 import os
 import sys
 import urllib2
-from time import sleep
 import shutil
 from PyQt4.QtCore import pyqtSignal, pyqtSlot
 from Queue import Queue, Empty
@@ -73,10 +72,12 @@ class DirectEdit(Worker):
     def autolock_lock(self, src_path):
         ref = self._local_client.get_path(src_path)
         self._lock_queue.put((ref, 'lock'))
+        self.wakeup()
 
     def autolock_unlock(self, src_path):
         ref = self._local_client.get_path(src_path)
         self._lock_queue.put((ref, 'unlock'))
+        self.wakeup()
 
     def start(self):
         self._stop = False
@@ -314,6 +315,10 @@ class DirectEdit(Worker):
         dir_path = os.path.dirname(ref)
         self._local_client.set_remote_id(dir_path, unicode(digest), "nxdirecteditdigest")
         self._upload_queue.put(ref)
+        self.wakeup()
+
+    def _has_pending(self):
+        return not (self._lock_queue.empty() and self._upload_queue.empty() and self._watchdog_queue.empty())
 
     def _handle_queues(self):
         uploaded = False
@@ -418,7 +423,8 @@ class DirectEdit(Worker):
                 while (not self._watchdog_queue.empty()):
                     evt = self._watchdog_queue.get()
                     self.handle_watchdog_event(evt)
-                sleep(0.01)
+                # Retry the errors every second
+                self._wait(None if self._error_queue.is_empty() else 1, pending=self._has_pending)
         except ThreadInterrupt:
             raise
         finally:
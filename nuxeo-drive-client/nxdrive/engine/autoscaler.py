@@ -0,0 +1,97 @@
+'''
+Adaptive number of additional file processors
+'''
+from nxdrive.logging_config import get_logger
+
+log = get_logger(__name__)
+
+# Seconds between two samples
+AUTOSCALE_INTERVAL = 5
+# Consecutive samples agreeing before changing a pool size
+HYSTERESIS_SAMPLES = 3
+# Queued files per processor needed to grow a pool
+BACKLOG_PER_PROCESSOR = 2
+# Average server response time in seconds above which the pools shrink, grow only below half of it
+MAX_LATENCY = 2.0
+# Transfer rate of each concurrent transfer compared to the best single transfer rate: below
+# SATURATED_RATIO the bandwidth is saturated and the pool shrinks, it only grows above SCALING_RATIO
+SATURATED_RATIO = 0.5
+SCALING_RATIO = 0.8
+# Decay of the best transfer rate at each sample, to follow bandwidth changes
+PEAK_RATE_DECAY = 0.99
+
+
+class ProcessorAutoscaler(object):
+    '''
+    Size of the local, remote and generic pools of additional processors, between min_processors
+    and max_processors, from samples of their queue backlog, transfer rates and the server latency
+    '''
+    POOLS = ('local', 'remote', 'generic')
+
+    def __init__(self, max_processors, min_processors=(0, 0, 0)):
+        self.set_bounds(max_processors, min_processors)
+        self.decisions = 0
+        self.last_decision = ''
+
+    def set_bounds(self, max_processors, min_processors=(0, 0, 0)):
+        self._max = list(max_processors)
+        self._min = [min(low, high) for low, high in zip(min_processors, max_processors)]
+        # Start from the configured processors
+        self.processors = list(self._max)
+        # Consecutive grow (positive) or shrink (negative) votes
+        self._votes = [0] * len(self.POOLS)
+        self._peak_rates = [0.0] * len(self.POOLS)
+
+    def sample(self, backlogs, transfers, latency):
+        '''
+        backlogs: queued files of each pool
+        transfers: (total rate, number of transfers in progress) of each pool
+        latency: average server response time in seconds
+        Return the new processors if a pool changed, None otherwise
+        '''
+        changed = False
+        for i, pool in enumerate(self.POOLS):
+            vote = self._get_vote(i, backlogs[i], transfers[i], latency)
+            if vote > 0:
+                self._votes[i] = max(self._votes[i], 0) + 1
+            elif vote < 0:
+                self._votes[i] = min(self._votes[i], 0) - 1
+            else:
+                self._votes[i] = 0
+            if self._votes[i] >= HYSTERESIS_SAMPLES and self.processors[i] < self._max[i]:
+                self._decide(i, 1)
+                changed = True
+            elif self._votes[i] <= -HYSTERESIS_SAMPLES and self.processors[i] > self._min[i]:
+                self._decide(i, -1)
+                changed = True
+        return tuple(self.processors) if changed else None
+
+    def _get_vote(self, i, backlog, transfer, latency):
+        rate, count = transfer
+        efficiency = None
+        if count > 0:
+            per_transfer = float(rate) / count
+            self._peak_rates[i] = max(self._peak_rates[i] * PEAK_RATE_DECAY, per_transfer)
+            if self._peak_rates[i] > 0:
+                efficiency = per_transfer / self._peak_rates[i]
+        if latency > MAX_LATENCY or (count > 1 and efficiency is not None and efficiency < SATURATED_RATIO):
+            return -1
+        if (backlog > BACKLOG_PER_PROCESSOR * (self.processors[i] + 1) and latency <= MAX_LATENCY / 2
+                and (efficiency is None or efficiency >= SCALING_RATIO)):
+            return 1
+        return 0
+
+    def _decide(self, i, step):
+        self.processors[i] += step
+        self._votes[i] = 0
+        self.decisions += 1
+        self.last_decision = '%s %s to %d' % ('grow' if step > 0 else 'shrink', self.POOLS[i], self.processors[i])
+        log.debug('Processors autoscaler: %s', self.last_decision)
+
+    def get_metrics(self):
+        metrics = dict()
+        for i, pool in enumerate(self.POOLS):
+            metrics['autoscale_%s_processors' % pool] = self.processors[i]
+        metrics['autoscale_decisions'] = self.decisions
+        metrics['autoscale_last_decision'] = self.last_decision
+        return metrics
@@ -9,6 +9,8 @@ Updated on Feb 17, 2016
 '''
 
 from __future__ import division
+from heapq import heappush, heappop, heapify
+from itertools import count as counter
 from threading import RLock
 import time
 import random
@@ -65,17 +67,48 @@ class BlacklistItem(object):
 
 
 class BlacklistQueue(object):
+    '''
+    Items indexed by id, with a heap ordered by next try so the due check only looks at the due items.
+    Heap entries of removed or repushed items are skipped when they reach the top. Due items are
+    returned in push order, not in the order of their jittered next try.
+    '''
 
     def __init__(self, delay=DEFAULT_DELAY):
         self._queue = dict()
+        self._heap = []
+        # Push order of the due items, and never compare the items
+        self._sequence = counter()
         self._lock = RLock()
         self._delay = delay
 
+    def _schedule(self, item):
+        self._queue[item.get_id()] = item
+        heappush(self._heap, (item._next_try, next(self._sequence), item))
+        # Drop the stale entries once they are the majority
+        if len(self._heap) > 2 * len(self._queue) + 100:
+            self._heap = [entry for entry in self._heap if self._is_valid(entry)]
+            heapify(self._heap)
+
+    def _is_valid(self, entry):
+        next_try, _, item = entry
+        return self._queue.get(item.get_id()) is item and item._next_try == next_try
+
+    def _pop_due(self, cur_time):
+        # Heap entries of the due items in push order, removed from the queue
+        entries = []
+        while self._heap and cur_time > self._heap[0][0]:
+            entry = heappop(self._heap)
+            if self._is_valid(entry):
+                del self._queue[entry[2].get_id()]
+                entries.append(entry)
+        entries.sort(key=lambda entry: entry[1])
+        return entries
+
     def push(self, id_obj, obj, count=1):
         item = BlacklistItem(item_id=id_obj, item=obj, next_try=self._delay, count=count)
         self._lock.acquire()
         try:
-            self._queue[item.get_id()] = item
+            self._schedule(item)
             return item._next_interval
         finally:
             self._lock.release()
@@ -83,13 +116,13 @@ class BlacklistQueue(object):
     def repush(self, item, increase_wait=True):
         if not isinstance(item, BlacklistItem):
             raise Exception("Illegal argument")
-        if increase_wait:
-            item.increase()
-        else:
-            item.increase(next_try=self._delay)
         self._lock.acquire()
         try:
-            self._queue[item.get_id()] = item
+            if increase_wait:
+                item.increase()
+            else:
+                item.increase(next_try=self._delay)
+            self._schedule(item)
             return item._next_interval
         finally:
             self._lock.release()
@@ -109,10 +142,14 @@ class BlacklistQueue(object):
         cur_time = int(time.time())
         self._lock.acquire()
         try:
-            for item in self._queue.values():
-                if item.check(cur_time=cur_time):
-                    del self._queue[item.get_id()]
-                    return item
+            entries = self._pop_due(cur_time)
+            if not entries:
+                return None
+            # The other due items keep their entry, so their push order
+            for entry in entries[1:]:
+                self._queue[entry[2].get_id()] = entry[2]
+                heappush(self._heap, entry)
+            return entries[0][2]
         finally:
             self._lock.release()
 
@@ -120,19 +157,22 @@ class BlacklistQueue(object):
         cur_time = int(time.time())
         self._lock.acquire()
         try:
-            for item in self._queue.values():
-                if item.check(cur_time=cur_time):
-                    if remove:
-                        del self._queue[item.get_id()]
-                    yield item
+            items = [entry[2] for entry in self._pop_due(cur_time)]
+            if not remove:
+                for item in items:
+                    self._schedule(item)
         finally:
             self._lock.release()
+        for item in items:
+            yield item
 
     def remove(self, item_id):
+        # The heap entry is skipped once it is due
+        self._lock.acquire()
         try:
-            del self._queue[item_id]
-        except KeyError:
-            pass
+            return self._queue.pop(item_id, None)
+        finally:
+            self._lock.release()
 
     def is_empty(self):
         self._lock.acquire()
@@ -0,0 +1,110 @@
+'''
+Queues keeping a single pending entry per item id
+'''
+from Queue import Queue
+from collections import OrderedDict
+from itertools import islice
+from time import time
+
+
+class CoalescingQueue(Queue):
+    '''
+    FIFO of items having an id attribute: pushing an id already pending replaces the
+    pending item, the latest one wins but keeps the position of the first push
+    '''
+
+    def _init(self, maxsize):
+        self.queue = OrderedDict()
+        # Pending entries replaced by a newer push, here or in another queue
+        self.coalesced = 0
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _put(self, item):
+        if item.id in self.queue:
+            self.coalesced += 1
+        self.queue[item.id] = item
+
+    def _get(self):
+        return self.queue.popitem(last=False)[1]
+
+    def _remove(self, item_id):
+        return self.queue.pop(item_id, None) is not None
+
+    def remove(self, item_id):
+        # Used when the item moves to another queue
+        with self.mutex:
+            if not self._remove(item_id):
+                return False
+            self.coalesced += 1
+            return True
+
+    def items(self):
+        with self.mutex:
+            return self.queue.values()
+
+    def peek(self, count):
+        # First pushed items, left in the queue
+        with self.mutex:
+            return list(islice(self.queue.itervalues(), count))
+
+
+class LaneQueue(CoalescingQueue):
+    '''
+    CoalescingQueue serving the small items first. Items larger than threshold bytes wait in a
+    large lane, whose head is served first once it waited more than max_wait seconds.
+    Items of unknown size, like the ones not downloaded yet, go to the small lane.
+    '''
+
+    def __init__(self, get_size, threshold, max_wait, clock=time):
+        self._get_size = get_size
+        self._threshold = threshold
+        self._max_wait = max_wait
+        self._clock = clock
+        CoalescingQueue.__init__(self)
+
+    def _init(self, maxsize):
+        CoalescingQueue._init(self, maxsize)
+        # Item id to enqueue time
+        self._small = OrderedDict()
+        self._large = OrderedDict()
+
+    def _put(self, item):
+        if item.id not in self.queue:
+            size = self._get_size(item)
+            lane = self._large if size is not None and size > self._threshold else self._small
+            lane[item.id] = self._clock()
+        CoalescingQueue._put(self, item)
+
+    def _pop(self, lane):
+        item_id = lane.popitem(last=False)[0]
+        return self.queue.pop(item_id)
+
+    def _get(self):
+        if self._large and (not self._small
+                            or self._clock() - next(self._large.itervalues()) > self._max_wait):
+            return self._pop(self._large)
+        return self._pop(self._small)
+
+    def _remove(self, item_id):
+        self._small.pop(item_id, None)
+        self._large.pop(item_id, None)
+        return CoalescingQueue._remove(self, item_id)
+
+    def has_small(self):
+        with self.mutex:
+            return len(self._small) > 0
+
+    def get_small(self):
+        # Non blocking, for the processors reserved to the small items
+        with self.mutex:
+            if not self._small:
+                return None
+            item = self._pop(self._small)
+            self.not_full.notify()
+            return item
+
+    def get_lane_sizes(self):
+        with self.mutex:
+            return len(self._small), len(self._large)
@@ -1,14 +1,37 @@
 import sqlite3
 import os
 import inspect
+from bisect import bisect_right
+from thread import get_ident
 from threading import Lock, local, current_thread
 from datetime import datetime
+from time import time, sleep
 from nxdrive.logging_config import get_logger
 from PyQt4.QtCore import pyqtSignal, QObject
 log = get_logger(__name__)
 
 SCHEMA_VERSION = "schema_version"
 
+# Pragmas applied to every connection, can be changed with ConfigurationDAO.set_connection_profile
+DEFAULT_CONNECTION_PROFILE = {
+    # Readers dont wait for the writer and the writer dont wait for the readers
+    'journal_mode': 'WAL',
+    # Safe with WAL: a power loss can only rollback the last commits
+    'synchronous': 'NORMAL',
+    'mmap_size': 64 * 1024 * 1024,
+    # Negative value is a size in KiB
+    'cache_size': -8192,
+    'temp_store': 'MEMORY',
+    # Time in ms a statement waits for a database lock before failing
+    'busy_timeout': 5000,
+}
+
+CONNECTION_PROFILE_VALUES = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY'),
+}
+
 # Summary status from last known pair of states
 
 PAIR_STATES = {
@@ -76,61 +99,231 @@ def _get_remote_state_from_pair_state(pair_state):
 LOCAL_STATES_VALUES, REMOTE_STATES_VALUES, PAIR_STATES_VALUES = _get_states_values()
 
 
+def _get_sql_values(values):
+    return ', '.join("'%s'" % value for value in sorted(values))
+
+
+def _get_state_fix_expression(column, values, get_state):
+    # Keep a valid state, otherwise derive it from the pair state like _get_local_state_from_pair_state does
+    cases = ''.join(" WHEN '%s' THEN '%s'" % (pair_state, get_state(pair_state))
+                    for pair_state in sorted(PAIR_STATES_VALUES))
+    return "CASE WHEN %s IN (%s) THEN %s ELSE CASE pair_state%s ELSE 'unknown' END END" % (
+        column, _get_sql_values(values), column, cases)
+
+
+# Rows pushed to the queue manager between two releases of the lock on startup
+QUEUE_BOOTSTRAP_CHUNK_SIZE = 1000
+
+# Aggregates of the States table kept in StatesCounters by triggers, {0} is the row and {1} the error threshold
+STATE_COUNTERS = (
+    ('syncing', "{0}.error_count < {1} AND {0}.pair_state NOT IN ('synchronized', 'conflicted', 'unsynchronized')"),
+    ('errors', "{0}.error_count > {1}"),
+    ('conflicted', "{0}.pair_state = 'conflicted'"),
+    ('unsynchronized', "{0}.pair_state = 'unsynchronized'"),
+    ('synchronized', "{0}.pair_state = 'synchronized'"),
+    ('sync_files', "{0}.pair_state = 'synchronized' AND {0}.folderish = 0"),
+    ('sync_folders', "{0}.pair_state = 'synchronized' AND {0}.folderish = 1"),
+    ('sync_size', "CASE WHEN {0}.pair_state = 'synchronized' THEN {0}.size END"),
+)
+# Only an update of these columns can change a counter
+STATE_COUNTERS_COLUMNS = 'pair_state, error_count, folderish, size'
+STATE_COUNTERS_ERROR_THRESHOLD = 3
+# Seconds between two checks of the counters against the real aggregates
+STATE_COUNTERS_CHECK_INTERVAL = 3600
+
+
+def _get_counter_expression(expression, row):
+    return "IFNULL(" + expression.format(row, STATE_COUNTERS_ERROR_THRESHOLD) + ", 0)"
+
+
+# Backoff between the tries of a statement waiting for a database lock, up to the busy_timeout
+LOCK_RETRY_DELAY = 0.001
+LOCK_RETRY_MAX_DELAY = 0.1
+# Seconds between two compactions requested after a corruption error
+VACUUM_MIN_INTERVAL = 3600
+
+
+class DatabaseStats(object):
+    '''
+    Lock contention and compaction counters of one DAO
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.lock_retries = 0
+        self.lock_errors = 0
+        self.lock_wait_time = 0.0
+        self.vacuum_requests = 0
+        self.vacuums = 0
+        self.vacuum_needed = False
+        self.last_vacuum = None
+        self.counters_resets = 0
+
+    def locked(self, wait_time, retries, failed=False):
+        with self._lock:
+            self.lock_wait_time = self.lock_wait_time + wait_time
+            self.lock_retries = self.lock_retries + retries
+            if failed:
+                self.lock_errors = self.lock_errors + 1
+
+    def request_vacuum(self):
+        with self._lock:
+            self.vacuum_requests = self.vacuum_requests + 1
+            self.vacuum_needed = True
+
+    def vacuumed(self):
+        with self._lock:
+            self.vacuums = self.vacuums + 1
+            self.vacuum_needed = False
+            self.last_vacuum = time()
+
+    def is_vacuum_due(self):
+        with self._lock:
+            return self.vacuum_needed and (self.last_vacuum is None
+                                           or time() - self.last_vacuum >= VACUUM_MIN_INTERVAL)
+
+    def counters_reset(self):
+        with self._lock:
+            self.counters_resets = self.counters_resets + 1
+
+    def get_metrics(self):
+        metrics = dict()
+        metrics["db_lock_retries"] = self.lock_retries
+        metrics["db_lock_errors"] = self.lock_errors
+        metrics["db_lock_wait_time"] = int(self.lock_wait_time * 1000)
+        metrics["db_vacuum_requests"] = self.vacuum_requests
+        metrics["db_vacuums"] = self.vacuums
+        metrics["db_counters_resets"] = self.counters_resets
+        return metrics
+
+
+def _is_locked_error(error):
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+def _is_corruption_error(error):
+    message = str(error)
+    return 'malformed' in message or 'corrupt' in message or 'not a database' in message
+
+
+def _retry_locked(con, method, args, kwargs, statement=True):
+    # The connection has no busy handler so every wait for a database lock is done and counted here
+    retries = 0
+    wait_time = 0.0
+    while (1):
+        try:
+            result = method(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not _is_locked_error(e):
+                raise
+            timeout = con.busy_timeout - wait_time
+            if timeout <= 0:
+                if con.stats is not None:
+                    con.stats.locked(wait_time, retries, failed=True)
+                raise
+            delay = min(LOCK_RETRY_DELAY * 2 ** retries, LOCK_RETRY_MAX_DELAY, timeout)
+            retries += 1
+            # A statement that did not get its lock has nothing pending, the other threads can use the DAO
+            # meanwhile, unless a batch holds the DAO lock for its transaction
+            depth = 0
+            if statement and con.lock is not None and con.batch is None:
+                depth = con.lock.release_all()
+            start = time()
+            try:
+                sleep(delay)
+            finally:
+                wait_time = wait_time + time() - start
+                if depth:
+                    con.lock.restore(depth)
+            continue
+        if retries:
+            log.trace('Result returned after %d retries in %.3fs', retries, wait_time)
+            if con.stats is not None:
+                con.stats.locked(wait_time, retries)
+        return result
+
+
 class AutoRetryCursor(sqlite3.Cursor):
     def execute(self, *args, **kwargs):
-        count = 0
-        obj = None
-        while (1):
-            try:
-                count += 1
-                obj = super(AutoRetryCursor, self).execute(*args, **kwargs)
-                if count > 1:
-                    log.trace('Result returned from try #%d', count)
-                break
-            except sqlite3.OperationalError as e:
-                log.trace('Retry locked database #%d', count)
-                if count > 5:
-                    raise e
-            except sqlite3.DatabaseError as e:
-                log.trace('compact the database database')
-                self.connection.rollback()
-                self.connection.execute('VACUUM')
-                if count > 1:
-                    raise e
-        return obj
+        return self._execute(super(AutoRetryCursor, self).execute, args, kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._execute(super(AutoRetryCursor, self).executemany, args, kwargs)
+
+    def _execute(self, method, args, kwargs):
+        try:
+            return _retry_locked(self.connection, method, args, kwargs)
+        except sqlite3.IntegrityError:
+            # Only the statement failed, a rollback would also drop the writes of an open batch
+            raise
+        except sqlite3.DatabaseError as e:
+            if not _is_corruption_error(e):
+                raise
+            # Compacting here would block the caller thread, let the DAO do it later
+            log.trace('Database corruption error, request a compaction of the database: %r', e)
+            self.connection.rollback()
+            if self.connection.stats is not None:
+                self.connection.stats.request_vacuum()
+            raise
 
 
 class AutoRetryConnection(sqlite3.Connection):
+    stats = None
+    # Seconds a statement waits for a database lock
+    busy_timeout = 0
+    # DAO lock released while a statement waits
+    lock = None
+    # Batch writer with an open transaction on this connection
+    batch = None
+
     def cursor(self):
         return super(AutoRetryConnection, self).cursor(AutoRetryCursor)
 
+    def commit(self):
+        # The writes are pending, keep the DAO lock
+        _retry_locked(self, super(AutoRetryConnection, self).commit, (), {}, statement=False)
+
+    def rollback(self):
+        super(AutoRetryConnection, self).rollback()
+        if self.batch is not None:
+            self.batch.rolled_back()
+
 
 class CustomRow(sqlite3.Row):
+    # No instance dict, the overrides dict is only created on the first assignment
+    __slots__ = ('_custom',)
 
-    def __init__(self, arg1, arg2):
-        super(CustomRow, self).__init__(arg1, arg2)
-        self._custom = dict()
+    def __new__(cls, cursor, values):
+        row = super(CustomRow, cls).__new__(cls, cursor, values)
+        row._custom = None
+        return row
 
     def __getattr__(self, name):
-        if name in self._custom:
-            return self._custom[name]
+        custom = self._custom
+        if custom is not None and name in custom:
+            return custom[name]
         return self[name]
 
     def __setattr__(self, name, value):
         if name.startswith('_'):
-            super(CustomRow, self).__setattr__(name,value)
+            super(CustomRow, self).__setattr__(name, value)
         else:
+            if self._custom is None:
+                self._custom = dict()
             self._custom[name] = value
 
     def __delattr__(self, name):
         if name.startswith('_'):
-            super(CustomRow, self).__detattr__(name)
+            super(CustomRow, self).__delattr__(name)
+        elif self._custom is None or name not in self._custom:
+            raise AttributeError(name)
         else:
             del self._custom[name]
 
 
 class StateRow(CustomRow):
-    _custom = None
+    __slots__ = ()
 
     def is_readonly(self):
         if self.folderish:
@@ -154,6 +347,23 @@ class StateRow(CustomRow):
             self.pair_state)
 
 
+class FilterMatcher(object):
+    '''
+    Sorted filter paths, the ones under another filter are dropped so the only
+    candidate for a path is the closest lower filter
+    '''
+
+    def __init__(self, paths):
+        self._paths = []
+        for path in sorted(paths):
+            if not self._paths or not path.startswith(self._paths[-1]):
+                self._paths.append(path)
+
+    def match(self, path):
+        index = bisect_right(self._paths, path)
+        return index > 0 and path.startswith(self._paths[index - 1])
+
+
 class LogLock(object):
     def __init__(self):
         self._lock = Lock()
@@ -168,6 +378,54 @@ class LogLock(object):
         self._lock.release()
 
 
+class DAOLock(object):
+    '''
+    Reentrant lock of a DAO, that a statement waiting for a database lock releases meanwhile
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self):
+        if self._owner == get_ident():
+            self._depth = self._depth + 1
+            return
+        self._lock.acquire()
+        self._owner = get_ident()
+        self._depth = 1
+
+    def release(self):
+        if self._owner != get_ident():
+            raise RuntimeError("Cannot release a DAO lock not acquired")
+        self._depth = self._depth - 1
+        if self._depth == 0:
+            self._owner = None
+            self._lock.release()
+
+    def release_all(self):
+        # Return the depth to restore, 0 if the current thread does not hold the lock
+        if self._owner != get_ident():
+            return 0
+        depth = self._depth
+        self._depth = 0
+        self._owner = None
+        self._lock.release()
+        return depth
+
+    def restore(self, depth):
+        self._lock.acquire()
+        self._owner = get_ident()
+        self._depth = depth
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
 class FakeLock(object):
     def acquire(self):
         pass
@@ -175,11 +433,172 @@ class FakeLock(object):
     def release(self):
         pass
 
+    def release_all(self):
+        return 0
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class BatchWriter(object):
+    '''
+    Group the writes of one thread in a single transaction
+
+    Statements that dont need a result are buffered and executed with executemany,
+    the transaction is committed every max_size statements or max_delay seconds.
+    The DAO lock is held from the first statement executed until the commit so no
+    other thread can commit or rollback the batch. Queue pushes are delayed until
+    the rows they refer to are committed.
+    '''
+
+    def __init__(self, dao, max_size=1000, max_delay=1.0):
+        self._dao = dao
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.flushing = False
+        self._con = None
+        self._depth = 0
+        self._statements = []
+        self._callbacks = []
+        self._count = 0
+        self._last_flush = time()
+        self._metrics = dict()
+        self._metrics['batch_flushes'] = 0
+        self._metrics['batch_statements'] = 0
+        self._metrics['batch_rollbacks'] = 0
+
+    def __enter__(self):
+        self._depth = self._depth + 1
+        if self._depth == 1:
+            self._dao._set_batch(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth = self._depth - 1
+        if self._depth > 0:
+            return
+        try:
+            self.flush()
+        finally:
+            self._dao._set_batch(None)
+
+    def get_metrics(self):
+        return self._metrics.copy()
+
+    def has_pending(self):
+        return len(self._statements) > 0
+
+    def is_open(self):
+        return self._con is not None
+
+    def begin(self, con):
+        # Called with the DAO lock, keep it until the commit
+        if self._con is None:
+            self._dao._lock.acquire()
+            self._con = con
+            con.batch = self
+        if self._statements:
+            # Keep the statements order
+            self.execute_pending(con.cursor())
+
+    def _end(self):
+        con = self._con
+        if con is None:
+            return
+        self._con = None
+        con.batch = None
+        self._dao._lock.release()
+
+    def rolled_back(self):
+        # The rows written since the last commit are lost, so are their queue pushes
+        log.debug("Batch rolled back, dropping %d statements and %d queue pushes",
+                  sum(len(params) for _, params in self._statements), len(self._callbacks))
+        self._metrics['batch_rollbacks'] = self._metrics['batch_rollbacks'] + 1
+        self._statements = []
+        self._callbacks = []
+        self._count = 0
+        self._end()
+
+    def execute(self, query, params):
+        if self._statements and self._statements[-1][0] == query:
+            self._statements[-1][1].append(params)
+        else:
+            self._statements.append((query, [params]))
+        self._written()
+
+    def defer(self, callback, *args):
+        self._callbacks.append((callback, args))
+        self._written()
+
+    def _written(self):
+        self._count = self._count + 1
+        if self._count >= self.max_size or time() - self._last_flush >= self.max_delay:
+            self.flush()
+
+    def execute_pending(self, cursor):
+        statements = self._statements
+        self._statements = []
+        for query, params in statements:
+            cursor.executemany(query, params)
+            self._metrics['batch_statements'] = self._metrics['batch_statements'] + len(params)
+
+    def flush(self):
+        if self.flushing:
+            return
+        self.flushing = True
+        try:
+            self._dao._lock.acquire()
+            try:
+                con = self._dao._get_write_connection()
+                self.execute_pending(con.cursor())
+                con.commit()
+            finally:
+                self._end()
+                self._dao._lock.release()
+            self._metrics['batch_flushes'] = self._metrics['batch_flushes'] + 1
+            self._count = 0
+            self._last_flush = time()
+            callbacks = self._callbacks
+            self._callbacks = []
+            for callback, args in callbacks:
+                callback(*args)
+        finally:
+            self.flushing = False
+
 
 class ConfigurationDAO(QObject):
     '''
     classdocs
     '''
+    connection_profile = DEFAULT_CONNECTION_PROFILE.copy()
+
+    @staticmethod
+    def set_connection_profile(**kwargs):
+        profile = DEFAULT_CONNECTION_PROFILE.copy()
+        for name, value in kwargs.items():
+            if value is None:
+                continue
+            if name not in profile:
+                log.warn("Unknown database connection setting %s", name)
+                continue
+            # Pragmas cannot be bound so only accept known values
+            if name in CONNECTION_PROFILE_VALUES:
+                value = str(value).upper()
+                if value not in CONNECTION_PROFILE_VALUES[name]:
+                    log.warn("Invalid value %r for database connection setting %s", value, name)
+                    continue
+            else:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    log.warn("Invalid value %r for database connection setting %s", value, name)
+                    continue
+            profile[name] = value
+        log.debug("Database connection profile: %r", profile)
+        ConfigurationDAO.connection_profile = profile
 
     def __init__(self, db):
         '''
@@ -188,6 +607,8 @@ class ConfigurationDAO(QObject):
         super(ConfigurationDAO, self).__init__()
         log.debug("Create DAO on %s", db)
         self._db = db
+        self._batches = local()
+        self._stats = DatabaseStats()
         migrate = os.path.exists(self._db)
         # For testing purpose only should always be True
         self.share_connection = True
@@ -197,7 +618,8 @@ class ConfigurationDAO(QObject):
         self._tx_lock = Lock()
         # If we dont share connection no need to lock
         if self.share_connection:
-            self._lock = Lock()
+            # Reentrant as the batch writer can flush while a write is in progress
+            self._lock = DAOLock()
         else:
             self._lock = FakeLock()
         # Use to clean
@@ -226,6 +648,43 @@ class ConfigurationDAO(QObject):
     def get_db(self):
         return self._db
 
+    @property
+    def auto_commit(self):
+        # The batch writer of the current thread is in charge of the commits
+        return self._auto_commit and self._get_batch() is None
+
+    @auto_commit.setter
+    def auto_commit(self, value):
+        self._auto_commit = value
+
+    def batch_writer(self, max_size=1000, max_delay=1.0):
+        batch = getattr(self._batches, 'writer', None)
+        if batch is None:
+            batch = BatchWriter(self, max_size=max_size, max_delay=max_delay)
+        return batch
+
+    def flush_batch(self):
+        # Commit the open batch of the current thread, so its lock is not held while the thread waits
+        batch = self._get_batch()
+        if batch is not None:
+            batch.flush()
+
+    def _get_batch(self):
+        batch = getattr(self._batches, 'writer', None)
+        if batch is None or batch.flushing:
+            return None
+        return batch
+
+    def _set_batch(self, batch):
+        self._batches.writer = batch
+
+    def _after_commit(self, callback, *args):
+        batch = self._get_batch()
+        if batch is None:
+            callback(*args)
+        else:
+            batch.defer(callback, *args)
+
     def _migrate_table(self, cursor, name):
         # Add the last_transfer
         tmpname = name + 'Migration'
@@ -254,8 +713,6 @@ class ConfigurationDAO(QObject):
             self.update_config(SCHEMA_VERSION, 1)
 
     def _init_db(self, cursor):
-        # http://www.stevemcarthur.co.uk/blog/post/some-kind-of-disk-io-error-occurred-sqlite
-        cursor.execute("PRAGMA journal_mode = MEMORY")
         self._create_configuration_table(cursor)
 
     def _create_configuration_table(self, cursor):
@@ -264,12 +721,53 @@ class ConfigurationDAO(QObject):
     def _create_main_conn(self):
         log.debug("Create main connexion on %s (dir exists: %d / file exists: %d)",
                     self._db, os.path.exists(os.path.dirname(self._db)), os.path.exists(self._db))
-        self._conn = AutoRetryConnection(self._db, check_same_thread=False)
+        self._conn = self._create_connection(main=True)
         self._connections.append(self._conn)
 
+    def _create_connection(self, main=False):
+        # Dont check same thread for closing purpose, no busy handler as AutoRetryCursor waits for the locks
+        con = AutoRetryConnection(self._db, check_same_thread=False, timeout=0)
+        con.stats = self._stats
+        con.lock = self._lock
+        profile = self.connection_profile
+        con.busy_timeout = profile['busy_timeout'] / 1000.0
+        con.execute("PRAGMA busy_timeout = 0")
+        if main:
+            # The journal mode is kept by the database file in WAL, other modes are set on the main connection only
+            # MEMORY was used to avoid http://www.stevemcarthur.co.uk/blog/post/some-kind-of-disk-io-error-occurred-sqlite
+            mode = con.execute("PRAGMA journal_mode = " + profile['journal_mode']).fetchone()[0]
+            if mode.upper() != profile['journal_mode']:
+                log.warn("Cannot use journal mode %s on %s, using %s", profile['journal_mode'], self._db, mode)
+        con.execute("PRAGMA synchronous = " + profile['synchronous'])
+        con.execute("PRAGMA temp_store = " + profile['temp_store'])
+        con.execute("PRAGMA mmap_size = %d" % profile['mmap_size'])
+        con.execute("PRAGMA cache_size = %d" % profile['cache_size'])
+        return con
+
     def _log_trace(self, query):
         log.trace(query)
 
+    def get_metrics(self):
+        return self._stats.get_metrics()
+
+    def _vacuum(self, con):
+        log.trace("Vacuum sqlite")
+        con.execute("VACUUM")
+        self._stats.vacuumed()
+        log.trace("Vacuum sqlite finished")
+
+    def vacuum_if_needed(self):
+        if not self._stats.is_vacuum_due():
+            return False
+        self._lock.acquire()
+        try:
+            con = self._get_write_connection()
+            con.commit()
+            self._vacuum(con)
+        finally:
+            self._lock.release()
+        return True
+
     def dispose(self):
         log.debug("Disposing sqlite database %r", self.get_db())
         for con in self._connections:
@@ -288,11 +786,19 @@ class ConfigurationDAO(QObject):
         if self.share_connection or self.in_tx:
             if self._conn is None:
                 self._create_main_conn()
+            batch = self._get_batch()
+            if batch is not None:
+                batch.begin(self._conn)
             self._conn.row_factory = factory
             return self._conn
         return self._get_read_connection(factory)
 
     def _get_read_connection(self, factory=CustomRow):
+        batch = self._get_batch()
+        if batch is not None and (batch.is_open() or batch.has_pending()):
+            # Uncommitted writes are only visible from the write connection, the batch holds the lock on it
+            with self._lock:
+                return self._get_write_connection(factory)
         # If in transaction
         if self.in_tx is not None:
             if current_thread().ident != self.in_tx:
@@ -304,8 +810,7 @@ class ConfigurationDAO(QObject):
                 # Return the write connection
                 return self._conn
         if not hasattr(self._conns, '_conn') or self._conns._conn is None:
-            # Dont check same thread for closing purpose
-            self._conns._conn = AutoRetryConnection(self._db, check_same_thread=False)
+            self._conns._conn = self._create_connection()
             self._connections.append(self._conns._conn)
         self._conns._conn.row_factory = factory
             # Python3.3 feature
@@ -327,6 +832,10 @@ class ConfigurationDAO(QObject):
         self.in_tx = None
 
     def commit(self):
+        batch = self._get_batch()
+        if batch is not None:
+            batch.flush()
+            return
         if self.auto_commit:
             return
         self._lock.acquire()
@@ -528,20 +1037,24 @@ class EngineDAO(ConfigurationDAO):
         '''
         Constructor
         '''
-        self._filters = None
+        self._filters = FilterMatcher([])
         self._queue_manager = None
+        # Rows queued since the start of the queue bootstrap, their state read by the bootstrap is older
+        self._bootstrap_queued = None
+        # Check the counters on the first call to check_state_counters_if_needed
+        self._counters_check = 0
         super(EngineDAO, self).__init__(db)
-        self._filters = self.get_filters()
-        self._items_count = None
-        self._items_count = self.get_syncing_count()
+        self._filters = self._get_filter_matcher()
         self.reinit_processors()
 
     def get_schema_version(self):
-        return 3
+        return 5
 
     def _migrate_state(self, cursor):
         try:
             self._migrate_table(cursor, 'States')
+            # Indexes are dropped with the StatesMigration table
+            self._create_state_indexes(cursor)
         except sqlite3.IntegrityError:
             # If we cannot smoothly migrate harder migration
             cursor.execute("DROP TABLE if exists StatesMigration")
@@ -559,6 +1072,12 @@ class EngineDAO(ConfigurationDAO):
         if (version < 3):
             self._migrate_state(cursor)
             self.update_config(SCHEMA_VERSION, 3)
+        if (version < 4):
+            self._create_state_indexes(cursor)
+            self.update_config(SCHEMA_VERSION, 4)
+        if (version < 5):
+            self._create_state_counters(cursor)
+            self.update_config(SCHEMA_VERSION, 5)
 
     def _reinit_database(self):
         self.reinit_states()
@@ -583,6 +1102,81 @@ class EngineDAO(ConfigurationDAO):
           + "remote_can_create_child INTEGER, last_remote_modifier VARCHAR,"
           + "last_sync_date TIMESTAMP, error_count INTEGER DEFAULT (0), last_sync_error_date TIMESTAMP, last_error VARCHAR, last_error_details TEXT, version INTEGER DEFAULT (0), processor INTEGER DEFAULT (0), last_transfer VARCHAR, PRIMARY KEY (id),"
           +  "UNIQUE(remote_ref, remote_parent_ref), UNIQUE(remote_ref, local_path));")
+        self._create_state_indexes(cursor)
+        self._create_state_counters(cursor)
+
+    def _create_state_indexes(self, cursor):
+        # Secondary indexes for the hot queries, the UNIQUE constraints only cover remote_ref lookups
+        cursor.execute("CREATE INDEX if not exists StatesLocalPathIdx ON States(local_path)")
+        cursor.execute("CREATE INDEX if not exists StatesLocalParentPathIdx ON States(local_parent_path)")
+        cursor.execute("CREATE INDEX if not exists StatesRemoteParentRefIdx ON States(remote_parent_ref, remote_name)")
+        cursor.execute("CREATE INDEX if not exists StatesRemoteDigestIdx ON States(remote_digest)")
+        cursor.execute("CREATE INDEX if not exists StatesProcessorIdx ON States(processor)")
+        cursor.execute("CREATE INDEX if not exists StatesPairStateIdx ON States(pair_state, folderish, last_sync_date)")
+        cursor.execute("CREATE INDEX if not exists StatesErrorCountIdx ON States(error_count, pair_state)")
+        cursor.execute("CREATE INDEX if not exists StatesLastSyncDateIdx ON States(last_sync_date)")
+
+    def _create_state_counters(self, cursor):
+        cursor.execute("CREATE TABLE if not exists StatesCounters("
+                       + ', '.join([name + " INTEGER" for name, _ in STATE_COUNTERS]) + ")")
+        # Triggers follow a renamed table, always recreate them on the current States table
+        for trigger in ('StatesCountersInsert', 'StatesCountersUpdate', 'StatesCountersDelete'):
+            cursor.execute("DROP TRIGGER if exists " + trigger)
+        cursor.execute("CREATE TRIGGER StatesCountersInsert AFTER INSERT ON States BEGIN "
+                       + self._get_counters_update('NEW', None) + "; END")
+        cursor.execute("CREATE TRIGGER StatesCountersUpdate AFTER UPDATE OF " + STATE_COUNTERS_COLUMNS + " ON States"
+                       " BEGIN " + self._get_counters_update('NEW', 'OLD') + "; END")
+        cursor.execute("CREATE TRIGGER StatesCountersDelete AFTER DELETE ON States BEGIN "
+                       + self._get_counters_update(None, 'OLD') + "; END")
+        self._reset_state_counters(cursor)
+
+    def _get_counters_update(self, added, removed):
+        values = []
+        for name, expression in STATE_COUNTERS:
+            value = name + "=" + name
+            if added is not None:
+                value = value + " + " + _get_counter_expression(expression, added)
+            if removed is not None:
+                value = value + " - " + _get_counter_expression(expression, removed)
+            values.append(value)
+        return "UPDATE StatesCounters SET " + ', '.join(values)
+
+    def _get_counters_aggregates(self):
+        return ', '.join(["IFNULL(SUM(" + _get_counter_expression(expression, 'States') + "), 0)"
+                          for _, expression in STATE_COUNTERS])
+
+    def _reset_state_counters(self, cursor):
+        cursor.execute("DELETE FROM StatesCounters")
+        cursor.execute("INSERT INTO StatesCounters SELECT " + self._get_counters_aggregates() + " FROM States")
+
+    def check_state_counters(self):
+        self._lock.acquire()
+        try:
+            con = self._get_write_connection()
+            c = con.cursor()
+            expected = tuple(c.execute("SELECT " + self._get_counters_aggregates() + " FROM States").fetchone())
+            counters = c.execute("SELECT * FROM StatesCounters").fetchone()
+            self._counters_check = time()
+            if counters is not None and tuple(counters) == expected:
+                return True
+            log.warning("States counters %r differ from the aggregates %r, resetting them",
+                        counters if counters is None else tuple(counters), expected)
+            self._reset_state_counters(c)
+            if self.auto_commit:
+                con.commit()
+            self._stats.counters_reset()
+            return False
+        finally:
+            self._lock.release()
+
+    def check_state_counters_if_needed(self):
+        if time() - self._counters_check < STATE_COUNTERS_CHECK_INTERVAL:
+            return None
+        return self.check_state_counters()
+
+    def _get_state_counter(self, name):
+        c = self._get_read_connection().cursor()
+        return c.execute("SELECT " + name + " FROM StatesCounters").fetchone()[0]
 
     def _init_db(self, cursor):
         super(EngineDAO, self)._init_db(cursor)
@@ -596,24 +1190,51 @@ class EngineDAO(ConfigurationDAO):
         return super(EngineDAO, self)._get_read_connection(factory)
 
     def acquire_state(self, thread_id, row_id):
-        if self.acquire_processor(thread_id, row_id):
-            # Avoid any lock for this call by using the write connection
+        # Claim and read the row in the same transaction
+        self._lock.acquire()
+        try:
+            con = self._get_write_connection(factory=StateRow)
+            c = con.cursor()
             try:
-                return self.get_state_from_id(row_id, from_write=True)
+                c.execute("UPDATE States SET processor=? WHERE id=? AND (processor=0 OR processor=?)",
+                          (thread_id, row_id, thread_id))
+                state = None
+                if c.rowcount == 1:
+                    state = c.execute("SELECT * FROM States WHERE id=?", (row_id,)).fetchone()
+                if self.auto_commit:
+                    con.commit()
             except:
-                self.release_processor(thread_id)
+                if self.auto_commit:
+                    con.rollback()
                 raise
-        return None
+        finally:
+            self._lock.release()
+        if state is not None:
+            log.trace('Acquired processor %d for row %d', thread_id, row_id)
+        else:
+            log.trace("Couldn't acquire processor %d for row %d: either row does't exist or it is being processed",
+                      thread_id, row_id)
+        return state
 
-    def release_state(self, thread_id):
-        self.release_processor(thread_id)
+    def release_state(self, thread_id, row_id=None):
+        if row_id is None:
+            return self.release_processor(thread_id)
+        self._lock.acquire()
+        try:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute("UPDATE States SET processor=0 WHERE id=? AND processor=?", (row_id, thread_id))
+            if self.auto_commit:
+                con.commit()
+        finally:
+            self._lock.release()
+        return c.rowcount == 1
 
     def release_processor(self, processor_id):
         self._lock.acquire()
         try:
             con = self._get_write_connection()
             c = con.cursor()
-            # TO_REVIEW Might go back to primary key id
             c.execute("UPDATE States SET processor=0 WHERE processor=?", (processor_id,))
             if self.auto_commit:
                 con.commit()
@@ -660,9 +1281,7 @@ class EngineDAO(ConfigurationDAO):
             c = con.cursor()
             self._reinit_states(c)
             con.commit()
-            log.trace("Vacuum sqlite")
-            con.execute("VACUUM")
-            log.trace("Vacuum sqlite finished")
+            self._vacuum(con)
         finally:
             self._lock.release()
 
@@ -675,9 +1294,7 @@ class EngineDAO(ConfigurationDAO):
             c.execute("UPDATE States SET error_count=0, last_sync_error_date=NULL, last_error = NULL WHERE pair_state='synchronized'")
             if self.auto_commit:
                 con.commit()
-            log.trace("Vacuum sqlite")
-            con.execute("VACUUM")
-            log.trace("Vacuum sqlite finished")
+            self._vacuum(con)
         finally:
             self._lock.release()
 
@@ -689,7 +1306,8 @@ class EngineDAO(ConfigurationDAO):
             update = "UPDATE States SET remote_state='deleted', pair_state=?"
             c.execute(update + " WHERE id=?", ('remotely_deleted',doc_pair.id))
             if doc_pair.folderish:
-                c.execute(update + self._get_recursive_condition(doc_pair), ('parent_remotely_deleted',))
+                condition, params = self._get_recursive_condition(doc_pair)
+                c.execute(update + condition, ('parent_remotely_deleted',) + params)
             # Only queue parent
             self._queue_pair_state(doc_pair.id, doc_pair.folderish, 'remotely_deleted')
             if self.auto_commit:
@@ -712,7 +1330,8 @@ class EngineDAO(ConfigurationDAO):
             update = "UPDATE States SET local_state='deleted', pair_state=?"
             c.execute(update + " WHERE id=?", (current_state, doc_pair.id))
             if doc_pair.folderish:
-                c.execute(update + self._get_recursive_condition(doc_pair), ('parent_locally_deleted',))
+                condition, params = self._get_recursive_condition(doc_pair)
+                c.execute(update + condition, ('parent_locally_deleted',) + params)
             if self.auto_commit:
                 con.commit()
         finally:
@@ -738,10 +1357,9 @@ class EngineDAO(ConfigurationDAO):
             parent = c.execute("SELECT * FROM States WHERE local_path=?", (parent_path,)).fetchone()
             # Dont queue if parent is not yet created
             if (parent is None and parent_path == '') or (parent is not None and parent.pair_state != "locally_created"):
-                self._queue_pair_state(row_id, info.folderish, pair_state)
+                self._queue_pair_state(row_id, info.folderish, pair_state, size=info.size)
             if self.auto_commit:
                 con.commit()
-            self._items_count = self._items_count + 1
         finally:
             self._lock.release()
         return row_id
@@ -759,55 +1377,76 @@ class EngineDAO(ConfigurationDAO):
         return "pair_state != 'synchronized' AND pair_state != 'unsynchronized'"
 
     def register_queue_manager(self, manager):
-        # Prevent any update while init queue
         self._lock.acquire()
-        con = None
         try:
             self._queue_manager = manager
-            con = self._get_read_connection(factory=StateRow)
-            con.text_factory = str
-            c = con.cursor()
-            # Order by path to be sure to process parents before childs
-            pairs = c.execute("SELECT * FROM States WHERE " + self._get_to_sync_condition() + " ORDER BY local_path ASC").fetchall()
-            folders = dict()
-            for pair in pairs:
-                self._validate_states(pair)
-                # Add all the folders
-                if pair.folderish:
-                    folders[pair.local_path] = True
-                if not pair.local_parent_path in folders:
-                    self._queue_manager.push_ref(pair.id, pair.folderish, pair.pair_state)
-        # Dont block everything if queue manager fail
-        # TODO As the error should be fatal not sure we need this
+            self._bootstrap_queued = set()
+            self._validate_states()
         finally:
-            con.text_factory = unicode
             self._lock.release()
+        con = self._get_read_connection()
+        c = con.cursor()
+        # Only the QueueItem columns, as tuples
+        c.row_factory = None
+        con.text_factory = str
+        try:
+            # Order by path to be sure to process parents before childs, streamed by the local_path index
+            c.execute("SELECT id, folderish, CASE WHEN pair_state IN (" + _get_sql_values(PAIR_STATES_VALUES) + ")"
+                      " THEN pair_state ELSE 'unknown' END, local_path, local_parent_path, size FROM States"
+                      " WHERE " + self._get_to_sync_condition() + " ORDER BY local_path ASC")
+            folders = set()
+            while True:
+                # Let the writers go between two chunks
+                self._lock.acquire()
+                try:
+                    pairs = c.fetchmany(QUEUE_BOOTSTRAP_CHUNK_SIZE)
+                    for row_id, folderish, pair_state, local_path, local_parent_path, size in pairs:
+                        # Add all the folders
+                        if folderish:
+                            folders.add(local_path)
+                        if local_parent_path not in folders and row_id not in self._bootstrap_queued:
+                            self._queue_manager.push_ref(row_id, folderish, pair_state, size=size)
+                finally:
+                    self._lock.release()
+                if len(pairs) < QUEUE_BOOTSTRAP_CHUNK_SIZE:
+                    break
+        finally:
+            self._bootstrap_queued = None
+            c.close()
+            con.text_factory = unicode
 
-    def _validate_states(self, state):
-        if state.pair_state not in PAIR_STATES_VALUES:
-            log.error('pair state \'%s\' is not valid', state.pair_state)
-            state.pair_state = 'unknown'
-
-        state_row = self.get_state_from_id(state.id)
-        if state_row.local_state not in LOCAL_STATES_VALUES:
-            log.error('local state \'%s\' is not valid', state_row.local_state)
-            state_row.local_state = _get_local_state_from_pair_state(state.pair_state)
-            self._fix_local_state(state_row, state_row.local_state)
-
-        if state_row.remote_state not in REMOTE_STATES_VALUES:
-            log.error('remote state \'%s\' is not valid', state_row.remote_state)
-            state_row.remote_state = _get_remote_state_from_pair_state(state.pair_state)
-            self._fix_remote_state(state_row, state_row.remote_state)
+    def _validate_states(self):
+        con = self._get_write_connection()
+        c = con.cursor()
+        condition = " WHERE " + self._get_to_sync_condition()
+        invalid = c.execute("SELECT COUNT(*) FROM States" + condition + " AND pair_state NOT IN ("
+                            + _get_sql_values(PAIR_STATES_VALUES) + ")").fetchone()[0]
+        if invalid:
+            log.error('%d pair states are not valid', invalid)
+        c.execute("UPDATE States SET local_state=" + _get_state_fix_expression('local_state', LOCAL_STATES_VALUES,
+                                                                                _get_local_state_from_pair_state)
+                  + ", remote_state=" + _get_state_fix_expression('remote_state', REMOTE_STATES_VALUES,
+                                                                  _get_remote_state_from_pair_state)
+                  + condition + " AND (local_state IS NULL OR local_state NOT IN ("
+                  + _get_sql_values(LOCAL_STATES_VALUES) + ") OR remote_state IS NULL OR remote_state NOT IN ("
+                  + _get_sql_values(REMOTE_STATES_VALUES) + "))")
+        if c.rowcount > 0:
+            log.error('%d local or remote states were not valid', c.rowcount)
+        if self.auto_commit:
+            con.commit()
 
-    def _queue_pair_state(self, row_id, folderish, pair_state, pair=None):
+    def _queue_pair_state(self, row_id, folderish, pair_state, pair=None, size=None):
+        bootstrap_queued = self._bootstrap_queued
+        if bootstrap_queued is not None:
+            bootstrap_queued.add(row_id)
         if (self._queue_manager is not None
              and pair_state != 'synchronized' and pair_state != 'unsynchronized'):
             if pair_state == 'conflicted':
                 log.trace("Emit newConflict with: %r, pair=%r", row_id, pair)
-                self.newConflict.emit(row_id)
+                self._after_commit(self.newConflict.emit, row_id)
             else:
                 log.trace("Push to queue: %s, pair=%r", pair_state, pair)
-                self._queue_manager.push_ref(row_id, folderish, pair_state)
+                self._after_commit(self._queue_manager.push_ref, row_id, folderish, pair_state, size)
         else:
             log.trace("Will not push pair: %s, pair=%r", pair_state, pair)
         return
@@ -815,7 +1454,27 @@ class EngineDAO(ConfigurationDAO):
     def _get_pair_state(self, row):
         return PAIR_STATES.get((row.local_state, row.remote_state))
 
+    def _queue_local_state(self, cursor, row_id, parent_path, folderish, pair_state, pair=None, size=None):
+        parent = cursor.execute("SELECT * FROM States WHERE local_path=?", (parent_path,)).fetchone()
+        # Dont queue if parent is not yet created
+        if (parent is None and parent_path == '') or (parent is not None and parent.pair_state != "locally_created"):
+            self._queue_pair_state(row_id, folderish, pair_state, pair=pair, size=size)
+
+    def _queue_remote_state(self, cursor, row_id, parent_uid, folderish, pair_state, size=None):
+        # Check if parent is not in creation
+        parent = cursor.execute("SELECT * FROM States WHERE remote_ref=?", (parent_uid,)).fetchone()
+        # Parent can be None if the parent is filtered
+        if (parent is not None and parent.pair_state != "remotely_created") or parent is None:
+            self._queue_pair_state(row_id, folderish, pair_state, size=size)
+
+    def _queue_after_batch(self, queue_method, *args):
+        queue_method(self._get_read_connection().cursor(), *args)
+
     def update_last_transfer(self, row_id, transfer):
+        batch = self._get_batch()
+        if batch is not None:
+            batch.execute("UPDATE States SET last_transfer=? WHERE id=?", (transfer, row_id))
+            return
         self._lock.acquire()
         try:
             con = self._get_write_connection()
@@ -834,55 +1493,30 @@ class EngineDAO(ConfigurationDAO):
             version = ', version=version+1'
             log.trace('Increasing version to %d for pair %r', row.version + 1, row)
         parent_path = os.path.dirname(info.path)
+        query = ("UPDATE States SET last_local_updated=?, local_digest=?, local_path=?, local_parent_path=?, local_name=?,"
+                 + "local_state=?, size=?, remote_state=?, pair_state=?" + version + " WHERE id=?")
+        params = (info.last_modification_time, row.local_digest, info.path, parent_path, os.path.basename(info.path),
+                  row.local_state, info.size, row.remote_state, pair_state, row.id)
+        batch = self._get_batch()
+        if batch is not None:
+            batch.execute(query, params)
+            if queue:
+                batch.defer(self._queue_after_batch, self._queue_local_state, row.id, parent_path, info.folderish,
+                            pair_state, row, info.size)
+            return
         self._lock.acquire()
         try:
             con = self._get_write_connection()
             c = con.cursor()
             # Should not update this
-            c.execute("UPDATE States SET last_local_updated=?, local_digest=?, local_path=?, local_parent_path=?, local_name=?,"
-                      + "local_state=?, size=?, remote_state=?, pair_state=?" + version +
-                      " WHERE id=?", (info.last_modification_time, row.local_digest, info.path, parent_path,
-                                        os.path.basename(info.path), row.local_state, info.size, row.remote_state,
-                                        pair_state, row.id))
+            c.execute(query, params)
             if queue:
-                parent = c.execute("SELECT * FROM States WHERE local_path=?", (parent_path,)).fetchone()
-                # Dont queue if parent is not yet created
-                if (parent is None and parent_path == '') or (parent is not None and parent.pair_state != "locally_created"):
-                    self._queue_pair_state(row.id, info.folderish, pair_state, pair=row)
+                self._queue_local_state(c, row.id, parent_path, info.folderish, pair_state, pair=row, size=info.size)
             if self.auto_commit:
                 con.commit()
         finally:
             self._lock.release()
 
-    def _fix_local_state(self, row, local_state, lock=False):
-        log.trace('Updating local state for row = %r with state = %r', row, local_state)
-        if lock:
-            self._lock.acquire()
-        try:
-            con = self._get_write_connection()
-            c = con.cursor()
-            c.execute("UPDATE States SET local_state=? WHERE id=?", (local_state, row.id))
-            if self.auto_commit:
-                con.commit()
-        finally:
-            if lock:
-                self._lock.release()
-
-    def _fix_remote_state(self, row, remote_state, lock=False):
-        log.trace('Updating local state for row = %r with state = %r', row, remote_state)
-        if lock:
-            self._lock.acquire()
-        try:
-            con = self._get_write_connection()
-            c = con.cursor()
-            # Should not update this
-            c.execute("UPDATE States SET remote_state=? WHERE id=?", (remote_state, row.id))
-            if self.auto_commit:
-                con.commit()
-        finally:
-            if lock:
-                self._lock.release()
-
     def update_local_modification_time(self, row, info):
         self.update_local_state(row, info, versionned=False, queue=False)
 
@@ -907,29 +1541,28 @@ class EngineDAO(ConfigurationDAO):
         return c.execute("SELECT * FROM States WHERE remote_parent_ref=? AND remote_state='created' AND local_state='unknown'", (ref,)).fetchall()
 
     def get_unsynchronized_count(self):
-        return self.get_count("pair_state='unsynchronized'")
+        return self._get_state_counter('unsynchronized')
 
     def get_conflict_count(self):
-        return self.get_count("pair_state='conflicted'")
+        return self._get_state_counter('conflicted')
 
-    def get_error_count(self, threshold=3):
-        return self.get_count("error_count > " + str(threshold))
+    def get_error_count(self, threshold=STATE_COUNTERS_ERROR_THRESHOLD):
+        if threshold != STATE_COUNTERS_ERROR_THRESHOLD:
+            return self.get_count("error_count > " + str(threshold))
+        return self._get_state_counter('errors')
 
-    def get_syncing_count(self, threshold=3):
-        query = "pair_state!='synchronized' AND pair_state!='conflicted' AND pair_state!='unsynchronized' AND error_count < " + str(threshold)
-        count = self.get_count(query)
-        if self._items_count is not None and count != self._items_count:
-            log.trace("Cache Syncing count incorrect should be %d was %d", count, self._items_count)
-            self._items_count = count
-        return count
+    def get_syncing_count(self, threshold=STATE_COUNTERS_ERROR_THRESHOLD):
+        if threshold != STATE_COUNTERS_ERROR_THRESHOLD:
+            return self.get_count("error_count < " + str(threshold) +
+                                  " AND pair_state NOT IN ('synchronized', 'conflicted', 'unsynchronized')")
+        return self._get_state_counter('syncing')
 
     def get_sync_count(self, filetype=None):
-        query = "pair_state='synchronized'"
         if filetype == "file":
-            query = query + " AND folderish=0"
+            return self._get_state_counter('sync_files')
         elif filetype == "folder":
-            query = query + " AND folderish=1"
-        return self.get_count(query)
+            return self._get_state_counter('sync_folders')
+        return self._get_state_counter('synchronized')
 
     def get_count(self, condition=None):
         query = "SELECT COUNT(*) as count FROM States"
@@ -939,8 +1572,7 @@ class EngineDAO(ConfigurationDAO):
         return c.execute(query).fetchone().count
 
     def get_global_size(self):
-        c = self._get_read_connection(factory=StateRow).cursor()
-        return c.execute("SELECT SUM(size) as sum FROM States WHERE pair_state='synchronized'").fetchone().sum
+        return self._get_state_counter('sync_size')
 
     def get_unsynchronizeds(self):
         c = self._get_read_connection(factory=StateRow).cursor()
@@ -1002,8 +1634,11 @@ class EngineDAO(ConfigurationDAO):
         return state
 
     def _get_recursive_condition(self, doc_pair):
-        return (" WHERE local_parent_path LIKE '" + self._escape(doc_pair.local_path) + "/%'"
-                    + " OR local_parent_path = '" + self._escape(doc_pair.local_path) + "'")
+        # Use a range instead of LIKE 'path/%' so the local_parent_path index is used,
+        # as '0' follows '/' every descendant path is between 'path/' and 'path0'
+        path = doc_pair.local_path
+        return (" WHERE local_parent_path = ? OR (local_parent_path >= ? AND local_parent_path < ?)",
+                (path, path + '/', path + '0'))
 
     def update_remote_parent_path(self, doc_pair, new_path):
         self._lock.acquire()
@@ -1012,11 +1647,11 @@ class EngineDAO(ConfigurationDAO):
             c = con.cursor()
             if doc_pair.folderish:
                 remote_path = doc_pair.remote_parent_path + "/" + doc_pair.remote_ref
-                query = "UPDATE States SET remote_parent_path='%s/%s' || substr(remote_parent_path,%d)" % (
-                    self._escape(new_path), self._escape(doc_pair.remote_ref), len(remote_path) + 1)
-                query = query + self._get_recursive_condition(doc_pair)
-                log.trace("Update remote_parent_path: " + query)
-                c.execute(query)
+                condition, params = self._get_recursive_condition(doc_pair)
+                query = "UPDATE States SET remote_parent_path=? || substr(remote_parent_path,?)" + condition
+                params = (new_path + "/" + doc_pair.remote_ref, len(remote_path) + 1) + params
+                log.trace("Update remote_parent_path: %s %r", query, params)
+                c.execute(query, params)
             c.execute("UPDATE States SET remote_parent_path=? WHERE id=?", (new_path, doc_pair.id))
             if self.auto_commit:
                 con.commit()
@@ -1042,13 +1677,13 @@ class EngineDAO(ConfigurationDAO):
             if doc_pair.folderish:
                 if new_path == '/':
                     new_path = ''
-                escaped_new_path = self._escape(new_path)
-                escaped_new_name = self._escape(new_name)
-                query = ("UPDATE States SET local_parent_path='%s/%s' || substr(local_parent_path,%d), local_path='%s/%s' || substr(local_path,%d)" %
-                         (escaped_new_path, escaped_new_name, len(doc_pair.local_path) + 1,
-                          escaped_new_path, escaped_new_name, len(doc_pair.local_path)+1))
-                query = query + self._get_recursive_condition(doc_pair)
-                c.execute(query)
+                new_local_path = new_path + '/' + new_name
+                condition, params = self._get_recursive_condition(doc_pair)
+                query = ("UPDATE States SET local_parent_path=? || substr(local_parent_path,?),"
+                         + " local_path=? || substr(local_path,?)" + condition)
+                params = (new_local_path, len(doc_pair.local_path) + 1,
+                          new_local_path, len(doc_pair.local_path) + 1) + params
+                c.execute(query, params)
             # Dont need to update the path as it is refresh later
             c.execute("UPDATE States SET local_parent_path=? WHERE id=?", (new_path, doc_pair.id))
             if self.auto_commit:
@@ -1064,7 +1699,8 @@ class EngineDAO(ConfigurationDAO):
             update = "UPDATE States SET local_digest=NULL, last_local_updated=NULL, local_name=NULL, remote_state='deleted', pair_state='remotely_deleted'"
             c.execute(update + " WHERE id=?", (doc_pair.id,))
             if doc_pair.folderish:
-                c.execute(update + self._get_recursive_condition(doc_pair))
+                condition, params = self._get_recursive_condition(doc_pair)
+                c.execute(update + condition, params)
             if self.auto_commit:
                 con.commit()
             self._queue_pair_state(doc_pair.id, doc_pair.folderish, doc_pair.pair_state)
@@ -1077,9 +1713,10 @@ class EngineDAO(ConfigurationDAO):
             con = self._get_write_connection()
             c = con.cursor()
             update = "UPDATE States SET local_digest=NULL, last_local_updated=NULL, local_name=NULL, remote_state='created', pair_state='remotely_created'"
-            c.execute(update + " WHERE id=" + str(doc_pair.id))
+            c.execute(update + " WHERE id=?", (doc_pair.id,))
             if doc_pair.folderish:
-                c.execute(update + self._get_recursive_condition(doc_pair))
+                condition, params = self._get_recursive_condition(doc_pair)
+                c.execute(update + condition, params)
             if self.auto_commit:
                 con.commit()
             self._queue_pair_state(doc_pair.id, doc_pair.folderish, doc_pair.pair_state)
@@ -1092,9 +1729,10 @@ class EngineDAO(ConfigurationDAO):
             con = self._get_write_connection()
             c = con.cursor()
             update = "UPDATE States SET remote_digest=NULL, remote_ref=NULL, remote_parent_ref=NULL, remote_parent_path=NULL, last_remote_updated=NULL, remote_name=NULL, remote_state='unknown', local_state='created', pair_state='locally_created'"
-            c.execute(update + " WHERE id=" + str(doc_pair.id))
+            c.execute(update + " WHERE id=?", (doc_pair.id,))
             if doc_pair.folderish:
-                c.execute(update + self._get_recursive_condition(doc_pair))
+                condition, params = self._get_recursive_condition(doc_pair)
+                c.execute(update + condition, params)
             if self.auto_commit:
                 con.commit()
             self._queue_pair_state(doc_pair.id, doc_pair.folderish, doc_pair.pair_state)
@@ -1108,7 +1746,8 @@ class EngineDAO(ConfigurationDAO):
             c = con.cursor()
             c.execute("DELETE FROM States WHERE id=?", (doc_pair.id,))
             if doc_pair.folderish:
-                c.execute("DELETE FROM States" + self._get_recursive_condition(doc_pair))
+                condition, params = self._get_recursive_condition(doc_pair)
+                c.execute("DELETE FROM States" + condition, params)
             if self.auto_commit:
                 con.commit()
         finally:
@@ -1120,6 +1759,7 @@ class EngineDAO(ConfigurationDAO):
 
     def insert_remote_state(self, info, remote_parent_path, local_path, local_parent_path):
         pair_state = PAIR_STATES.get(('unknown','created'))
+        row_id = None
         self._lock.acquire()
         try:
             con = self._get_write_connection()
@@ -1128,20 +1768,19 @@ class EngineDAO(ConfigurationDAO):
                       "remote_parent_path, remote_name, last_remote_updated, remote_can_rename," +
                       "remote_can_delete, remote_can_update, " +
                       "remote_can_create_child, last_remote_modifier, remote_digest," +
-                      "folderish, last_remote_modifier, local_path, local_parent_path, remote_state, local_state, pair_state, local_name)" +
-                      " VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,'created','unknown',?, ?)",
+                      "folderish, last_remote_modifier, local_path, local_parent_path, remote_state, local_state, pair_state, local_name, size)" +
+                      " VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,'created','unknown',?,?,?)",
                       (info.uid, info.parent_uid, remote_parent_path, info.name,
                        info.last_modification_time, info.can_rename, info.can_delete, info.can_update,
                        info.can_create_child, info.last_contributor, info.digest, info.folderish, info.last_contributor,
-                       local_path, local_parent_path, pair_state, info.name))
+                       local_path, local_parent_path, pair_state, info.name, info.size))
             row_id = c.lastrowid
             if self.auto_commit:
                 con.commit()
             # Check if parent is not in creation
             parent = c.execute("SELECT * FROM States WHERE remote_ref=?", (info.parent_uid,)).fetchone()
             if (parent is None and local_parent_path == '') or (parent is not None and parent.pair_state != "remotely_created"):
-                self._queue_pair_state(row_id, info.folderish, pair_state)
-            self._items_count = self._items_count + 1
+                self._queue_pair_state(row_id, info.folderish, pair_state, size=info.size)
         except sqlite3.IntegrityError:
             pass
         finally:
@@ -1186,8 +1825,7 @@ class EngineDAO(ConfigurationDAO):
                       " WHERE id=?", (row.id,))
             if self.auto_commit:
                 con.commit()
-            self._queue_pair_state(row.id, row.folderish, row.pair_state)
-            self._items_count = self._items_count + 1
+            self._queue_pair_state(row.id, row.folderish, row.pair_state, size=row.size)
         finally:
             self._lock.release()
         row.last_error = None
@@ -1207,7 +1845,6 @@ class EngineDAO(ConfigurationDAO):
         finally:
             self._lock.release()
         if c.rowcount == 1:
-            self._items_count = self._items_count + 1
             return True
         return False
 
@@ -1224,7 +1861,6 @@ class EngineDAO(ConfigurationDAO):
         finally:
             self._lock.release()
         if c.rowcount == 1:
-            self._items_count = self._items_count + 1
             return True
         return False
 
@@ -1241,7 +1877,6 @@ class EngineDAO(ConfigurationDAO):
         finally:
             self._lock.release()
         if c.rowcount == 1:
-            self._items_count = self._items_count - 1
             return True
         return False
 
@@ -1321,27 +1956,32 @@ class EngineDAO(ConfigurationDAO):
         if versionned:
             version = ', version=version+1'
             log.trace('Increasing version to %d for pair %r', row.version + 1, row)
+        query = ("SET remote_ref=?, remote_parent_ref=?, " +
+                 "remote_parent_path=?, remote_name=?, last_remote_updated=?, remote_can_rename=?," +
+                 "remote_can_delete=?, remote_can_update=?, " +
+                 "remote_can_create_child=?, last_remote_modifier=?, remote_digest=?, local_state=?," +
+                 "remote_state=?, pair_state=?" + version + " WHERE id=?")
+        params = (info.uid, info.parent_uid, remote_parent_path, info.name,
+                  info.last_modification_time, info.can_rename, info.can_delete, info.can_update,
+                  info.can_create_child, info.last_contributor, info.digest, row.local_state,
+                  row.remote_state, pair_state, row.id)
+        batch = self._get_batch()
+        if batch is not None:
+            # IGNORE has the same effect than catching the IntegrityError without breaking the executemany
+            batch.execute("UPDATE OR IGNORE States " + query, params)
+            if queue:
+                batch.defer(self._queue_after_batch, self._queue_remote_state, row.id, info.parent_uid,
+                            info.folderish, pair_state, info.size)
+            return
         self._lock.acquire()
         try:
             con = self._get_write_connection()
             c = con.cursor()
-            c.execute("UPDATE States SET remote_ref=?, remote_parent_ref=?, " +
-                      "remote_parent_path=?, remote_name=?, last_remote_updated=?, remote_can_rename=?," +
-                      "remote_can_delete=?, remote_can_update=?, " +
-                      "remote_can_create_child=?, last_remote_modifier=?, remote_digest=?, local_state=?," +
-                      "remote_state=?, pair_state=?" + version + " WHERE id=?",
-                      (info.uid, info.parent_uid, remote_parent_path, info.name,
-                       info.last_modification_time, info.can_rename, info.can_delete, info.can_update,
-                       info.can_create_child, info.last_contributor, info.digest, row.local_state,
-                       row.remote_state, pair_state, row.id))
+            c.execute("UPDATE States " + query, params)
             if self.auto_commit:
                 con.commit()
             if queue:
-                # Check if parent is not in creation
-                parent = c.execute("SELECT * FROM States WHERE remote_ref=?", (info.parent_uid,)).fetchone()
-                # Parent can be None if the parent is filtered
-                if (parent is not None and parent.pair_state != "remotely_created") or parent is None:
-                    self._queue_pair_state(row.id, info.folderish, pair_state)
+                self._queue_remote_state(c, row.id, info.parent_uid, info.folderish, pair_state, size=info.size)
         except sqlite3.IntegrityError:
             pass
         finally:
@@ -1390,6 +2030,10 @@ class EngineDAO(ConfigurationDAO):
 
     def add_path_scanned(self, path):
         path = self._clean_filter_path(path)
+        batch = self._get_batch()
+        if batch is not None:
+            batch.execute("INSERT OR IGNORE INTO RemoteScan(path) VALUES(?)", (path,))
+            return
         self._lock.acquire()
         try:
             con = self._get_write_connection()
@@ -1454,11 +2098,10 @@ class EngineDAO(ConfigurationDAO):
         return c.execute("SELECT * FROM States WHERE remote_parent_ref=? AND remote_name < ? AND folderish=0 ORDER BY remote_name DESC LIMIT 1", (state.remote_parent_ref,state.remote_name)).fetchone()
 
     def is_filter(self, path):
-        path = self._clean_filter_path(path)
-        if any([path.startswith(filter_obj.path) for filter_obj in self._filters]):
-            return True
-        else:
-            return False
+        return self._filters.match(self._clean_filter_path(path))
+
+    def _get_filter_matcher(self):
+        return FilterMatcher([filter_obj.path for filter_obj in self.get_filters()])
 
     def get_filters(self):
         c = self._get_read_connection().cursor()
@@ -1481,8 +2124,7 @@ class EngineDAO(ConfigurationDAO):
             # TODO ADD THIS path AS remotely_deleted
             if self.auto_commit:
                 con.commit()
-            self._filters = self.get_filters()
-            self._items_count = self.get_syncing_count()
+            self._filters = self._get_filter_matcher()
         finally:
             self._lock.release()
 
@@ -1495,14 +2137,10 @@ class EngineDAO(ConfigurationDAO):
             c.execute("DELETE FROM Filters WHERE path LIKE ?", (path + '%',))
             if self.auto_commit:
                 con.commit()
-            self._filters = self.get_filters()
-            self._items_count = self.get_syncing_count()
+            self._filters = self._get_filter_matcher()
         finally:
             self._lock.release()
 
-    def _escape(self, _str):
-        return _str.replace("'", "''")
-
     def _create_users_table(self, cursor, force=False):
         '''
             Create a new table 'Users' to store the mapping between user-id and user's full name
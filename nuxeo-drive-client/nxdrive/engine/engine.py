@@ -10,6 +10,7 @@ from nxdrive.client import RemoteFileSystemClient
 from nxdrive.client import RemoteFilteredFileSystemClient
 from nxdrive.client import RemoteDocumentClient
 from nxdrive.client.local_client import DEDUPED_MAX_COUNT
+from nxdrive.client.base_automation_client import BaseAutomationClient
 from nxdrive.utils import normalized_path
 from nxdrive.engine.processor import Processor
 from threading import current_thread
@@ -412,6 +413,8 @@ class Engine(QObject):
         self._remote_password = self._dao.get_config("remote_password")
         self._remote_token = self._dao.get_config("remote_token")
         self._device_id = self._manager.device_id
+        if self._server_url is not None:
+            BaseAutomationClient.operation_cache.set_server_version(self._server_url, self.get_server_version())
         if self._remote_password is None and self._remote_token is None:
             self.set_invalid_credentials(reason="found no password nor token in engine configuration")
 
@@ -426,9 +429,14 @@ class Engine(QObject):
 
     def _create_queue_manager(self, processors):
         from nxdrive.engine.queue_manager import QueueManager
+        file_scheduling = self._manager.get_file_scheduling()
+        autoscale = self._manager.is_autoscale_processors()
+        folder_creation_threads = self._manager.get_folder_creation_threads()
         if self._manager.is_debug():
-            return QueueManager(self, self._dao, max_file_processors=2)
-        return QueueManager(self, self._dao, max_file_processors=processors)
+            return QueueManager(self, self._dao, max_file_processors=2, file_scheduling=file_scheduling,
+                                autoscale=autoscale, folder_creation_threads=folder_creation_threads)
+        return QueueManager(self, self._dao, max_file_processors=processors, file_scheduling=file_scheduling,
+                            autoscale=autoscale, folder_creation_threads=folder_creation_threads)
 
     def _create_remote_watcher(self, delay):
         from nxdrive.engine.watcher.remote_watcher import RemoteWatcher
@@ -636,6 +644,10 @@ class Engine(QObject):
         metrics["unsynchronized_files"] = self._dao.get_unsynchronized_count()
         metrics["files_size"] = self._dao.get_global_size()
         metrics["invalid_credentials"] = self._invalid_credentials
+        metrics.update(self._dao.get_metrics())
+        metrics.update(BaseAutomationClient.connection_pool.get_metrics())
+        metrics.update(BaseAutomationClient.operation_cache.get_metrics())
+        metrics.update(RemoteFileSystemClient.info_cache.get_metrics())
         return metrics
 
     def get_conflicts(self):
@@ -674,6 +686,8 @@ class Engine(QObject):
         self._stopped = True
         log.debug("Engine %s stopping", self._uid)
         self._stop.emit()
+        # Parked processors end instead of waiting for new items
+        self._queue_manager.shutdown_processors()
         for thread in self._threads:
             if not thread.wait(5000):
                 log.warn("Thread is not responding - terminate it")
@@ -707,6 +721,7 @@ class Engine(QObject):
         update_info = client.get_update_info()
         log.debug("Fetched update info for engine [%s] from server %s: %r", self._name, self._server_url, update_info)
         self._dao.update_config("server_version", update_info.get("serverVersion"))
+        BaseAutomationClient.operation_cache.set_server_version(self._server_url, update_info.get("serverVersion"))
         self._dao.update_config("update_url", update_info.get("updateSiteURL"))
         beta_update_site_url = update_info.get("betaUpdateSiteURL")
         # Consider empty string as None
@@ -768,6 +783,8 @@ class Engine(QObject):
                 raise e
         nxclient = None
         if check_credential:
+            # Fetch the operations to check the credentials
+            BaseAutomationClient.operation_cache.invalidate(self._server_url)
             nxclient = self.remote_doc_client_factory(
                 self._server_url, self._remote_user, self._manager.device_id,
                 self._manager.get_version(), proxies=self._manager.proxies,
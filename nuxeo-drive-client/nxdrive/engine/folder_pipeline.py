@@ -0,0 +1,136 @@
+'''
+Remote folder creations started ahead of the local folder processor
+'''
+from Queue import Queue
+from threading import Event, Lock, Thread
+from nxdrive.logging_config import get_logger
+
+log = get_logger(__name__)
+
+# Folder creations in progress or waiting for the processor
+PIPELINE_DEPTH = 16
+
+
+class FolderCreation(object):
+
+    def __init__(self, row_id, parent_ref, name):
+        self.row_id = row_id
+        self.parent_ref = parent_ref
+        self.name = name
+        self.info = None
+        self.error = None
+        self.done = Event()
+
+
+class FolderPipeline(object):
+    '''
+    Create the remote folders of the queued pairs on a few threads, before the LocalFolderProcessor
+    reaches them. The processor keeps the ordering and the DAO updates: it takes the created folder
+    of a pair with get, the creations it does not use are deleted with cancel unless a pair got bound
+    to them in the meantime.
+    '''
+
+    def __init__(self, threads, depth=PIPELINE_DEPTH, dao=None):
+        self._threads = threads
+        self.depth = depth
+        self._dao = dao
+        self._lock = Lock()
+        self._creations = dict()
+        self._requests = Queue()
+        self._workers = []
+        self._used = 0
+        self._cancelled = 0
+
+    def is_full(self):
+        return len(self._creations) >= self.depth
+
+    def has(self, row_id):
+        return row_id in self._creations
+
+    def start(self, row_id, remote_client, parent_ref, name):
+        with self._lock:
+            if row_id in self._creations or len(self._creations) >= self.depth:
+                return False
+            creation = FolderCreation(row_id, parent_ref, name)
+            self._creations[row_id] = creation
+            if len(self._workers) < self._threads:
+                worker = Thread(target=self._run, name="FolderPipeline-%d" % len(self._workers))
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        log.trace("Pipelining creation of remote folder '%s' in %s", name, parent_ref)
+        self._requests.put((creation, remote_client))
+        return True
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            creation, remote_client = request
+            try:
+                creation.info = remote_client.make_folder(creation.parent_ref, creation.name)
+            except Exception as e:
+                log.debug("Pipelined creation of remote folder '%s' failed: %r", creation.name, e)
+                creation.error = e
+            finally:
+                creation.done.set()
+
+    def _pop(self, row_id):
+        with self._lock:
+            creation = self._creations.pop(row_id, None)
+        if creation is not None:
+            creation.done.wait()
+        return creation
+
+    def get(self, row_id, remote_client, parent_ref, name):
+        '''
+        Return the remote folder created for the pair, None if the caller has to create it
+        '''
+        creation = self._pop(row_id)
+        if creation is None or creation.error is not None:
+            return None
+        if creation.parent_ref != parent_ref or creation.name != name:
+            # The pair changed since the creation started
+            self._delete(creation, remote_client)
+            return None
+        self._used += 1
+        return creation.info
+
+    def cancel(self, row_id, remote_client):
+        creation = self._pop(row_id)
+        if creation is not None:
+            self._delete(creation, remote_client)
+
+    def discard(self, row_id):
+        # Forget the creation, the remote folder is left as is
+        self._pop(row_id)
+
+    def _delete(self, creation, remote_client):
+        if creation.info is None:
+            return
+        if self._dao is not None and self._dao.get_normal_state_from_remote(creation.info.uid) is not None:
+            # The remote watcher may have bound a pair to it
+            log.debug("Keeping remote folder '%s' (%s) bound to a pair", creation.name, creation.info.uid)
+            return
+        self._cancelled += 1
+        log.debug("Deleting unused remote folder '%s' (%s)", creation.name, creation.info.uid)
+        try:
+            remote_client.delete(creation.info.uid, parent_fs_item_id=creation.info.parent_uid)
+        except Exception as e:
+            log.debug("Cannot delete unused remote folder %s: %r", creation.info.uid, e)
+
+    def stop(self):
+        # The workers end once the started creations are done
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+        for _ in workers:
+            self._requests.put(None)
+
+    def get_metrics(self):
+        metrics = dict()
+        metrics["pipelined_folders"] = len(self._creations)
+        metrics["pipelined_folders_used"] = self._used
+        metrics["pipelined_folders_cancelled"] = self._cancelled
+        return metrics
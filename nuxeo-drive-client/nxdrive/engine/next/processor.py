@@ -15,7 +15,7 @@ class Processor(OldProcessor):
         log.warn("acquire...")
         result = super(Processor, self).acquire_state(row_id)
         if result is not None and self._engine.get_local_watcher().is_pending_scan(result.local_parent_path):
-            self._dao.release_processor(self._thread_id)
+            self._dao.release_state(self._thread_id, result.id)
             # Postpone pair for watcher delay
             self._engine.get_queue_manager().postpone_pair(result, self._engine.get_local_watcher().get_scan_delay())
             return None
@@ -38,11 +38,15 @@ class Processor(OldProcessor):
         if pair:
             import shutil
             shutil.copy(local_client._abspath(pair.local_path), file_out)
-            return file_out
-        tmp_file = remote_client.stream_content( doc_pair.remote_ref, file_path,
-                                parent_fs_item_id=doc_pair.remote_parent_ref, file_out=file_out)
+            return file_out, None
+        fs_item_info = remote_client.get_cached_info(doc_pair.remote_ref, doc_pair.remote_digest)
+        tmp_file, digest_algorithm, digest = remote_client.stream_content_with_digest( doc_pair.remote_ref, file_path,
+                                parent_fs_item_id=doc_pair.remote_parent_ref, fs_item_info=fs_item_info,
+                                file_out=file_out)
         self._update_speed_metrics()
-        return tmp_file
+        if digest_algorithm != local_client.get_digest_func():
+            digest = None
+        return tmp_file, digest
 
     def _update_remotely(self, doc_pair, local_client, remote_client, is_renaming):
         log.warn("_update_remotely")
@@ -53,7 +57,7 @@ class Processor(OldProcessor):
         else:
             new_os_path = os_path
         log.debug("Updating content of local file '%s'.", os_path)
-        tmp_file = self._download_content(local_client, remote_client, doc_pair, new_os_path)
+        tmp_file, digest = self._download_content(local_client, remote_client, doc_pair, new_os_path)
         # Delete original file and rename tmp file
         remote_id = local_client.get_remote_id(doc_pair.local_path)
         local_client.delete_final(doc_pair.local_path)
@@ -62,7 +66,7 @@ class Processor(OldProcessor):
         # Move rename
         updated_info = local_client.move(rel_path,
                                         doc_pair.local_parent_path, doc_pair.remote_name)
-        doc_pair.local_digest = updated_info.get_digest()
+        doc_pair.local_digest = digest if digest is not None else updated_info.get_digest()
         self._dao.update_last_transfer(doc_pair.id, "download")
         self._refresh_local_state(doc_pair, updated_info)
 
@@ -81,7 +85,8 @@ class Processor(OldProcessor):
             else:
                 path, os_path, name = local_client.get_new_file(local_parent_path,
                                                                 name)
-                tmp_file = self._download_content(local_client, remote_client, doc_pair, os_path)
+                tmp_file, doc_pair.local_digest = self._download_content(local_client, remote_client, doc_pair,
+                                                                         os_path)
                 log.debug("Creating local file '%s' in '%s'", name,
                           local_client._abspath(parent_pair.local_path))
                 # Move file to its folder - might want to split it in two for events
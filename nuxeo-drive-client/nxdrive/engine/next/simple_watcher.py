@@ -1,6 +1,6 @@
 __author__ = 'loopingz'
 from nxdrive.engine.watcher.local_watcher import LocalWatcher, DriveFSRootEventHandler, normalize_event_filename
-from time import sleep, time, mktime
+from time import time, mktime
 from nxdrive.utils import current_milli_time
 import os
 import sqlite3
@@ -138,19 +138,20 @@ class SimpleWatcher(LocalWatcher):
             current_time_millis = int(round(time() * 1000))
             self._win_delete_interval = current_time_millis
             self._win_folder_scan_interval = current_time_millis
-            i = 0
+            next_scan_check = time() + 1
             while (1):
                 self._interact()
-                sleep(0.01)
+                # Woken up by the watchdog events, or when the paths to scan are due
+                self._wait(next_scan_check - time() if self._to_scan or self._delete_files else None,
+                           pending=lambda: not self._watchdog_queue.empty())
                 while (not self._watchdog_queue.empty()):
                     # Dont retest if already local scan
                     evt = self._watchdog_queue.get()
                     self.handle_watchdog_event(evt)
-                # Check to scan
-                i += 1
-                if i % 100 != 0:
+                # Check to scan every second
+                if time() < next_scan_check:
                     continue
-                i = 0
+                next_scan_check = time() + 1
                 threshold_time = current_milli_time() - 1000 * self._scan_delay
                 # Need to create a list of to scan as the dictionary cannot grow while iterating
                 local_scan = []
@@ -0,0 +1,57 @@
+'''
+Local paths of the pairs being processed
+'''
+from bisect import bisect_left
+from threading import Lock
+
+
+class PathRegistry(object):
+    '''
+    Local path of the pair each worker is processing. Updates replace a snapshot under a lock,
+    lookups only read the current snapshot: the paths by worker, the workers by path and the
+    sorted paths for the prefix lookups.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        # Worker to (path, file worker)
+        self._entries = dict()
+        self._snapshot = (dict(), dict(), [])
+
+    def register(self, worker, path, file_worker=True):
+        with self._lock:
+            if path is None:
+                if self._entries.pop(worker, None) is None:
+                    return
+            else:
+                self._entries[worker] = (path, file_worker)
+            self._update()
+
+    def unregister(self, worker):
+        self.register(worker, None)
+
+    def _update(self):
+        by_worker = dict()
+        by_path = dict()
+        for worker, entry in self._entries.iteritems():
+            by_worker[worker] = entry[0]
+            by_path.setdefault(entry[0], []).append((worker, entry[1]))
+        self._snapshot = (by_worker, by_path, sorted(by_path))
+
+    def get_path(self, worker):
+        return self._snapshot[0].get(worker)
+
+    def get_workers(self, path, exact_match=True, file_workers_only=False):
+        _, by_path, paths = self._snapshot
+        if exact_match:
+            entries = by_path.get(path, ())
+        else:
+            entries = []
+            i = bisect_left(paths, path)
+            while i < len(paths) and paths[i].startswith(path):
+                entries.extend(by_path[paths[i]])
+                i += 1
+        return [worker for worker, file_worker in entries if file_worker or not file_workers_only]
+
+    def __len__(self):
+        return len(self._snapshot[0])
@@ -9,6 +9,7 @@ from nxdrive.client.common import LOCALLY_EDITED_FOLDER_NAME, UNACCESSIBLE_HASH
 from nxdrive.client.common import NotFound
 from nxdrive.client.common import safe_filename
 from nxdrive.engine.activity import Action
+from nxdrive.engine.tracing import Span, NO_PHASE
 from nxdrive.utils import current_milli_time, is_office_temp_file
 from PyQt4.QtCore import pyqtSignal
 from threading import Lock
@@ -42,6 +43,7 @@ class Processor(EngineWorker):
         self._current_doc_pair = None
         self._get_item = item_getter
         self._engine = engine
+        self._span = None
 
     def _unlock_soft_path(self, path):
         log.trace("Soft unlocking: %s", path)
@@ -134,6 +136,29 @@ class Processor(EngineWorker):
         finally:
             Processor.path_locker.release()
 
+    def stop(self):
+        self._continue = False
+        # Wake it up if parked
+        self._engine.get_queue_manager().wake_processors()
+        super(Processor, self).stop()
+
+    def _get_next_item(self):
+        # Stay in the pool, parked, while the queues are empty
+        queue_manager = self._engine.get_queue_manager()
+        while self._continue:
+            if queue_manager.retire_processor(self):
+                log.trace('%s processor retired, its pool shrank', self.get_name())
+                return None
+            wakeup = queue_manager.get_processors_wakeup()
+            item = self._get_item()
+            if item is not None:
+                return item
+            self._current_doc_pair = None
+            if not queue_manager.park_processor(self, wakeup):
+                return None
+            self._interact()
+        return None
+
     def _clean(self, reason, e=None):
         super(Processor, self)._clean(reason, e)
         if reason == 'exception':
@@ -143,15 +168,26 @@ class Processor(EngineWorker):
 
     def _execute(self):
         self._current_metrics = dict()
-        self._current_item = self._get_item()
+        self._current_item = None
         soft_lock = None
-        while self._continue and self._current_item is not None:
+        while True:
+            if self._current_item is None:
+                # Once the previous pair is released
+                self._current_item = self._get_next_item()
+            if not self._continue or self._current_item is None:
+                break
             # Take client every time as it is cached in engine
             local_client = self._engine.get_local_client()
             remote_client = self._engine.get_remote_client()
             doc_pair = None
+            # Held, requeued or processed elsewhere: the children and the pipelined folder are kept
+            requeued = False
+            handled = False
+            row_id = self._current_item.id
+            self._span = Span(row_id)
             try:
-                doc_pair = self._dao.acquire_state(self._thread_id, self._current_item.id)
+                with self._trace('acquire'):
+                    doc_pair = self._dao.acquire_state(self._thread_id, self._current_item.id)
                 if doc_pair and doc_pair.last_remote_modifier:
                     self._engine._user_name_resolver.refresh_user(doc_pair.last_remote_modifier)
             except:
@@ -162,10 +198,13 @@ class Processor(EngineWorker):
             try:
                 if doc_pair is None:
                     log.trace("Didn't acquire state, dropping %r", self._current_item)
+                    # Left to the processor handling it, if the row still exists
+                    requeued = self._dao.get_state_from_id(row_id) is not None
                     self._current_item = self._get_item()
                     continue
                 log.debug('Executing processor on %r(%d)', doc_pair, doc_pair.version)
                 self._current_doc_pair = doc_pair
+                self._engine.get_queue_manager().set_processing(self, doc_pair)
                 self._current_temp_file = None
                 if (doc_pair.pair_state == 'synchronized'
                     or doc_pair.pair_state == 'unsynchronized'
@@ -176,11 +215,16 @@ class Processor(EngineWorker):
                     if doc_pair.pair_state == 'synchronized':
                         self._handle_readonly(local_client, doc_pair)
                     continue
+                if self._hold_for_parent(doc_pair):
+                    requeued = True
+                    self._current_item = self._get_item()
+                    continue
                 # TODO Update as the server dont take hash to avoid conflict yet
                 if (doc_pair.pair_state.startswith("locally")
                         and doc_pair.remote_ref is not None):
                     try:
-                        remote_info = remote_client.get_info(doc_pair.remote_ref)
+                        with self._trace('refresh'):
+                            remote_info = remote_client.get_info(doc_pair.remote_ref)
                         if remote_info.digest != doc_pair.remote_digest:
                             doc_pair.remote_state = 'modified'
                         self._refresh_remote(doc_pair, remote_client, remote_info)
@@ -218,11 +262,14 @@ class Processor(EngineWorker):
                     self._current_metrics = dict()
                     self._current_metrics["handler"] = doc_pair.pair_state
                     self._current_metrics["start_time"] = current_milli_time()
+                    self._span.handler = handler_name
                     log.trace("Calling %s on doc pair %r", sync_handler, doc_pair)
                     try:
                         soft_lock = self._lock_soft_path(doc_pair.local_path)
+                        handled = True
                         sync_handler(doc_pair, local_client, remote_client)
                         self._current_metrics["end_time"] = current_milli_time()
+                        self._current_metrics["phases"] = self._span.get_phases()
                         self.pairSync.emit(doc_pair, self._current_metrics)
                         # TO_REVIEW May have a call to reset_error
                         log.trace("Finish %s on doc pair %r", sync_handler, doc_pair)
@@ -232,16 +279,21 @@ class Processor(EngineWorker):
                         from time import sleep
                         # Wait one second to avoid retrying to quickly
                         self._current_doc_pair = None
+                        self._span.status = 'interrupted'
                         log.debug("PairInterrupt wait 1s and requeue on %r", doc_pair)
                         sleep(1)
+                        requeued = True
                         self._engine.get_queue_manager().push(doc_pair)
                         continue
                     except Exception as e:
+                        self._span.status = 'error'
                         log.exception(e)
                         self.increase_error(doc_pair, "SYNC HANDLER: %s" % handler_name, exception=e)
                         self._current_item = self._get_item()
                         continue
             except ThreadInterrupt:
+                self._span.status = 'interrupted'
+                requeued = True
                 self._engine.get_queue_manager().push(doc_pair)
                 raise
             except Exception as e:
@@ -251,7 +303,16 @@ class Processor(EngineWorker):
             finally:
                 if soft_lock is not None:
                     self._unlock_soft_path(soft_lock)
-                self._dao.release_state(self._thread_id)
+                if doc_pair is not None:
+                    self._dao.release_state(self._thread_id, doc_pair.id)
+                # Even if the pair is gone since it was registered
+                self._engine.get_queue_manager().set_processing(self, None)
+                if not requeued:
+                    # Created, failed, skipped or gone: the children must not wait for it anymore
+                    self._engine.get_queue_manager().release_children(row_id)
+                    self._cancel_pipelined_folder(row_id, remote_client, handled)
+                self._engine.get_queue_manager().add_span(self._span.finish())
+                self._span = None
             self._interact()
             self._current_item = self._get_item()
         log.trace('%s processor terminated' if not self._continue else '%s processor finished, queue is empty',
@@ -267,6 +328,22 @@ class Processor(EngineWorker):
             log.debug("Auto-resolve conflict has folder has same remote_id")
             self._dao.synchronize_state(doc_pair)
 
+    def _trace(self, phase):
+        # Time spent by the current pair in the phase
+        if self._span is None:
+            return NO_PHASE
+        return self._span.phase(phase)
+
+    def _hold_for_parent(self, doc_pair):
+        # Wait for the creation of the parent folder instead of failing on it
+        queue_manager = self._engine.get_queue_manager()
+        if not queue_manager.has_pending_folders() or doc_pair.local_parent_path == '':
+            return False
+        parent_pair = self._dao.get_state_from_local(doc_pair.local_parent_path)
+        if parent_pair is None or parent_pair.pair_state not in ('locally_created', 'remotely_created'):
+            return False
+        return queue_manager.hold_for_parent(doc_pair, parent_pair.id)
+
     def _handle_no_parent(self, doc_pair, local_client, remote_client):
         log.trace("Republish as parent doesn't exist : %r", doc_pair)
         parent_pair = self._dao.get_normal_state_from_remote(doc_pair.remote_parent_ref)
@@ -295,7 +372,8 @@ class Processor(EngineWorker):
                 log.debug('Forcing _synchronize_remotely_modified for pair = %r with info = %r', doc_pair, remote_info)
                 self._synchronize_remotely_modified(doc_pair, local_client, remote_client)
             else:
-                self._dao.synchronize_state(doc_pair)
+                with self._trace('dao'):
+                    self._dao.synchronize_state(doc_pair)
 
     def _synchronize_locally_modified(self, doc_pair, local_client, remote_client):
         fs_item_info = None
@@ -303,27 +381,33 @@ class Processor(EngineWorker):
             # Try to update
             info = local_client.get_info(doc_pair.local_path)
             log.trace("Modification of postponed local file: %r", doc_pair)
-            doc_pair.local_digest = info.get_digest()
+            with self._trace('digest'):
+                doc_pair.local_digest = info.get_digest()
             if doc_pair.local_digest == UNACCESSIBLE_HASH:
                 self._postpone_pair(doc_pair, 'Unaccessible hash')
                 return
             self._dao.update_local_state(doc_pair, info, versionned=False, queue=False)
-        if not local_client.is_equal_digests(doc_pair.local_digest, doc_pair.remote_digest, doc_pair.local_path):
+        with self._trace('digest'):
+            equal_digests = local_client.is_equal_digests(doc_pair.local_digest, doc_pair.remote_digest,
+                                                          doc_pair.local_path)
+        if not equal_digests:
             if doc_pair.remote_can_update:
                 if doc_pair.local_digest == UNACCESSIBLE_HASH:
                     self._postpone_pair(doc_pair, 'Unaccessible hash')
                     return
                 log.debug("Updating remote document '%s'.",
                           doc_pair.local_name)
-                fs_item_info = remote_client.stream_update(
-                    doc_pair.remote_ref,
-                    local_client._abspath(doc_pair.local_path),
-                    parent_fs_item_id=doc_pair.remote_parent_ref,
-                    filename=doc_pair.remote_name,  # Use remote name to avoid rename in case of duplicate
-                )
+                with self._trace('transfer'):
+                    fs_item_info = remote_client.stream_update(
+                        doc_pair.remote_ref,
+                        local_client._abspath(doc_pair.local_path),
+                        parent_fs_item_id=doc_pair.remote_parent_ref,
+                        filename=doc_pair.remote_name,  # Use remote name to avoid rename in case of duplicate
+                    )
                 self._dao.update_last_transfer(doc_pair.id, "upload")
                 self._update_speed_metrics()
-                self._dao.update_remote_state(doc_pair, fs_item_info, versionned=False)
+                with self._trace('dao'):
+                    self._dao.update_remote_state(doc_pair, fs_item_info, versionned=False)
                 # TODO refresh_client
             else:
                 log.debug("Skip update of remote document '%s' as it is readonly.", doc_pair.local_name)
@@ -363,7 +447,8 @@ class Processor(EngineWorker):
             # Save the error_count to not ignore next time
             self.increase_error(doc_pair, 'Can be Office Temp')
             return
-        remote_ref = local_client.get_remote_id(doc_pair.local_path)
+        with self._trace('xattr'):
+            remote_ref = local_client.get_remote_id(doc_pair.local_path)
         # Find the parent pair to find the ref of the remote folder to
         # create the document
         parent_pair = self._dao.get_state_from_local(doc_pair.local_parent_path)
@@ -425,7 +510,12 @@ class Processor(EngineWorker):
             if doc_pair.folderish:
                 log.debug("Creating remote folder '%s' in folder '%s'",
                           name, parent_pair.remote_name)
-                fs_item_info = remote_client.make_folder(parent_ref, name)
+                with self._trace('remote'):
+                    pipeline = self._pipeline_folders(local_client, remote_client)
+                    if pipeline is not None:
+                        fs_item_info = pipeline.get(doc_pair.id, remote_client, parent_ref, name)
+                    if fs_item_info is None:
+                        fs_item_info = remote_client.make_folder(parent_ref, name)
                 remote_ref = fs_item_info.uid
             else:
                 # TODO Check if the file is already on the server with the good digest
@@ -439,7 +529,8 @@ class Processor(EngineWorker):
                     self._postpone_pair(doc_pair, 'Unaccessible hash')
                     return
                 if doc_pair.local_digest == UNACCESSIBLE_HASH:
-                    doc_pair.local_digest = info.get_digest()
+                    with self._trace('digest'):
+                        doc_pair.local_digest = info.get_digest()
                     log.trace("Creation of postponed local file: %r", doc_pair)
                     self._dao.update_local_state(doc_pair, info, versionned=False, queue=False)
                     if doc_pair.local_digest == UNACCESSIBLE_HASH:
@@ -447,16 +538,19 @@ class Processor(EngineWorker):
                         return
                 # CSPII-9040: Add delay to let Office finish temp file juggling
                 time.sleep(2)
-                fs_item_info = remote_client.stream_file(
-                    parent_ref, local_client._abspath(doc_pair.local_path), filename=name)
+                with self._trace('transfer'):
+                    fs_item_info = remote_client.stream_file(
+                        parent_ref, local_client._abspath(doc_pair.local_path), filename=name)
                 remote_ref = fs_item_info.uid
                 self._dao.update_last_transfer(doc_pair.id, "upload")
                 self._update_speed_metrics()
-            self._dao.update_remote_state(doc_pair, fs_item_info, remote_parent_path=remote_parent_path,
-                                          versionned=False)
+            with self._trace('dao'):
+                self._dao.update_remote_state(doc_pair, fs_item_info, remote_parent_path=remote_parent_path,
+                                              versionned=False)
             log.trace("Put remote_ref in %s", remote_ref)
             try:
-                local_client.set_remote_id(doc_pair.local_path, remote_ref)
+                with self._trace('xattr'):
+                    local_client.set_remote_id(doc_pair.local_path, remote_ref)
             except (NotFound, IOError, OSError):
                 new_pair = self._dao.get_state_from_id(doc_pair.id)
                 # File has been moved during creation
@@ -481,6 +575,38 @@ class Processor(EngineWorker):
                 self._engine.newReadonly.emit(doc_pair.local_name, parent_pair.remote_name)
                 self._handle_unsynchronized(local_client, doc_pair)
 
+    def _pipeline_folders(self, local_client, remote_client):
+        # Start the remote creation of the next queued folders
+        pipeline = self._engine.get_queue_manager().get_folder_pipeline()
+        if pipeline is None:
+            return None
+        for item in self._engine.get_queue_manager().get_next_local_folders(pipeline.depth):
+            if pipeline.is_full():
+                break
+            if item.pair_state != 'locally_created' or pipeline.has(item.id):
+                continue
+            doc_pair = self._dao.get_state_from_id(item.id)
+            if doc_pair is None or doc_pair.pair_state != 'locally_created' or not doc_pair.folderish:
+                continue
+            parent_pair = self._dao.get_state_from_local(doc_pair.local_parent_path)
+            if (parent_pair is None or parent_pair.remote_ref is None or not parent_pair.remote_can_create_child
+                    or local_client.get_remote_id(doc_pair.local_path) is not None):
+                continue
+            pipeline.start(doc_pair.id, remote_client, parent_pair.remote_ref, os.path.basename(doc_pair.local_path))
+        return pipeline
+
+    def _cancel_pipelined_folder(self, row_id, remote_client, handled):
+        # The pair did not use the folder created ahead for it
+        pipeline = self._engine.get_queue_manager().get_folder_pipeline()
+        if pipeline is None or not pipeline.has(row_id):
+            return
+        if not handled and self._dao.get_state_from_id(row_id) is not None:
+            # Skipped pair, it may be bound to the folder since
+            pipeline.discard(row_id)
+        else:
+            # Not used by the handler or the row is gone, kept if bound to a pair
+            pipeline.cancel(row_id, remote_client)
+
     def _synchronize_locally_deleted(self, doc_pair, local_client, remote_client):
         if doc_pair.remote_ref is not None:
             if doc_pair.remote_can_delete:
@@ -584,6 +710,7 @@ class Processor(EngineWorker):
         return file_out
 
     def _download_content(self, local_client, remote_client, doc_pair, file_path):
+        # Return the temporary file and its local digest if computed while downloading, None otherwise
         # Check if the file is already on the HD
         # todo checks if a synchronized file with the same digest exists, but anywhere, not in the same parent (folder)
         pair = self._dao.get_valid_duplicate_file(doc_pair.remote_digest)
@@ -593,15 +720,22 @@ class Processor(EngineWorker):
             locker = local_client.unlock_path(file_out)
             try:
                 # todo what happens if it throws exception here, e.g. source file does not exist?
-                shutil.copy(local_client._abspath(pair.local_path), file_out)
+                with self._trace('transfer'):
+                    shutil.copy(local_client._abspath(pair.local_path), file_out)
             finally:
                 local_client.lock_path(file_out, locker)
-            return file_out
-        tmp_file = remote_client.stream_content(
-                                doc_pair.remote_ref, file_path,
-                                parent_fs_item_id=doc_pair.remote_parent_ref)
+            return file_out, None
+        # Info received by the remote watcher or the refresh of the pair, if still matching
+        fs_item_info = remote_client.get_cached_info(doc_pair.remote_ref, doc_pair.remote_digest)
+        with self._trace('transfer'):
+            tmp_file, digest_algorithm, digest = remote_client.stream_content_with_digest(
+                                    doc_pair.remote_ref, file_path,
+                                    parent_fs_item_id=doc_pair.remote_parent_ref,
+                                    fs_item_info=fs_item_info)
         self._update_speed_metrics()
-        return tmp_file
+        if digest_algorithm != local_client.get_digest_func():
+            digest = None
+        return tmp_file, digest
 
     def _update_remotely(self, doc_pair, local_client, remote_client, is_renaming):
         os_path = local_client._abspath(doc_pair.local_path)
@@ -611,14 +745,18 @@ class Processor(EngineWorker):
         else:
             new_os_path = os_path
         log.debug("Updating content of local file '%s'.", os_path)
-        self.tmp_file = self._download_content(local_client, remote_client, doc_pair, new_os_path)
+        self.tmp_file, digest = self._download_content(local_client, remote_client, doc_pair, new_os_path)
         # Delete original file and rename tmp file
         remote_id = local_client.get_remote_id(doc_pair.local_path)
         local_client.delete_final(doc_pair.local_path)
         if remote_id is not None:
-            local_client.set_remote_id(local_client.get_path(self.tmp_file), doc_pair.remote_ref)
+            with self._trace('xattr'):
+                local_client.set_remote_id(local_client.get_path(self.tmp_file), doc_pair.remote_ref)
         updated_info = local_client.rename(local_client.get_path(self.tmp_file), doc_pair.remote_name)
-        doc_pair.local_digest = updated_info.get_digest()
+        if digest is None:
+            with self._trace('digest'):
+                digest = updated_info.get_digest()
+        doc_pair.local_digest = digest
         self._dao.update_last_transfer(doc_pair.id, "download")
         self._refresh_local_state(doc_pair, updated_info)
 
@@ -626,8 +764,10 @@ class Processor(EngineWorker):
         self.tmp_file = None
         try:
             is_renaming = safe_filename(doc_pair.remote_name) != doc_pair.local_name
-            if (not local_client.is_equal_digests(doc_pair.local_digest, doc_pair.remote_digest, doc_pair.local_path)
-                    and doc_pair.local_digest is not None):
+            with self._trace('digest'):
+                equal_digests = local_client.is_equal_digests(doc_pair.local_digest, doc_pair.remote_digest,
+                                                              doc_pair.local_path)
+            if not equal_digests and doc_pair.local_digest is not None:
                 self._update_remotely(doc_pair, local_client, remote_client, is_renaming)
             else:
                 # digest agree so this might be a renaming and/or a move,
@@ -679,7 +819,8 @@ class Processor(EngineWorker):
                         self._dao.update_local_parent_path(doc_pair, os.path.basename(updated_info.path), new_path)
                         self._refresh_local_state(doc_pair, updated_info)
             self._handle_readonly(local_client, doc_pair)
-            self._dao.synchronize_state(doc_pair)
+            with self._trace('dao'):
+                self._dao.synchronize_state(doc_pair)
         except (IOError, WindowsError) as e:
             log.warning(
                 "Delaying local update of remotely modified content %r due to"
@@ -740,13 +881,16 @@ class Processor(EngineWorker):
                 # Case of several documents with same name or case insensitive hard drive
                 # TODO dedup
                 path = self._create_remotely(local_client, remote_client, doc_pair, parent_pair, name)
-        local_client.set_remote_id(path, doc_pair.remote_ref)
+        with self._trace('xattr'):
+            local_client.set_remote_id(path, doc_pair.remote_ref)
         if path != doc_pair.local_path and doc_pair.folderish:
             # Update childs
             self._dao.update_local_parent_path(doc_pair, os.path.basename(path), os.path.dirname(path))
         self._refresh_local_state(doc_pair, local_client.get_info(path))
         self._handle_readonly(local_client, doc_pair)
-        if not self._dao.synchronize_state(doc_pair):
+        with self._trace('dao'):
+            synchronized = self._dao.synchronize_state(doc_pair)
+        if not synchronized:
             log.debug("Pair is not in synchronized state (version issue): %r", doc_pair)
             # Need to check if this is a remote or local change
             new_pair = self._dao.get_state_from_id(doc_pair.id)
@@ -774,10 +918,13 @@ class Processor(EngineWorker):
                                                                 name)
                 log.debug("Creating local file '%s' in '%s'", name,
                           local_client._abspath(parent_pair.local_path))
-                tmp_file = self._download_content(local_client, remote_client, doc_pair, os_path)
+                tmp_file, digest = self._download_content(local_client, remote_client, doc_pair, os_path)
+                # Spares the digest computation of the refresh of the local state
+                doc_pair.local_digest = digest
                 tmp_file_path = local_client.get_path(tmp_file)
                 # Set remote id on tmp file already
-                local_client.set_remote_id(tmp_file_path, doc_pair.remote_ref)
+                with self._trace('xattr'):
+                    local_client.set_remote_id(tmp_file_path, doc_pair.remote_ref)
                 # Rename tmp file
                 local_client.rename(tmp_file_path, name)
                 self._dao.update_last_transfer(doc_pair.id, "download")
@@ -848,8 +995,10 @@ class Processor(EngineWorker):
 
     def _refresh_local_state(self, doc_pair, local_info):
         if doc_pair.local_digest is None and not doc_pair.folderish:
-            doc_pair.local_digest = local_info.get_digest()
-        self._dao.update_local_state(doc_pair, local_info, versionned=False, queue=False)
+            with self._trace('digest'):
+                doc_pair.local_digest = local_info.get_digest()
+        with self._trace('dao'):
+            self._dao.update_local_state(doc_pair, local_info, versionned=False, queue=False)
         doc_pair.local_path = local_info.path
         doc_pair.local_name = os.path.basename(local_info.path)
         doc_pair.last_local_updated = local_info.last_modification_time
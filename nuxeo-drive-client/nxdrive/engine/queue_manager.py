@@ -1,12 +1,18 @@
 from PyQt4.QtCore import QObject, pyqtSignal, pyqtSlot, QTimer, QCoreApplication
-from Queue import Queue, Empty
+from Queue import Empty
 from blacklist_queue import BlacklistItem, BlacklistQueue
+from coalescing_queue import CoalescingQueue, LaneQueue
+from autoscaler import AUTOSCALE_INTERVAL, ProcessorAutoscaler
+from folder_pipeline import FolderPipeline
+from path_registry import PathRegistry
+from tracing import TraceStats
 from nxdrive.client.base_automation_client import BaseAutomationClient
 from nxdrive.client.base_automation_client import get_number_of_processors, MAX_NUMBER_PROCESSORS
 from nxdrive.logging_config import get_logger
-from threading import Lock, local
+from threading import Condition, Lock, local
 from time import sleep
 from copy import deepcopy
+from collections import defaultdict
 
 log = get_logger(__name__)
 
@@ -14,6 +20,17 @@ WINERROR_CODE_PROCESS_CANNOT_ACCESS_FILE = 32
 # with an interval of 10sec and 16 retries, it retries for over 48hrs
 ERROR_THRESHOLD = 16
 DEFAULT_DELAY = 10
+# File queue policies
+FILE_SCHEDULING_FIFO = 'fifo'
+FILE_SCHEDULING_PRIORITY = 'priority'
+# Priority policy: files above this size in bytes go to the large lane
+SMALL_FILE_SIZE = 10 * 1024 * 1024
+# Priority policy: seconds after which a large file is served before the small ones
+LARGE_FILE_MAX_WAIT = 120
+# Priority policy: generic processors only taking small files
+SMALL_FILE_PROCESSORS = 2
+# Seconds a child waits for its parent folder creation before being retried anyway
+PARENT_WAIT_DELAY = 60
 WindowsError = None
 try:
     from exceptions import WindowsError
@@ -22,10 +39,11 @@ except ImportError:
 
 
 class QueueItem(object):
-    def __init__(self, row_id, folderish, pair_state):
+    def __init__(self, row_id, folderish, pair_state, size=None):
         self.id = row_id
         self.folderish = folderish
         self.pair_state = pair_state
+        self.size = size
 
     def __repr__(self):
         return "%s[%s](Folderish:%s, State: %s)" % (
@@ -47,17 +65,24 @@ class QueueManager(QObject):
     classdocs
     '''
 
-    def __init__(self, engine, dao, max_file_processors=(0, 0, 5)):
+    def __init__(self, engine, dao, max_file_processors=(0, 0, 5), file_scheduling=FILE_SCHEDULING_FIFO,
+                 autoscale=False, folder_creation_threads=0):
         '''
         Constructor
         '''
         super(QueueManager, self).__init__()
         self._dao = dao
         self._engine = engine
-        self._local_folder_queue = Queue()
-        self._local_file_queue = Queue()
-        self._remote_file_queue = Queue()
-        self._remote_folder_queue = Queue()
+        self._local_folder_queue = CoalescingQueue()
+        self._remote_folder_queue = CoalescingQueue()
+        # Small and large lanes in the file queues
+        self._file_lanes = file_scheduling == FILE_SCHEDULING_PRIORITY
+        if self._file_lanes:
+            self._local_file_queue = self._create_lane_queue()
+            self._remote_file_queue = self._create_lane_queue()
+        else:
+            self._local_file_queue = CoalescingQueue()
+            self._remote_file_queue = CoalescingQueue()
         self._connected = local()
         self._local_folder_enable = True
         self._local_file_enable = True
@@ -72,10 +97,25 @@ class QueueManager(QObject):
         self._max_local_processors = 0
         self._max_remote_processors = 0
         self._max_generic_processors = 0
+        # Sizes the additional processors pools, the configured ones being the upper bounds
+        self._autoscaler = None
         self.set_max_processors(max_file_processors)
+        if autoscale:
+            self._autoscaler = ProcessorAutoscaler(self._get_max_processors())
+        # Remote folder creations ahead of the LocalFolderProcessor
+        self._folder_pipeline = None
+        if folder_creation_threads > 0:
+            self._folder_pipeline = FolderPipeline(folder_creation_threads, dao=dao)
         self._threads_pool = list()
         self._processors_pool = list()
         self._get_file_lock = Lock()
+        # Idle processors wait here for new items instead of ending
+        self._processors_condition = Condition()
+        self._processors_wakeup = 0
+        self._processors_stopped = False
+        self._parked_processors = set()
+        # Surplus processors ending after a shrink of their pool
+        self._retired_processors = set()
         # Should not operate on thread while we are inspecting them
         '''
         This error required to add a lock for inspecting threads, as the below Traceback shows the processor thread was ended while the method was running
@@ -91,6 +131,20 @@ class QueueManager(QObject):
          AttributeError: 'NoneType' object has no attribute 'worker'
         '''
         self._thread_inspection = Lock()
+        # Local path of the pair each processor handles, read without the inspection lock
+        self._processing_paths = PathRegistry()
+        # Phase timings of the handled pairs
+        self._trace_stats = TraceStats()
+
+        # PARENT DEPENDENCIES
+        self._hold_lock = Lock()
+        # Folders queued for creation, by row id
+        self._pending_folders = set()
+        # Parent folder id to the ids of the children waiting for it, and the other way around
+        self._held_children = defaultdict(set)
+        self._held_parents = dict()
+        self._on_hold_queue = BlacklistQueue(delay=PARENT_WAIT_DELAY)
+        self._released_items = 0
 
         # ERROR HANDLING
         self._error_lock = Lock()
@@ -100,12 +154,21 @@ class QueueManager(QObject):
         self._error_timer.timeout.connect(self._on_error_timer)
         self.newError.connect(self._on_new_error)
         self.queueProcessing.connect(self.launch_processors)
+        self._autoscale_timer = QTimer()
+        self._autoscale_timer.timeout.connect(self._on_autoscale_timer)
         # LAST ACTION
         self._dao.register_queue_manager(self)
 
+    def _create_lane_queue(self):
+        return LaneQueue(lambda item: item.size, SMALL_FILE_SIZE, LARGE_FILE_MAX_WAIT)
+
     def init_processors(self):
         log.trace("Init processors")
+        with self._processors_condition:
+            self._processors_stopped = False
         self.newItem.connect(self.launch_processors)
+        if self._autoscaler is not None:
+            self._autoscale_timer.start(AUTOSCALE_INTERVAL * 1000)
         self.queueProcessing.emit()
 
     def shutdown_processors(self):
@@ -115,6 +178,46 @@ class QueueManager(QObject):
         except TypeError:
             # TypeError: disconnect() failed between 'newItem' and 'launch_processors'
             pass
+        self._autoscale_timer.stop()
+        if self._folder_pipeline is not None:
+            self._folder_pipeline.stop()
+        # Let the parked processors end
+        with self._processors_condition:
+            self._processors_stopped = True
+            self._processors_condition.notify_all()
+
+    def get_processors_wakeup(self):
+        return self._processors_wakeup
+
+    def wake_processors(self):
+        with self._processors_condition:
+            self._processors_wakeup += 1
+            if self._parked_processors:
+                self._processors_condition.notify_all()
+
+    def park_processor(self, worker, wakeup):
+        '''
+        Block an idle processor until something is pushed after the wakeup counter value it read
+        before looking for an item. Return False if the processor should end instead.
+        '''
+        with self._processors_condition:
+            if not self._parked_processors_waiting(worker, wakeup):
+                return worker.is_started() and not self._processors_stopped
+            self._parked_processors.add(worker)
+        try:
+            # Let launch_processors notice the end of the processing
+            self.newItem.emit(None)
+            with self._processors_condition:
+                while self._parked_processors_waiting(worker, wakeup):
+                    self._processors_condition.wait()
+                return worker.is_started() and not self._processors_stopped
+        finally:
+            with self._processors_condition:
+                self._parked_processors.discard(worker)
+
+    def _parked_processors_waiting(self, worker, wakeup):
+        return ((wakeup == self._processors_wakeup or self.is_paused())
+                and worker.is_started() and not self._processors_stopped)
 
     def init_queue(self, queue):
         # Dont need to change modify as State is compatible with QueueItem
@@ -122,7 +225,7 @@ class QueueManager(QObject):
             self.push(item)
 
     def _copy_queue(self, queue):
-        result = deepcopy(queue.queue)
+        result = deepcopy(queue.items())
         result.reverse()
         return result
 
@@ -141,6 +244,67 @@ class QueueManager(QObject):
         self._max_generic_processors = max_generic_processors - 2
         log.trace('number of additional processors: %d local, %d remote, %d generic',
                   self._max_local_processors, self._max_remote_processors, self._max_generic_processors)
+        if self._autoscaler is not None:
+            self._autoscaler.set_bounds(self._get_max_processors())
+
+    def _get_max_processors(self):
+        return self._max_local_processors, self._max_remote_processors, self._max_generic_processors
+
+    def _get_pool_limits(self):
+        # Number of additional processors of each name
+        if self._autoscaler is not None:
+            max_local_processors, max_remote_processors, max_generic_processors = self._autoscaler.processors
+        else:
+            max_local_processors, max_remote_processors, max_generic_processors = self._get_max_processors()
+        limits = dict(LocalFileProcessor=max_local_processors, RemoteFileProcessor=max_remote_processors)
+        if self._file_lanes:
+            limits["SmallFileProcessor"] = min(SMALL_FILE_PROCESSORS, max_generic_processors)
+            max_generic_processors = max_generic_processors - limits["SmallFileProcessor"]
+        limits["GenericProcessor"] = max_generic_processors
+        return limits
+
+    def _get_pool_threads(self, name):
+        return [thread for thread in list(self._processors_pool)
+                if thread.worker.get_name() == name and thread.worker not in self._retired_processors]
+
+    def retire_processor(self, worker):
+        '''
+        Return True if the processor is beyond the size of its pool, it should then end
+        '''
+        with self._processors_condition:
+            limit = self._get_pool_limits().get(worker.get_name())
+            if limit is None:
+                return False
+            threads = self._get_pool_threads(worker.get_name())
+            if len(threads) <= limit or worker not in [thread.worker for thread in threads]:
+                return False
+            self._retired_processors.add(worker)
+            return True
+
+    @pyqtSlot()
+    def _on_autoscale_timer(self):
+        backlogs = (self._local_file_queue.qsize(), self._remote_file_queue.qsize(),
+                    self._local_file_queue.qsize() + self._remote_file_queue.qsize())
+        transfers = (self._get_transfer_rates(["LocalFileProcessor"], upload=True),
+                     self._get_transfer_rates(["RemoteFileProcessor"], download=True),
+                     self._get_transfer_rates(["GenericProcessor", "SmallFileProcessor"], upload=True, download=True))
+        if self._autoscaler.sample(backlogs, transfers, BaseAutomationClient.latency_stats.get_average()) is None:
+            return
+        # Surplus processors end once their current item is done, parked ones right now
+        self.wake_processors()
+        self.launch_processors()
+
+    def _get_transfer_rates(self, names, upload=False, download=False):
+        threads = [self._local_file_thread, self._remote_file_thread] + list(self._processors_pool)
+        thread_ids = [thread.worker.get_thread_id() for thread in threads
+                      if thread is not None and thread.worker.get_name() in names]
+        rate, count = 0, 0
+        for stats, enabled in ((BaseAutomationClient.upload_stats, upload),
+                               (BaseAutomationClient.download_stats, download)):
+            if enabled:
+                stats_rate, stats_count = stats.get_rates(thread_ids)
+                rate, count = rate + stats_rate, count + stats_count
+        return rate, count
 
     def resume(self):
         log.debug("Resuming queue")
@@ -194,6 +358,8 @@ class QueueManager(QObject):
         self._local_file_enable = value
         if self._local_file_thread is not None and not value:
             self._local_file_thread.quit()
+        if value:
+            self.wake_processors()
         if value and emit:
             self.queueProcessing.emit()
 
@@ -201,6 +367,8 @@ class QueueManager(QObject):
         self._local_folder_enable = value
         if self._local_folder_thread is not None and not value:
             self._local_folder_thread.quit()
+        if value:
+            self.wake_processors()
         if value and emit:
             self.queueProcessing.emit()
 
@@ -208,6 +376,8 @@ class QueueManager(QObject):
         self._remote_file_enable = value
         if self._remote_file_thread is not None and not value:
             self._remote_file_thread.quit()
+        if value:
+            self.wake_processors()
         if value and emit:
             self.queueProcessing.emit()
 
@@ -215,6 +385,8 @@ class QueueManager(QObject):
         self._remote_folder_enable = value
         if self._remote_folder_thread is not None and not value:
             self._remote_folder_thread.quit()
+        if value:
+            self.wake_processors()
         if value and emit:
             self.queueProcessing.emit()
 
@@ -230,48 +402,118 @@ class QueueManager(QObject):
     def get_remote_folder_queue(self):
         return self._copy_queue(self._remote_folder_queue)
 
-    def push_ref(self, row_id, folderish, pair_state):
-        self.push(QueueItem(row_id, folderish, pair_state))
+    def get_next_local_folders(self, count):
+        return self._local_folder_queue.peek(count)
+
+    def get_folder_pipeline(self):
+        return self._folder_pipeline
+
+    def push_ref(self, row_id, folderish, pair_state, size=None):
+        self.push(QueueItem(row_id, folderish, pair_state, size=size))
+
+    def _put(self, queue, state):
+        # Only one pending entry per row, drop the one queued with a previous pair_state
+        for other in (self._local_folder_queue, self._local_file_queue,
+                      self._remote_folder_queue, self._remote_file_queue):
+            if other is not queue:
+                other.remove(state.id)
+        queue.put(state)
 
     def push(self, state):
         if state.pair_state is None:
             log.trace("Don't push an empty pair_state: %r", state)
             return
+        self._push(state)
+        self.wake_processors()
+
+    def _push(self, state):
         log.trace("Pushing %r", state)
         row_id = state.id
+        if state.folderish and state.pair_state in ('locally_created', 'remotely_created'):
+            with self._hold_lock:
+                self._pending_folders.add(row_id)
         if state.pair_state.startswith('locally'):
             if state.folderish:
-                self._local_folder_queue.put(state)
+                self._put(self._local_folder_queue, state)
                 log.trace('Pushed to _local_folder_queue, now of size: %d', self._local_folder_queue.qsize())
             else:
                 if "deleted" in state.pair_state:
                     self._engine.cancel_action_on(state.id)
-                self._local_file_queue.put(state)
+                self._put(self._local_file_queue, state)
                 log.trace('Pushed to _local_file_queue, now of size: %d', self._local_file_queue.qsize())
             self.newItem.emit(row_id)
         elif state.pair_state.startswith('remotely'):
             if state.folderish:
-                self._remote_folder_queue.put(state)
+                self._put(self._remote_folder_queue, state)
                 log.trace('Pushed to _remote_folder_queue, now of size: %d', self._remote_folder_queue.qsize())
             else:
                 if "deleted" in state.pair_state:
                     self._engine.cancel_action_on(state.id)
-                self._remote_file_queue.put(state)
+                self._put(self._remote_file_queue, state)
                 log.trace('Pushed to _remote_file_queue, now of size: %d', self._remote_file_queue.qsize())
             self.newItem.emit(row_id)
         else:
             # deleted and conflicted
             log.debug("Not processable state: %r", state)
 
+    def has_pending_folders(self):
+        return len(self._pending_folders) > 0
+
+    def hold_for_parent(self, doc_pair, parent_id):
+        '''
+        Keep the pair out of the queues until its parent folder is created, return False if
+        the parent is not queued for creation
+        '''
+        with self._hold_lock:
+            if parent_id not in self._pending_folders:
+                return False
+            self._held_children[parent_id].add(doc_pair.id)
+            self._held_parents[doc_pair.id] = parent_id
+            # Retried after PARENT_WAIT_DELAY if the parent is never created
+            self._on_hold_queue.push(doc_pair.id, QueueItem(doc_pair.id, doc_pair.folderish, doc_pair.pair_state,
+                                                            size=doc_pair.size))
+        log.trace("Holding %r until its parent %d is created", doc_pair, parent_id)
+        if not self._error_timer.isActive():
+            self.newError.emit(doc_pair.id)
+        return True
+
+    def release_children(self, parent_id):
+        # The parent folder is created: queue the children waiting for it
+        items = []
+        with self._hold_lock:
+            self._pending_folders.discard(parent_id)
+            for child_id in self._held_children.pop(parent_id, ()):
+                del self._held_parents[child_id]
+                item = self._on_hold_queue.remove(child_id)
+                if item is not None:
+                    items.append(item.get())
+            self._released_items += len(items)
+        for item in items:
+            self.push(item)
+
+    def _get_held_items(self):
+        # Children waiting for too long
+        with self._hold_lock:
+            items = [item.get() for item in self._on_hold_queue.process_items()]
+            for item in items:
+                parent_id = self._held_parents.pop(item.id)
+                self._held_children[parent_id].discard(item.id)
+                if not self._held_children[parent_id]:
+                    del self._held_children[parent_id]
+            return items
+
     @pyqtSlot()
     def _on_error_timer(self):
         for item in self._on_error_queue.process_items():
             doc_pair = item.get()
-            queueItem = QueueItem(doc_pair.id, doc_pair.folderish, doc_pair.pair_state)
+            queueItem = QueueItem(doc_pair.id, doc_pair.folderish, doc_pair.pair_state, size=doc_pair.size)
             log.debug('Retrying blacklisted doc_pair: %r', doc_pair)
             self.push(queueItem)
+        for item in self._get_held_items():
+            log.debug('Retrying %r, still waiting for its parent', item)
+            self.push(item)
 
-        if self._on_error_queue.is_empty():
+        if self._on_error_queue.is_empty() and self._on_hold_queue.is_empty():
             self._error_timer.stop()
             log.debug('blacklist queue timer stopped')
 
@@ -363,7 +605,13 @@ class QueueManager(QObject):
             self._get_file_lock.release()
             return None
         state = None
-        if (self._remote_file_queue.qsize() > self._local_file_queue.qsize()):
+        remote_first = self._remote_file_queue.qsize() > self._local_file_queue.qsize()
+        if self._file_lanes:
+            # Prefer the queue with small files waiting
+            remote_small = self._remote_file_queue.has_small()
+            if remote_small != self._local_file_queue.has_small():
+                remote_first = remote_small
+        if remote_first:
             state = self._get_remote_file()
         else:
             state = self._get_local_file()
@@ -372,6 +620,19 @@ class QueueManager(QObject):
             return self._get_file()
         return state
 
+    def _get_small_file(self):
+        # Only used by the processors reserved to small files
+        queues = [self._remote_file_queue, self._local_file_queue]
+        if self._local_file_queue.qsize() > self._remote_file_queue.qsize():
+            queues.reverse()
+        for queue in queues:
+            state = queue.get_small()
+            while state is not None and self._is_on_error(state.id):
+                state = queue.get_small()
+            if state is not None:
+                return state
+        return None
+
     @pyqtSlot()
     def _thread_finished(self):
         self._thread_inspection.acquire()
@@ -379,6 +640,7 @@ class QueueManager(QObject):
             for thread in self._processors_pool:
                 if thread.isFinished():
                     self._processors_pool.remove(thread)
+                    self._retired_processors.discard(thread.worker)
                     QueueManager.clear_client_transfer_stats(thread.worker.get_thread_id())
             if (self._local_folder_thread is not None and
                     self._local_folder_thread.isFinished()):
@@ -403,11 +665,14 @@ class QueueManager(QObject):
         return self.is_active()
 
     def is_active(self):
-        return (self._local_folder_thread is not None
-                or self._local_file_thread is not None
-                or self._remote_file_thread is not None
-                or self._remote_folder_thread is not None
-                or len(self._processors_pool) > 0)
+        # Parked processors are idle
+        threads = [self._local_folder_thread, self._local_file_thread, self._remote_file_thread,
+                   self._remote_folder_thread] + self._processors_pool
+        with self._processors_condition:
+            for thread in threads:
+                if thread is not None and thread.worker not in self._parked_processors:
+                    return True
+        return False
 
     def _create_thread(self, item_getter, name=None):
         processor = self._engine.create_processor(item_getter, name=name)
@@ -431,22 +696,51 @@ class QueueManager(QObject):
         metrics["total_queue"] = (metrics["local_folder_queue"] + metrics["local_file_queue"]
                                   + metrics["remote_folder_queue"] + metrics["remote_file_queue"])
         metrics["additional_processors"] = len(self._processors_pool)
+        metrics["parked_processors"] = len(self._parked_processors)
+        metrics["held_items"] = self._on_hold_queue.size()
+        metrics["released_items"] = self._released_items
+        if self._autoscaler is not None:
+            metrics.update(self._autoscaler.get_metrics())
+            metrics["server_latency"] = int(BaseAutomationClient.latency_stats.get_average() * 1000)
+        if self._folder_pipeline is not None:
+            metrics.update(self._folder_pipeline.get_metrics())
+        if self._file_lanes:
+            local_small, local_large = self._local_file_queue.get_lane_sizes()
+            remote_small, remote_large = self._remote_file_queue.get_lane_sizes()
+            metrics["small_file_queue"] = local_small + remote_small
+            metrics["large_file_queue"] = local_large + remote_large
+        metrics["coalesced_items"] = (self._local_folder_queue.coalesced + self._local_file_queue.coalesced
+                                      + self._remote_folder_queue.coalesced + self._remote_file_queue.coalesced)
         return metrics
 
     def get_overall_size(self):
         return (self._local_folder_queue.qsize() + self._local_file_queue.qsize()
-                + self._remote_folder_queue.qsize() + self._remote_file_queue.qsize())
+                + self._remote_folder_queue.qsize() + self._remote_file_queue.qsize()
+                + self._on_hold_queue.size())
+
+    def add_span(self, span):
+        self._trace_stats.add(span)
+
+    def get_traces(self):
+        return self._trace_stats.to_dict()
+
+    def set_processing(self, worker, doc_pair):
+        # Called by the processors when they pick up or release a pair
+        if doc_pair is None or doc_pair.local_path is None:
+            self._processing_paths.unregister(worker)
+            return
+        folder_threads = (self._local_folder_thread, self._remote_folder_thread)
+        file_worker = not any([thread is not None and thread.worker is worker for thread in folder_threads])
+        self._processing_paths.register(worker, doc_pair.local_path, file_worker=file_worker)
 
     def is_processing_file(self, worker, path, exact_match=False):
-        if not hasattr(worker, "_current_doc_pair"):
-            return False
-        doc_pair = worker._current_doc_pair
-        if (doc_pair is None or doc_pair.local_path is None):
+        local_path = self._processing_paths.get_path(worker)
+        if local_path is None:
             return False
         if exact_match:
-            result = doc_pair.local_path == path
+            result = local_path == path
         else:
-            result = doc_pair.local_path.startswith(path)
+            result = local_path.startswith(path)
         if result:
             log.trace("Worker(%r) is processing: %r", worker.get_metrics(), path)
         return result
@@ -456,44 +750,10 @@ class QueueManager(QObject):
             proc.stop()
 
     def get_processors_on(self, path, exact_match=True):
-        self._thread_inspection.acquire()
-        try:
-            res = []
-            if self._local_folder_thread is not None:
-                if self.is_processing_file(self._local_folder_thread.worker, path, exact_match):
-                    res.append(self._local_folder_thread.worker)
-            if self._remote_folder_thread is not None:
-                if self.is_processing_file(self._remote_folder_thread.worker, path, exact_match):
-                    res.append(self._remote_folder_thread.worker)
-            if self._local_file_thread is not None:
-                if self.is_processing_file(self._local_file_thread.worker, path, exact_match):
-                    res.append(self._local_file_thread.worker)
-            if self._remote_file_thread is not None:
-                if self.is_processing_file(self._remote_file_thread.worker, path, exact_match):
-                    res.append(self._remote_file_thread.worker)
-            for thread in self._processors_pool:
-                if self.is_processing_file(thread.worker, path, exact_match):
-                    res.append(thread.worker)
-            return res
-        finally:
-            self._thread_inspection.release()
+        return self._processing_paths.get_workers(path, exact_match=exact_match)
 
     def has_file_processors_on(self, path):
-        self._thread_inspection.acquire()
-        try:
-            # First check local and remote file
-            if self._local_file_thread is not None:
-                if self.is_processing_file(self._local_file_thread.worker, path):
-                    return True
-            if self._remote_file_thread is not None:
-                if self.is_processing_file(self._remote_file_thread.worker, path):
-                    return True
-            for thread in self._processors_pool:
-                if self.is_processing_file(thread.worker, path):
-                    return True
-            return False
-        finally:
-            self._thread_inspection.release()
+        return len(self._processing_paths.get_workers(path, exact_match=False, file_workers_only=True)) > 0
 
     @pyqtSlot()
     def launch_processors(self):
@@ -529,22 +789,31 @@ class QueueManager(QObject):
         log.trace('max remote processors: %d', self._max_remote_processors)
         log.trace('max local processors: %d', self._max_local_processors)
 
+        limits = self._get_pool_limits()
+        if self._file_lanes:
+            if self._local_file_queue.has_small() or self._remote_file_queue.has_small():
+                while len(self._get_pool_threads("SmallFileProcessor")) < limits["SmallFileProcessor"]:
+                    self._processors_pool.append(self._create_thread(self._get_small_file, name="SmallFileProcessor"))
+                    count += 1
+            if count > 0:
+                log.trace("created %d small file processor%s", count, 's' if count > 1 else '')
+            count = 0
         if not (self._local_file_queue.empty() and self._remote_file_queue.empty()):
-            while len([t for t in self._processors_pool if t.worker.get_name() == "GenericProcessor"]) < self._max_generic_processors:
+            while len(self._get_pool_threads("GenericProcessor")) < limits["GenericProcessor"]:
                 self._processors_pool.append(self._create_thread(self._get_file, name="GenericProcessor"))
                 count += 1
         if count > 0:
             log.trace("created %d additional file processor%s", count, 's' if count > 1 else '')
         count = 0
         if not self._remote_file_queue.empty():
-            while len([t for t in self._processors_pool if t.worker.get_name() == "RemoteFileProcessor"]) < self._max_remote_processors:
+            while len(self._get_pool_threads("RemoteFileProcessor")) < limits["RemoteFileProcessor"]:
                 self._processors_pool.append(self._create_thread(self._get_remote_file, name="RemoteFileProcessor"))
                 count += 1
         if count > 0:
             log.trace("created %d additional remote file processor%s", count, 's' if count > 1 else '')
         count = 0
         if not self._local_file_queue.empty():
-            while len([t for t in self._processors_pool if t.worker.get_name() == "LocalFileProcessor"]) < self._max_local_processors:
+            while len(self._get_pool_threads("LocalFileProcessor")) < limits["LocalFileProcessor"]:
                 self._processors_pool.append(self._create_thread(self._get_local_file, name="LocalFileProcessor"))
                 count += 1
         if count > 0:
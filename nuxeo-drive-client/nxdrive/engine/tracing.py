@@ -0,0 +1,173 @@
+'''
+Timings of the processing phases of each pair
+'''
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from time import time
+
+# Upper bounds in milliseconds of the histogram buckets, the last bucket taking the slower items
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+# Spans kept for inspection
+MAX_SPANS = 100
+
+
+class Phase(object):
+
+    def __init__(self, span, name):
+        self._span = span
+        self._name = name
+
+    def __enter__(self):
+        self._span._enter(self._name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._span._exit()
+        return False
+
+
+class NoPhase(object):
+    # Phase of the code running out of a span
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_PHASE = NoPhase()
+
+
+class Span(object):
+    '''
+    Processing of a pair: the time spent in each phase, a phase running inside another one
+    being only counted for itself
+    '''
+
+    def __init__(self, row_id, clock=time):
+        self.row_id = row_id
+        self.handler = None
+        self.status = 'ok'
+        self.phases = dict()
+        self._clock = clock
+        # Name, start time and time spent in the sub phases of the running phases
+        self._stack = []
+        self.start_time = clock()
+        self.end_time = None
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def _enter(self, name):
+        self._stack.append([name, self._clock(), 0])
+
+    def _exit(self):
+        name, start, children = self._stack.pop()
+        duration = self._clock() - start
+        self.phases[name] = self.phases.get(name, 0) + duration - children
+        if self._stack:
+            self._stack[-1][2] += duration
+
+    def finish(self, status=None):
+        if status is not None:
+            self.status = status
+        self.end_time = self._clock()
+        return self
+
+    def get_duration(self):
+        end_time = self.end_time if self.end_time is not None else self._clock()
+        return end_time - self.start_time
+
+    def get_phases(self):
+        # Milliseconds by phase, 'other' being the time out of any phase
+        phases = dict([(name, int(duration * 1000)) for name, duration in self.phases.iteritems()])
+        phases['other'] = max(int((self.get_duration() - sum(self.phases.values())) * 1000), 0)
+        return phases
+
+    def to_dict(self):
+        return {
+            'id': self.row_id,
+            'handler': self.handler,
+            'status': self.status,
+            'start_time': int(self.start_time * 1000),
+            'duration': int(self.get_duration() * 1000),
+            'phases': self.get_phases(),
+        }
+
+
+class LatencyHistogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, duration):
+        # Duration in milliseconds
+        self.counts[bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def get_percentile(self, percentile):
+        # Upper bound of the bucket holding the percentile, the maximum for the last bucket
+        if self.count == 0:
+            return 0
+        rank = percentile * self.count / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(HISTOGRAM_BUCKETS[i], self.max) if i < len(HISTOGRAM_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'p50': self.get_percentile(50),
+            'p90': self.get_percentile(90),
+            'p99': self.get_percentile(99),
+            'buckets': HISTOGRAM_BUCKETS,
+            'counts': self.counts,
+        }
+
+
+class TraceStats(object):
+    '''
+    Latency histograms of the spans by handler, overall and by phase, with the latest spans
+    '''
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self._lock = Lock()
+        self._handlers = dict()
+        self._spans = deque(maxlen=max_spans)
+
+    def add(self, span):
+        if span.handler is None:
+            return
+        phases = span.get_phases()
+        with self._lock:
+            stats = self._handlers.get(span.handler)
+            if stats is None:
+                stats = self._handlers[span.handler] = (LatencyHistogram(), dict())
+            stats[0].add(int(span.get_duration() * 1000))
+            for name, duration in phases.iteritems():
+                if name not in stats[1]:
+                    stats[1][name] = LatencyHistogram()
+                stats[1][name].add(duration)
+            self._spans.append(span.to_dict())
+
+    def to_dict(self):
+        with self._lock:
+            handlers = dict()
+            for handler, (total, phases) in self._handlers.iteritems():
+                handlers[handler] = {
+                    'total': total.to_dict(),
+                    'phases': dict([(name, histogram.to_dict()) for name, histogram in phases.iteritems()]),
+                }
+            return {'handlers': handlers, 'spans': list(self._spans)}
@@ -127,7 +127,8 @@ class LocalWatcher(EngineWorker):
             self._win_folder_scan_interval = current_time_millis
             while (1):
                 self._interact()
-                sleep(0.01)
+                # Woken up by the watchdog events, or every second on Windows for the delayed checks
+                self._wait(1 if self._windows else None, pending=lambda: not self._watchdog_queue.empty())
                 if trigger_local_scan:
                     self._action = Action("Full local scan")
                     self._scan()
@@ -312,6 +313,11 @@ class LocalWatcher(EngineWorker):
             return 0
 
     def _scan_recursive(self, info, recursive=True):
+        # Commit the states by batch, the recursive calls share the same batch
+        with self._dao.batch_writer():
+            self._do_scan_recursive(info, recursive=recursive)
+
+    def _do_scan_recursive(self, info, recursive=True):
         log.debug('Starting recursive local scan of %r', info.path)
         if recursive:
             # Don't interact if only one level
@@ -697,7 +703,7 @@ class LocalWatcher(EngineWorker):
         except sqlite3.OperationalError:
             log.exception("Don't update as cannot acquire %r", doc_pair)
         finally:
-            self._dao.release_state(self._thread_id)
+            self._dao.release_state(self._thread_id, doc_pair.id)
             if acquired_pair is not None:
                 refreshed_pair = self._dao.get_state_from_id(acquired_pair.id)
                 if refreshed_pair is not None:
@@ -988,6 +994,7 @@ class DriveFSEventHandler(FileSystemEventHandler):
         self.counter = self.counter + 1
         log.trace("Queueing watchdog: %r", event)
         self.watcher._watchdog_queue.put(event)
+        self.watcher.wakeup()
 
 
 class DriveFSRootEventHandler(FileSystemEventHandler):
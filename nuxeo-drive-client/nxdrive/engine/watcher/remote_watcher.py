@@ -7,10 +7,9 @@ from nxdrive.logging_config import get_logger
 from nxdrive.engine.workers import EngineWorker
 from nxdrive.utils import current_milli_time
 from nxdrive.client import NotFound
-from time import sleep
+from time import time
 from datetime import datetime
 from nxdrive.client.common import COLLECTION_SYNC_ROOT_FACTORY_NAME
-from nxdrive.client.remote_file_system_client import RemoteFileInfo
 from nxdrive.engine.activity import Action
 from nxdrive.client.common import safe_filename
 from nxdrive.client.base_automation_client import Unauthorized
@@ -37,7 +36,8 @@ class RemoteWatcher(EngineWorker):
         self.server_interval = delay
         # Review to delete
         self._init()
-        self._current_interval = 0
+        # Time of the next poll
+        self._next_polling = 0
 
     def _init(self):
         self.unhandle_fs_event = False
@@ -63,7 +63,8 @@ class RemoteWatcher(EngineWorker):
         metrics['last_event_log_id'] = self._last_event_log_id
         metrics['last_root_definitions'] = self._last_root_definitions
         metrics['last_remote_full_scan'] = self._last_remote_full_scan
-        metrics['next_polling'] = self._current_interval
+        # In hundredths of second
+        metrics['next_polling'] = max(0, int((self._next_polling - time()) * 100))
         return dict(metrics.items() + self._metrics.items())
 
     @pyqtSlot()
@@ -76,14 +77,14 @@ class RemoteWatcher(EngineWorker):
             self._init()
             while (1):
                 self._interact()
-                if self._current_interval == 0:
-                    #
-                    self._current_interval = self.server_interval * 100
+                if time() >= self._next_polling:
+                    self._next_polling = time() + self.server_interval
+                    # Compact the database outside of the processors if a database error occurred
+                    self._dao.vacuum_if_needed()
+                    self._dao.check_state_counters_if_needed()
                     if self._handle_changes(first_pass):
                         first_pass = False
-                else:
-                    self._current_interval = self._current_interval - 1
-                sleep(0.01)
+                self._wait(self._next_polling - time(), pending=lambda: time() >= self._next_polling)
         except ThreadInterrupt:
             self.remoteWatcherStopped.emit()
             raise
@@ -119,7 +120,8 @@ class RemoteWatcher(EngineWorker):
     @pyqtSlot(str)
     def scan_pair(self, remote_path):
         self._dao.add_path_to_scan(str(remote_path))
-        self._current_interval = 0
+        self._next_polling = 0
+        self.wakeup()
 
     def _scan_pair(self, remote_path):
         if remote_path is None:
@@ -192,86 +194,90 @@ class RemoteWatcher(EngineWorker):
         if remote_parent_path is None:
             return
 
-        # Detect recently deleted children
-        if moved:
-            db_descendants = self._dao.get_remote_descendants_from_ref(doc_pair.remote_ref)
-        else:
-            db_descendants = self._dao.get_remote_descendants(remote_parent_path)
-        descendants = dict()
-        for descendant in db_descendants:
-            descendants[descendant.remote_ref] = descendant
-
-        to_process = []
-        scroll_id = None
-        # TODO: configurable?
-        batch_size = 100
-        t1 = None
-        while True:
-            t0 = datetime.now()
-            if t1 is not None:
-                log.trace('Local processing of descendants of %s (%s) took %s ms', remote_info.name, remote_info.uid,
-                          self._get_elapsed_time_milliseconds(t1, t0))
-            # Scroll through a batch of descendants
-            log.trace('Scrolling through at most [%d] descendants of %s (%s)', batch_size, remote_info.name,
-                      remote_info.uid)
-            scroll_res = self._client.scroll_descendants(remote_info.uid, scroll_id, batch_size=batch_size)
-            t1 = datetime.now()
-            elapsed = self._get_elapsed_time_milliseconds(t0, t1)
-            descendants_info = scroll_res['descendants']
-            if not descendants_info:
-                log.trace('Remote scroll request retrieved no descendants of %s (%s), took %s ms', remote_info.name,
-                          remote_info.uid, elapsed)
-                break
-            log.trace('Remote scroll request retrieved %d descendants of %s (%s), took %s ms', len(descendants_info),
-                      remote_info.name, remote_info.uid, elapsed)
-            scroll_id = scroll_res['scroll_id']
-            # Results are not necessarily sorted
-            descendants_info = sorted(descendants_info, key=lambda x: x.path, reverse=False)
-            # Handle descendants
-            for descendant_info in descendants_info:
-                log.trace('Handling remote descendant: %r', descendant_info)
-                descendant_pair = None
-                if descendant_info.uid in descendants:
-                    descendant_pair = descendants.pop(descendant_info.uid)
-                    if self._check_modified(descendant_pair, descendant_info):
-                        descendant_pair.remote_state = 'modified'
-                    self._dao.update_remote_state(descendant_pair, descendant_info)
-                else:
+        # Commit the states by batch instead of one transaction per descendant
+        with self._dao.batch_writer():
+            # Detect recently deleted children
+            if moved:
+                db_descendants = self._dao.get_remote_descendants_from_ref(doc_pair.remote_ref)
+            else:
+                db_descendants = self._dao.get_remote_descendants(remote_parent_path)
+            descendants = dict()
+            for descendant in db_descendants:
+                descendants[descendant.remote_ref] = descendant
+
+            to_process = []
+            scroll_id = None
+            # TODO: configurable?
+            batch_size = 100
+            t1 = None
+            while True:
+                t0 = datetime.now()
+                if t1 is not None:
+                    log.trace('Local processing of descendants of %s (%s) took %s ms', remote_info.name, remote_info.uid,
+                              self._get_elapsed_time_milliseconds(t1, t0))
+                # Scroll through a batch of descendants
+                log.trace('Scrolling through at most [%d] descendants of %s (%s)', batch_size, remote_info.name,
+                          remote_info.uid)
+                # Dont block the other writers during the request
+                self._dao.flush_batch()
+                scroll_res = self._client.scroll_descendants(remote_info.uid, scroll_id, batch_size=batch_size)
+                t1 = datetime.now()
+                elapsed = self._get_elapsed_time_milliseconds(t0, t1)
+                descendants_info = scroll_res['descendants']
+                if not descendants_info:
+                    log.trace('Remote scroll request retrieved no descendants of %s (%s), took %s ms', remote_info.name,
+                              remote_info.uid, elapsed)
+                    break
+                log.trace('Remote scroll request retrieved %d descendants of %s (%s), took %s ms', len(descendants_info),
+                          remote_info.name, remote_info.uid, elapsed)
+                scroll_id = scroll_res['scroll_id']
+                # Results are not necessarily sorted
+                descendants_info = sorted(descendants_info, key=lambda x: x.path, reverse=False)
+                # Handle descendants
+                for descendant_info in descendants_info:
+                    log.trace('Handling remote descendant: %r', descendant_info)
+                    descendant_pair = None
+                    if descendant_info.uid in descendants:
+                        descendant_pair = descendants.pop(descendant_info.uid)
+                        if self._check_modified(descendant_pair, descendant_info):
+                            descendant_pair.remote_state = 'modified'
+                        self._dao.update_remote_state(descendant_pair, descendant_info)
+                    else:
+                        parent_pair = self._dao.get_normal_state_from_remote(descendant_info.parent_uid)
+                        if parent_pair is None:
+                            log.trace('Cannot find parent pair of remote descendant, postponing processing of %s',
+                                      descendant_info)
+                            to_process.append(descendant_info)
+                            continue
+                        descendant_pair, _ = self._find_remote_child_match_or_create(parent_pair, descendant_info)
+                    if descendant_info.folderish:
+                        self._dao.add_path_scanned(descendant_pair.remote_parent_path + '/' + descendant_pair.remote_ref)
+                # Check if synchronization thread was suspended
+                self._interact()
+
+            if to_process:
+                t0 = datetime.now()
+                to_process = sorted(to_process, key=lambda x: x.path, reverse=False)
+                log.trace('Processing [%d] postponed descendants of %s (%s)', len(to_process), remote_info.name,
+                          remote_info.uid)
+                for descendant_info in to_process:
                     parent_pair = self._dao.get_normal_state_from_remote(descendant_info.parent_uid)
                     if parent_pair is None:
-                        log.trace('Cannot find parent pair of remote descendant, postponing processing of %s',
-                                  descendant_info)
-                        to_process.append(descendant_info)
+                        log.error("Cannot find parent pair of postponed remote descendant, ignoring %s", descendant_info)
                         continue
                     descendant_pair, _ = self._find_remote_child_match_or_create(parent_pair, descendant_info)
-                if descendant_info.folderish:
-                    self._dao.add_path_scanned(descendant_pair.remote_parent_path + '/' + descendant_pair.remote_ref)
-            # Check if synchronization thread was suspended
-            self._interact()
-
-        if to_process:
-            t0 = datetime.now()
-            to_process = sorted(to_process, key=lambda x: x.path, reverse=False)
-            log.trace('Processing [%d] postponed descendants of %s (%s)', len(to_process), remote_info.name,
-                      remote_info.uid)
-            for descendant_info in to_process:
-                parent_pair = self._dao.get_normal_state_from_remote(descendant_info.parent_uid)
-                if parent_pair is None:
-                    log.error("Cannot find parent pair of postponed remote descendant, ignoring %s", descendant_info)
-                    continue
-                descendant_pair, _ = self._find_remote_child_match_or_create(parent_pair, descendant_info)
-                if descendant_info.folderish:
-                    self._dao.add_path_scanned(descendant_pair.remote_parent_path + '/' + descendant_pair.remote_ref)
-            t1 = datetime.now()
-            log.trace('Postponed descendants processing took %s ms', self._get_elapsed_time_milliseconds(t0, t1))
+                    if descendant_info.folderish:
+                        self._dao.add_path_scanned(descendant_pair.remote_parent_path + '/' + descendant_pair.remote_ref)
+                t1 = datetime.now()
+                log.trace('Postponed descendants processing took %s ms', self._get_elapsed_time_milliseconds(t0, t1))
 
-        # Delete remaining
-        for deleted in descendants.values():
-            # TODO Should be DAO
-            # self._dao.mark_descendants_remotely_deleted(deleted)
-            self._dao.delete_remote_state(deleted)
+            # Delete remaining
+            for deleted in descendants.values():
+                # TODO Should be DAO
+                # self._dao.mark_descendants_remotely_deleted(deleted)
+                self._dao.delete_remote_state(deleted)
 
-        self._dao.add_path_scanned(remote_parent_path)
+            self._dao.add_path_scanned(remote_parent_path)
 
     def _get_elapsed_time_milliseconds(self, t0, t1):
         delta = t1 - t0
@@ -434,7 +440,7 @@ class RemoteWatcher(EngineWorker):
         if self._engine.is_offline():
             try:
                 # Try to get the api
-                self._client.fetch_api()
+                self._client.fetch_api(use_cache=False)
                 # if retrieved
                 self._engine.set_offline(False)
                 return self._client
@@ -629,13 +635,8 @@ class RemoteWatcher(EngineWorker):
                             if remote_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME:
                                 new_info_parent_uid = doc_pair.remote_parent_ref
                                 new_info_path = (doc_pair.remote_parent_path + '/' + remote_ref)
-                                consistent_new_info = RemoteFileInfo(new_info.name, new_info.uid, new_info_parent_uid,
-                                                                     new_info_path, new_info.folderish,
-                                                                     new_info.last_modification_time,
-                                                                     new_info.last_contributor, new_info.digest,
-                                                                     new_info.digest_algorithm, new_info.download_url,
-                                                                     new_info.can_rename, new_info.can_delete,
-                                                                     new_info.can_update, new_info.can_create_child)
+                                consistent_new_info = new_info._replace(parent_uid=new_info_parent_uid,
+                                                                        path=new_info_path)
                             # Perform a regular document update on a document
                             # that has been updated, renamed or moved
                             log.debug("Refreshing remote state info"
@@ -1,7 +1,7 @@
 '''
 @author: Remi Cattiau
 '''
-from PyQt4.QtCore import QThread, QObject, pyqtSignal, pyqtSlot, QCoreApplication
+from PyQt4.QtCore import QThread, QObject, pyqtSignal, pyqtSlot, QCoreApplication, QEventLoop, QTimer
 from threading import current_thread
 from time import sleep, time
 from nxdrive.engine.activity import Action, IdleAction
@@ -33,6 +33,7 @@ class Worker(QObject):
     _pause = False
     actionUpdate = pyqtSignal(object)
     stopWorker = pyqtSignal()
+    wakeupWorker = pyqtSignal()
 
     def __init__(self, thread=None, name=None):
         super(Worker, self).__init__()
@@ -45,8 +46,13 @@ class Worker(QObject):
             name = type(self).__name__
         self._name = name
         self._running = False
+        # Times the thread went out of _wait
+        self._wakeups = 0
+        self._wakeup_pending = False
+        self._wait_timer = None
         self._thread.terminated.connect(self._terminated)
         self.stopWorker.connect(self.quit)
+        self.wakeupWorker.connect(self._wakeup)
 
     @pyqtSlot()
     def quit(self):
@@ -72,10 +78,43 @@ class Worker(QObject):
 
     def resume(self):
         self._pause = False
+        self.wakeup()
 
     def suspend(self):
         self._pause = True
 
+    def wakeup(self):
+        # Can be called from any thread: the queued signal ends the wait of the worker thread
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
+            self.wakeupWorker.emit()
+
+    @pyqtSlot()
+    def _wakeup(self):
+        pass
+
+    def _wait(self, timeout=None, pending=None):
+        '''
+        Block the worker thread until an event is posted to it, like a queued signal or a wakeup,
+        or for timeout seconds. Return at once if pending() tells work is left: its wakeup can
+        already have been processed by _interact
+        '''
+        # Cleared before the check, a later wakeup posts a new event
+        self._wakeup_pending = False
+        if not self._continue or (pending is not None and pending()):
+            self._wakeups += 1
+            return
+        if timeout is not None:
+            if self._wait_timer is None:
+                # Created in the worker thread
+                self._wait_timer = QTimer()
+                self._wait_timer.setSingleShot(True)
+            self._wait_timer.start(max(0, int(timeout * 1000)))
+        QCoreApplication.processEvents(QEventLoop.WaitForMoreEvents)
+        if self._wait_timer is not None:
+            self._wait_timer.stop()
+        self._wakeups += 1
+
     def _end_action(self):
         Action.finish_action()
         self._action = None
@@ -93,8 +132,7 @@ class Worker(QObject):
         QCoreApplication.processEvents()
         # Handle thread pause
         while (self._pause and self._continue):
-            QCoreApplication.processEvents()
-            sleep(0.01)
+            self._wait(pending=lambda: not self._pause)
         # Handle thread interruption
         if not self._continue:
             raise ThreadInterrupt()
@@ -102,7 +140,7 @@ class Worker(QObject):
     def _execute(self):
         while (1):
             self._interact()
-            sleep(0.01)
+            self._wait()
 
     def _terminated(self):
         log.debug("Thread %s(%r) terminated"
@@ -125,6 +163,7 @@ class Worker(QObject):
         metrics['thread_id'] = self._thread_id
         # Get action from activity as methods can have its own Action
         metrics['action'] = self.get_action()
+        metrics['wakeups'] = self._wakeups
         if hasattr(self, '_metrics'):
             metrics = dict(metrics.items() + self._metrics.items())
         return metrics
@@ -176,6 +215,11 @@ class EngineWorker(Worker):
     def _reset_clients(self):
         pass
 
+    def _wait(self, timeout=None, pending=None):
+        # An open batch holds the DAO lock
+        self._dao.flush_batch()
+        super(EngineWorker, self)._wait(timeout=timeout, pending=pending)
+
     def _clean(self, reason, e=None):
         if e is not None and type(e) == HTTPError:
             if e.code == 401:
@@ -228,6 +272,7 @@ class PollWorker(Worker):
     @pyqtSlot()
     def force_poll(self):
         self._next_check = 0
+        self.wakeup()
 
     def _execute(self):
         while (self._enable):
@@ -236,7 +281,7 @@ class PollWorker(Worker):
                 if self._poll():
                     self._metrics['last_poll'] = int(time())
                 self._next_check = int(time()) + self._check_interval
-            sleep(0.01)
+            self._wait(self._next_check - time(), pending=lambda: self.get_next_poll() <= 0)
 
     def _poll(self):
         return True
@@ -250,7 +295,7 @@ class DummyWorker(Worker):
     def _execute(self):
         while (1):
             self._interact()
-            sleep(0.01)
+            self._wait()
 
 
 '''
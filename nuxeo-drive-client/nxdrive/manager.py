@@ -19,6 +19,7 @@ from nxdrive.logging_config import get_logger, FILE_HANDLER
 from nxdrive.client.base_automation_client import get_proxies_for_handler
 from nxdrive.client.base_automation_client import BaseAutomationClient
 from nxdrive.client.base_automation_client import get_number_of_processors
+from nxdrive.client.operation_cache import OperationCache, DEFAULT_OPERATION_CACHE_TTL
 from nxdrive.utils import normalized_path
 from nxdrive.utils import get_default_home
 from nxdrive.updater import AppUpdater
@@ -336,6 +337,9 @@ class Manager(QtCore.QObject):
         self.remote_watcher_delay = options.delay
         self._nofscheck = options.nofscheck
         self._debug = options.debug
+        self._file_scheduling = options.file_scheduling
+        self._autoscale_processors = options.autoscale_processors is True
+        self._folder_creation_threads = options.folder_creation_threads
         self._engine_definitions = None
         self._engine_types = dict()
         from nxdrive.engine.next.engine_next import EngineNext
@@ -347,6 +351,12 @@ class Manager(QtCore.QObject):
         self.proxy_exceptions = None
         self._app_updater = None
         self._dao = None
+        from nxdrive.engine.dao.sqlite import ConfigurationDAO
+        ConfigurationDAO.set_connection_profile(journal_mode=options.db_journal_mode,
+                                                synchronous=options.db_synchronous,
+                                                mmap_size=options.db_mmap_size,
+                                                cache_size=options.db_cache_size,
+                                                temp_store=options.db_temp_store)
         self._create_dao()
         if options.proxy_server is not None:
             proxy = ProxySettings()
@@ -381,6 +391,16 @@ class Manager(QtCore.QObject):
         download_rate = self._dao.get_config('download_rate') or options.download_rate or -1
         BaseAutomationClient.set_download_rate_limit(download_rate)
         log.debug('download rate: %s', str(BaseAutomationClient.download_token_bucket))
+        download_segments = options.download_segments
+        if isinstance(download_segments, int) and download_segments > 0:
+            BaseAutomationClient.download_segments = download_segments
+
+        # Keep the operations of the servers between the clients and the starts
+        operation_cache_ttl = options.operation_cache_ttl
+        if not isinstance(operation_cache_ttl, int) or operation_cache_ttl < 0:
+            operation_cache_ttl = DEFAULT_OPERATION_CACHE_TTL
+        BaseAutomationClient.operation_cache = OperationCache(
+            ttl=operation_cache_ttl, path=os.path.join(normalized_path(self.nxdrive_home), "operations.json"))
         self.config_watcher = ConfigWatcher()
 
         # Create DirectEdit
@@ -467,6 +487,19 @@ class Manager(QtCore.QObject):
     def is_debug(self):
         return self._debug
 
+    def get_file_scheduling(self):
+        if self._file_scheduling not in ('fifo', 'priority'):
+            return 'fifo'
+        return self._file_scheduling
+
+    def is_autoscale_processors(self):
+        return self._autoscale_processors
+
+    def get_folder_creation_threads(self):
+        if not isinstance(self._folder_creation_threads, int) or self._folder_creation_threads < 0:
+            return 0
+        return self._folder_creation_threads
+
     def is_checkfs(self):
         return not self._nofscheck
 
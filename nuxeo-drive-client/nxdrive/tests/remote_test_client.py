@@ -46,9 +46,9 @@ class RemoteTestClient(RemoteFileSystemClient):
         else:
             raise self._upload_remote_error
 
-    def fetch_api(self):
+    def fetch_api(self, use_cache=True):
         if self._server_error is None:
-            return super(RemoteTestClient, self).fetch_api()
+            return super(RemoteTestClient, self).fetch_api(use_cache=use_cache)
         else:
             raise self._server_error
 
@@ -0,0 +1,212 @@
+'''
+Local HTTP server answering the Automation operations used by the remote clients
+'''
+import hashlib
+import json
+import socket
+import sys
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from collections import defaultdict
+from itertools import count
+from threading import Lock, Thread
+from nxdrive.client import RemoteFileSystemClient
+
+OPERATIONS = {
+    'NuxeoDrive.GetChangeSummary': ('lowerBound', 'lastSyncActiveRootDefinitions'),
+    'NuxeoDrive.CreateFolder': ('parentId', 'name'),
+    'NuxeoDrive.Delete': ('id', 'parentId'),
+    'NuxeoDrive.GetFileSystemItem': ('id', 'parentId'),
+    'NuxeoDrive.GetChildren': ('id',),
+}
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connections closed by the clients or by close_connections
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class StubAutomationHandler(BaseHTTPRequestHandler):
+    # Answer in one segment, as a real server, not to wait for the delayed ACK of a kept alive connection
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.stub.add_connection(self.connection)
+        if self.server.stub.keep_alive:
+            self.protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, result, code=200):
+        body = json.dumps(result)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith('/site/automation/'):
+            self._send_json(self.server.stub.get_operations())
+            return
+        stub = self.server.stub
+        content_range = self.headers.getheader('Range') if stub.accept_ranges else None
+        content = stub.get_blob(self.path, ranged=content_range is not None)
+        if content is None:
+            self.send_error(404)
+            return
+        if content_range is None:
+            self.send_response(200)
+        else:
+            # Only the bytes=start-end form sent by the clients
+            start, end = [int(bound) for bound in content_range.split('=', 1)[1].split('-')]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(content)))
+            content = content[start:end + 1]
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        if stub.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not stub.bandwidth:
+            self.wfile.write(content)
+            return
+        # Throttled as on a slow link
+        chunk_size = max(stub.bandwidth / 10, 1)
+        for i in range(0, len(content), chunk_size):
+            self.wfile.write(content[i:i + chunk_size])
+            self.wfile.flush()
+            time.sleep(float(len(content[i:i + chunk_size])) / stub.bandwidth)
+
+    def do_POST(self):
+        operation = self.path.rsplit('/', 1)[-1]
+        length = int(self.headers.getheader('Content-Length', 0))
+        params = json.loads(self.rfile.read(length)).get('params', {})
+        result = self.server.stub.execute(operation, params)
+        if result is None:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._send_json(result)
+
+
+class StubAutomationServer(object):
+    '''
+    Each operation answers after latency seconds, calls counts them by name and connections
+    counts the accepted connections, kept alive between the requests with keep_alive. The
+    listing of the operations, counted as 'operations', has extra_operations more. The
+    downloads of the files are counted as 'download', the ones of a range, answered with
+    accept_ranges, as 'range'. Each connection sends the files at bandwidth bytes per second.
+    '''
+
+    def __init__(self, latency=0, keep_alive=True, extra_operations=0, accept_ranges=False, bandwidth=None):
+        self.latency = latency
+        self.keep_alive = keep_alive
+        self.extra_operations = extra_operations
+        self.accept_ranges = accept_ranges
+        self.bandwidth = bandwidth
+        self.calls = defaultdict(int)
+        self.connections = 0
+        # Items by id and contents by download URL
+        self._items = dict()
+        self._blobs = dict()
+        self._sockets = []
+        self._lock = Lock()
+        self._ids = count(1)
+        self._server = ThreadedHTTPServer(('127.0.0.1', 0), StubAutomationHandler)
+        self._server.stub = self
+        self._thread = None
+        self.url = 'http://127.0.0.1:%d/nuxeo/' % self._server.server_address[1]
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def get_remote_client(self):
+        return RemoteFileSystemClient(self.url, 'Administrator', 'stub-device', '2.1', password='Administrator')
+
+    def add_connection(self, connection):
+        with self._lock:
+            self.connections += 1
+            self._sockets.append(connection)
+
+    def close_connections(self):
+        # As a server closing its idle keep-alive connections
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+        for connection in sockets:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def get_operations(self):
+        with self._lock:
+            self.calls['operations'] += 1
+        operations = []
+        for name, params in OPERATIONS.items():
+            operations.append({'id': name, 'params': [{'name': param, 'required': False} for param in params]})
+        for i in range(self.extra_operations):
+            operations.append({
+                'id': 'Stub.Operation%d' % i, 'aliases': ['Stub.Alias%d' % i], 'label': 'Stub operation %d' % i,
+                'description': 'Operation padding the listing as the ones of a real server',
+                'params': [{'name': 'param%d' % j, 'type': 'string', 'required': False} for j in range(3)],
+            })
+        return {'operations': operations}
+
+    def execute(self, operation, params):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if operation == 'NuxeoDrive.CreateFolder':
+            return self.create_folder(params['parentId'], params['name'])
+        if operation == 'NuxeoDrive.GetFileSystemItem':
+            return self._items.get(params['id'])
+        if operation == 'NuxeoDrive.GetChildren':
+            return [item for item in self._items.values() if item['parentId'] == params['id']]
+        return None
+
+    def create_folder(self, parent_id, name):
+        uid = 'defaultFileSystemItemFactory#default#folder-%d' % next(self._ids)
+        item = {
+            'id': uid, 'parentId': parent_id, 'name': name, 'path': '/%s/%s' % (parent_id, uid), 'folder': True,
+            'lastModificationDate': int(time.time() * 1000), 'canRename': True, 'canDelete': True,
+            'canCreateChild': True,
+        }
+        self._items[uid] = item
+        return item
+
+    def add_file(self, parent_id, name, content, digest=None):
+        uid = 'defaultFileSystemItemFactory#default#file-%d' % next(self._ids)
+        download_url = 'nxfile/default/%s/blobholder:0/%s' % (uid.rsplit('#', 1)[-1], name)
+        item = {
+            'id': uid, 'parentId': parent_id, 'name': name, 'path': '/%s/%s' % (parent_id, uid), 'folder': False,
+            'lastModificationDate': int(time.time() * 1000), 'canRename': True, 'canDelete': True,
+            'canUpdate': True, 'digest': digest or hashlib.md5(content).hexdigest(), 'digestAlgorithm': 'MD5',
+            'downloadURL': download_url, 'size': len(content),
+        }
+        self._items[uid] = item
+        self._blobs['/nuxeo/' + download_url] = content
+        return item
+
+    def get_blob(self, path, ranged=False):
+        content = self._blobs.get(path)
+        if content is not None:
+            with self._lock:
+                self.calls['range' if ranged else 'download'] += 1
+        return content
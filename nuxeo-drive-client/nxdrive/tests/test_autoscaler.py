@@ -0,0 +1,83 @@
+import unittest
+from mock import Mock
+from nxdrive.engine.autoscaler import ProcessorAutoscaler, HYSTERESIS_SAMPLES
+from nxdrive.engine.queue_manager import QueueManager
+
+IDLE = (0, 0)
+
+
+class ProcessorAutoscalerTest(unittest.TestCase):
+
+    def _sample(self, autoscaler, samples, backlogs=(0, 0, 0), transfers=(IDLE, IDLE, IDLE), latency=0.1):
+        results = [autoscaler.sample(backlogs, transfers, latency) for _ in range(samples)]
+        return [result for result in results if result is not None]
+
+    def test_hysteresis(self):
+        autoscaler = ProcessorAutoscaler((2, 4, 10))
+        self.assertEquals(autoscaler.processors, [2, 4, 10])
+        # A slow server shrinks all the pools, after HYSTERESIS_SAMPLES samples
+        self.assertEquals(self._sample(autoscaler, HYSTERESIS_SAMPLES - 1, latency=5), [])
+        self.assertEquals(self._sample(autoscaler, 1, latency=5), [(1, 3, 9)])
+        # An isolated sample does not change anything
+        self._sample(autoscaler, HYSTERESIS_SAMPLES - 1, latency=5)
+        self._sample(autoscaler, 1)
+        self.assertEquals(self._sample(autoscaler, HYSTERESIS_SAMPLES - 1, latency=5), [])
+        # Backlog grows the pools back, up to the configured processors
+        changes = self._sample(autoscaler, HYSTERESIS_SAMPLES * 10, backlogs=(100, 100, 100))
+        self.assertEquals(changes[-1], (2, 4, 10))
+        self.assertEquals(autoscaler.processors, [2, 4, 10])
+        # Latency between the bounds is neutral
+        self.assertEquals(self._sample(autoscaler, HYSTERESIS_SAMPLES * 2, latency=1.5), [])
+        self.assertEquals(autoscaler.decisions, 1 + 1 + 1 + 3)
+        metrics = autoscaler.get_metrics()
+        self.assertEquals(metrics['autoscale_generic_processors'], 10)
+        self.assertEquals(metrics['autoscale_last_decision'], 'grow generic to 10')
+
+    def test_bandwidth_saturation(self):
+        autoscaler = ProcessorAutoscaler((0, 4, 0))
+        # A single download gets 1000
+        self._sample(autoscaler, 1, transfers=(IDLE, (1000, 1), IDLE))
+        # Four concurrent downloads share the same bandwidth
+        changes = self._sample(autoscaler, HYSTERESIS_SAMPLES, backlogs=(0, 100, 100),
+                               transfers=(IDLE, (1000, 4), IDLE))
+        self.assertEquals(changes, [(0, 3, 0)])
+        # Do not grow again while the transfers do not scale
+        self.assertEquals(self._sample(autoscaler, HYSTERESIS_SAMPLES, backlogs=(0, 100, 100),
+                                       transfers=(IDLE, (2000, 3), IDLE)), [])
+        # Grow when they do
+        self.assertEquals(self._sample(autoscaler, HYSTERESIS_SAMPLES, backlogs=(0, 100, 100),
+                                       transfers=(IDLE, (2700, 3), IDLE)), [(0, 4, 0)])
+
+    def test_bounds(self):
+        autoscaler = ProcessorAutoscaler((2, 2, 2), min_processors=(1, 0, 5))
+        self._sample(autoscaler, HYSTERESIS_SAMPLES * 10, latency=5)
+        self.assertEquals(autoscaler.processors, [1, 0, 2])
+        autoscaler.set_bounds((3, 3, 3))
+        self.assertEquals(autoscaler.processors, [3, 3, 3])
+
+    def _create_thread(self, name):
+        thread = Mock()
+        thread.worker.get_name.return_value = name
+        return thread
+
+    def test_queue_manager(self):
+        manager = QueueManager(Mock(), Mock(), max_file_processors=(1, 1, 5), autoscale=True)
+        manager._processors_pool = [self._create_thread("GenericProcessor") for _ in range(3)]
+        workers = [thread.worker for thread in manager._processors_pool]
+        self.assertFalse(manager.retire_processor(workers[0]))
+        manager._autoscaler.sample((0, 0, 0), (IDLE, IDLE, IDLE), 5)
+        manager._autoscaler.sample((0, 0, 0), (IDLE, IDLE, IDLE), 5)
+        manager._autoscaler.sample((0, 0, 0), (IDLE, IDLE, IDLE), 5)
+        # Only one surplus processor retires
+        self.assertTrue(manager.retire_processor(workers[1]))
+        self.assertFalse(manager.retire_processor(workers[2]))
+        self.assertFalse(manager.retire_processor(workers[1]))
+        metrics = manager.get_metrics()
+        self.assertEquals(metrics['autoscale_generic_processors'], 2)
+        self.assertEquals(metrics['autoscale_last_decision'], 'shrink generic to 2')
+        # Idle queues with a fast server
+        manager._on_autoscale_timer()
+        self.assertEquals(manager.get_metrics()['autoscale_decisions'], 1)
+        # Static pools without autoscaler
+        manager = QueueManager(Mock(), Mock(), max_file_processors=(1, 1, 5))
+        self.assertFalse('autoscale_decisions' in manager.get_metrics())
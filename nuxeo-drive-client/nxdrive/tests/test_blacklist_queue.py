@@ -4,10 +4,13 @@ Created on 2 juil. 2015
 @author: Remi Cattiau
 '''
 import unittest
+from nose.plugins.attrib import attr
 from nxdrive.engine.blacklist_queue import BlacklistQueue
-from time import sleep
+from time import sleep, time
 from nxdrive.tests.common_unit_test import log
 
+STRESS_ITEMS = 100000
+
 
 class BlacklistQueueTest(unittest.TestCase):
 
@@ -139,3 +142,58 @@ class BlacklistQueueTest(unittest.TestCase):
 
         self.assertTrue(queue.is_empty(), 'queue is not empty')
         self.assertEqual(count, 7, "all items should have been ready for processing after repush")
+
+    def test_remove_and_repush(self):
+        queue = BlacklistQueue(delay=1)
+        queue.push(1, "Item1")
+        queue.push(2, "Item2")
+        queue.remove(1)
+        queue.repush_by_id(2, increase_wait=False)
+        self.assertFalse(queue.exists(1))
+        self.assertTrue(queue.exists(2))
+        sleep(3)
+        items = list(queue.process_items(remove=False))
+        self.assertEqual([item.get_id() for item in items], [2])
+        self.assertEqual(queue.size(), 1)
+        self.assertEqual(queue.get().get_id(), 2)
+        self.assertIsNone(queue.get())
+        self.assertTrue(queue.is_empty())
+
+    def test_due_order(self):
+        # Due items come out in push order whatever their random offset
+        queue = BlacklistQueue(delay=1)
+        for i in range(20):
+            queue.push(i, "Item%d" % i)
+        sleep(3)
+        self.assertEqual([item.get_id() for item in queue.process_items(remove=False)], range(20))
+        self.assertEqual([queue.get().get_id() for _ in range(20)], range(20))
+        self.assertTrue(queue.is_empty())
+
+    @attr(priority=2)
+    def test_stress(self):
+        queue = BlacklistQueue(delay=3600)
+        start = time()
+        for i in xrange(STRESS_ITEMS):
+            queue.push(i, "Item%d" % i)
+        push_time = time() - start
+        # What the error timer of the QueueManager does every second while nothing is due
+        start = time()
+        for _ in xrange(1000):
+            for item in queue.process_items():
+                pass
+            queue.exists(STRESS_ITEMS / 2)
+        idle_time = time() - start
+        self.assertEqual(queue.size(), STRESS_ITEMS)
+        queue = BlacklistQueue(delay=1)
+        for i in xrange(STRESS_ITEMS):
+            queue.push(i, "Item%d" % i)
+        sleep(4)
+        start = time()
+        count = 0
+        for item in queue.process_items():
+            count += 1
+        due_time = time() - start
+        log.info("%d items: push %.3fs, 1000 timer calls without due items %.3fs, processing all items %.3fs",
+                 STRESS_ITEMS, push_time, idle_time, due_time)
+        self.assertEqual(count, STRESS_ITEMS)
+        self.assertTrue(queue.is_empty())
@@ -0,0 +1,186 @@
+import unittest
+from mock import Mock
+from threading import Thread
+from time import sleep
+from nxdrive.engine.coalescing_queue import CoalescingQueue, LaneQueue
+from nxdrive.engine.queue_manager import QueueManager, QueueItem
+
+# Simulated workload: one large file pushed before many small ones
+SMALL_FILES = 100
+SMALL_FILE_DURATION = 1
+LARGE_FILE_DURATION = 300
+LARGE_FILE_MAX_WAIT = 50
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CoalescingQueueTest(unittest.TestCase):
+
+    def test_coalescing(self):
+        queue = CoalescingQueue()
+        queue.put(QueueItem(1, False, 'locally_modified'))
+        queue.put(QueueItem(2, False, 'locally_created'))
+        for _ in range(50):
+            queue.put(QueueItem(1, False, 'locally_modified'))
+        queue.put(QueueItem(1, False, 'locally_deleted'))
+        self.assertEquals(queue.qsize(), 2)
+        self.assertEquals(queue.coalesced, 51)
+        # Latest state wins and keeps the position of the first push
+        item = queue.get()
+        self.assertEquals(item.id, 1)
+        self.assertEquals(item.pair_state, 'locally_deleted')
+        self.assertEquals(queue.get().id, 2)
+        self.assertTrue(queue.empty())
+        queue.put(QueueItem(1, False, 'locally_modified'))
+        self.assertEquals(queue.qsize(), 1)
+
+    def test_remove(self):
+        queue = CoalescingQueue()
+        queue.put(QueueItem(1, False, 'locally_modified'))
+        self.assertFalse(queue.remove(2))
+        self.assertTrue(queue.remove(1))
+        self.assertTrue(queue.empty())
+        self.assertEquals(queue.coalesced, 1)
+
+    def test_queue_manager_push(self):
+        manager = QueueManager(Mock(), Mock())
+        for _ in range(10):
+            manager.push_ref(1, False, 'locally_modified')
+        manager.push_ref(2, True, 'remotely_created')
+        self.assertEquals(len(manager.get_local_file_queue()), 1)
+        # A pair moves to the queue of its latest state
+        manager.push_ref(1, False, 'remotely_modified')
+        self.assertEquals(len(manager.get_local_file_queue()), 0)
+        self.assertEquals(manager.get_remote_file_queue()[0].pair_state, 'remotely_modified')
+        metrics = manager.get_metrics()
+        self.assertEquals(metrics["total_queue"], 2)
+        self.assertEquals(metrics["coalesced_items"], 10)
+
+    def _create_lane_queue(self, clock=None, max_wait=60):
+        return LaneQueue(lambda item: item.size, 1000, max_wait, clock=clock or Clock())
+
+    def test_lanes(self):
+        clock = Clock()
+        queue = self._create_lane_queue(clock)
+        queue.put(QueueItem(1, False, 'remotely_created', size=5000))
+        queue.put(QueueItem(2, False, 'remotely_created', size=10))
+        queue.put(QueueItem(3, False, 'remotely_created'))
+        queue.put(QueueItem(4, False, 'remotely_created', size=10))
+        self.assertEquals(queue.get_lane_sizes(), (3, 1))
+        self.assertEquals(queue.get().id, 2)
+        # Unknown size goes to the small lane
+        self.assertEquals(queue.get().id, 3)
+        # The large item waited too long
+        clock.now = 61
+        self.assertEquals(queue.get().id, 1)
+        self.assertEquals(queue.get().id, 4)
+        self.assertTrue(queue.empty())
+        queue.put(QueueItem(5, False, 'remotely_created', size=5000))
+        self.assertIsNone(queue.get_small())
+        self.assertFalse(queue.has_small())
+        self.assertEquals(queue.get().id, 5)
+
+    def test_lanes_remove(self):
+        queue = self._create_lane_queue()
+        queue.put(QueueItem(1, False, 'remotely_created', size=5000))
+        queue.put(QueueItem(2, False, 'remotely_created', size=10))
+        # Coalescing keeps the lane of the first push
+        queue.put(QueueItem(2, False, 'remotely_modified', size=5000))
+        self.assertEquals(queue.get_lane_sizes(), (1, 1))
+        self.assertTrue(queue.remove(1))
+        self.assertEquals(queue.get_lane_sizes(), (1, 0))
+        self.assertEquals(queue.get_small().pair_state, 'remotely_modified')
+        self.assertTrue(queue.empty())
+
+    def _simulate(self, queue, clock):
+        # Single processor: return the completion time of each item
+        queue.put(QueueItem(0, False, 'remotely_created', size=5000))
+        for i in range(1, SMALL_FILES + 1):
+            queue.put(QueueItem(i, False, 'remotely_created', size=10))
+        completed = dict()
+        while not queue.empty():
+            item = queue.get()
+            clock.now += LARGE_FILE_DURATION if item.size > 1000 else SMALL_FILE_DURATION
+            completed[item.id] = clock.now
+        return completed
+
+    def test_small_files_first(self):
+        fifo = self._simulate(CoalescingQueue(), Clock())
+        clock = Clock()
+        priority = self._simulate(self._create_lane_queue(clock, max_wait=LARGE_FILE_MAX_WAIT), clock)
+        fifo_mean = sum([fifo[i] for i in range(1, SMALL_FILES + 1)]) / float(SMALL_FILES)
+        priority_mean = sum([priority[i] for i in range(1, SMALL_FILES + 1)]) / float(SMALL_FILES)
+        self.assertEquals(fifo[0], LARGE_FILE_DURATION)
+        self.assertLess(priority_mean, fifo_mean / 1.5)
+        self.assertEquals(priority[LARGE_FILE_MAX_WAIT], LARGE_FILE_MAX_WAIT)
+        # Aging: the large file does not wait for all the small ones
+        self.assertEquals(priority[0], LARGE_FILE_MAX_WAIT + 1 + LARGE_FILE_DURATION)
+
+    def test_queue_manager_priority(self):
+        dao = Mock()
+        manager = QueueManager(Mock(), dao, file_scheduling='priority')
+        manager.push_ref(1, False, 'remotely_created', size=50 * 1024 * 1024)
+        manager.push(QueueItem(2, False, 'remotely_created', size=10))
+        manager.push_ref(3, True, 'remotely_created')
+        metrics = manager.get_metrics()
+        self.assertEquals(metrics["small_file_queue"], 1)
+        self.assertEquals(metrics["large_file_queue"], 1)
+        # The size comes with the push
+        self.assertFalse(dao.get_state_from_id.called)
+        self.assertEquals(manager._get_small_file().id, 2)
+        self.assertIsNone(manager._get_small_file())
+        self.assertEquals(manager._get_file().id, 1)
+
+    def _park(self, manager, worker, result):
+        wakeup = manager.get_processors_wakeup()
+        result.append(manager._get_local_file())
+        result.append(manager.park_processor(worker, wakeup))
+        result.append(manager._get_local_file())
+
+    def _start_parked(self, manager, worker, result):
+        thread = Thread(target=self._park, args=(manager, worker, result))
+        thread.start()
+        while worker not in manager._parked_processors:
+            sleep(0.01)
+        self.assertFalse(manager.is_active())
+        self.assertEquals(manager.get_metrics()["parked_processors"], 1)
+        return thread
+
+    def test_park_processor(self):
+        manager = QueueManager(Mock(), Mock())
+        worker = Mock()
+        worker.is_started.return_value = True
+        # Woken up by a push
+        result = []
+        thread = self._start_parked(manager, worker, result)
+        manager.push_ref(1, False, 'locally_modified')
+        thread.join(5)
+        self.assertEquals(result[:2], [None, True])
+        self.assertEquals(result[2].id, 1)
+        # Item pushed before parking
+        wakeup = manager.get_processors_wakeup()
+        manager.push_ref(2, False, 'locally_modified')
+        self.assertTrue(manager.park_processor(worker, wakeup))
+        # Released on shutdown
+        result = []
+        thread = self._start_parked(manager, worker, result)
+        manager.shutdown_processors()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEquals(result[1], False)
+        self.assertFalse(manager.park_processor(worker, manager.get_processors_wakeup()))
+        # Released when the worker is stopped
+        manager = QueueManager(Mock(), Mock())
+        result = []
+        thread = self._start_parked(manager, worker, result)
+        worker.is_started.return_value = False
+        manager.wake_processors()
+        thread.join(5)
+        self.assertEquals(result[1], False)
@@ -0,0 +1,138 @@
+import errno
+import httplib
+import socket
+import unittest
+import urllib2
+from mock import Mock, patch
+from time import time
+from nose.plugins.attrib import attr
+from nxdrive.client.base_automation_client import BaseAutomationClient
+from nxdrive.client.connection_pool import ConnectionPool, KeepAliveHTTPHandler
+from nxdrive.tests.common_unit_test import log
+from nxdrive.tests.stub_automation_server import StubAutomationServer
+
+BENCHMARK_CALLS = 500
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(2)
+        self._default_pool = BaseAutomationClient.connection_pool
+        BaseAutomationClient.connection_pool = self.pool
+        self.server = StubAutomationServer()
+        self.server.start()
+
+    def tearDown(self):
+        BaseAutomationClient.connection_pool = self._default_pool
+        self.pool.clear()
+        self.server.stop()
+
+    def test_pool(self):
+        pool = ConnectionPool(1)
+        connections = [Mock(), Mock()]
+        self.assertIsNone(pool.get('host'))
+        pool.put('host', connections[0])
+        # Full
+        pool.put('host', connections[1])
+        connections[1].close.assert_called_once_with()
+        self.assertIs(pool.get('host'), connections[0])
+        self.assertIsNone(pool.get('other_host'))
+        metrics = pool.get_metrics()
+        self.assertEquals(metrics["http_connections_reused"], 1)
+        self.assertEquals(metrics["http_connections_discarded"], 1)
+        self.assertEquals(metrics["http_connections_idle"], 0)
+
+    def test_keep_alive(self):
+        remote_client = self.server.get_remote_client()
+        for i in range(10):
+            self.assertEquals(remote_client.make_folder('root', 'folder_%d' % i).name, 'folder_%d' % i)
+        # The fetch of the operations and the creations on one connection
+        self.assertEquals(self.server.connections, 1)
+        self.assertEquals(self.pool.created, 1)
+        self.assertEquals(self.pool.reused, 10)
+        self.assertEquals(self.pool.get_idle_count(), 1)
+        # Shared by the clients
+        self.server.get_remote_client().make_folder('root', 'folder')
+        self.assertEquals(self.server.connections, 1)
+
+    def test_body_left_unread(self):
+        remote_client = self.server.get_remote_client()
+        resp = remote_client.opener.open(self.server.url + 'site/automation/')
+        resp.close()
+        self.assertEquals(self.pool.discarded, 1)
+        remote_client.make_folder('root', 'folder')
+        self.assertEquals(self.server.connections, 2)
+
+    def test_closed_by_server(self):
+        remote_client = self.server.get_remote_client()
+        self.server.close_connections()
+        self.assertEquals(remote_client.make_folder('root', 'folder').name, 'folder')
+        self.assertEquals(self.pool.stale, 1)
+        self.assertEquals(self.server.connections, 2)
+        self.assertEquals(self.server.calls['NuxeoDrive.CreateFolder'], 1)
+
+    def _is_replayed(self, data, request_error=None, response_error=None):
+        # Whether the request failing on the idle connection is sent again on a new one
+        connection_class = Mock()
+        handler = KeepAliveHTTPHandler(self.pool, connection_class)
+        idle = Mock()
+        idle.request.side_effect = request_error
+        idle.getresponse.side_effect = response_error
+        self.pool.put((connection_class, 'host'), idle)
+        req = urllib2.Request('http://host/path', data=data)
+        req.timeout = 10
+        with patch('nxdrive.client.connection_pool.is_dropped', return_value=False):
+            try:
+                handler.http_open(req)
+            except (urllib2.URLError, httplib.HTTPException):
+                pass
+        return connection_class.called
+
+    def test_replay(self):
+        reset = socket.error(errno.ECONNRESET, 'Connection reset by peer')
+        self.assertTrue(self._is_replayed(None, response_error=httplib.BadStatusLine("''")))
+        self.assertTrue(self._is_replayed('{}', request_error=reset))
+        # The operation may have been run by the server
+        self.assertFalse(self._is_replayed('{}', response_error=httplib.BadStatusLine("''")))
+        # Streamed upload already consumed
+        self.assertFalse(self._is_replayed(iter(['content']), request_error=reset))
+
+    def test_connection_close(self):
+        self.server.stop()
+        self.server = StubAutomationServer(keep_alive=False)
+        self.server.start()
+        remote_client = self.server.get_remote_client()
+        remote_client.make_folder('root', 'folder')
+        self.assertEquals(self.pool.get_idle_count(), 0)
+        self.assertEquals(self.server.connections, 2)
+
+
+@attr(priority=2)
+class ConnectionPoolPerformanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubAutomationServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _create_folders(self, remote_client):
+        connections = self.server.connections
+        start = time()
+        for i in range(BENCHMARK_CALLS):
+            remote_client.make_folder('root', 'folder_%d' % i)
+        return time() - start, self.server.connections - connections
+
+    def test_sequential_calls(self):
+        remote_client = self.server.get_remote_client()
+        pooled, pooled_connections = self._create_folders(remote_client)
+        # One connection by request
+        remote_client.opener = urllib2.build_opener()
+        unpooled, unpooled_connections = self._create_folders(remote_client)
+        log.info("%d sequential calls: %.2fs with %d connections, %.2fs with %d connections without the pool",
+                 BENCHMARK_CALLS, pooled, pooled_connections, unpooled, unpooled_connections)
+        self.assertEquals(pooled_connections, 0)
+        self.assertEquals(unpooled_connections, BENCHMARK_CALLS)
+        self.assertLess(pooled, unpooled)
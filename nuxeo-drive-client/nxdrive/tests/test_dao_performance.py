@@ -0,0 +1,258 @@
+'''
+Benchmarks of the EngineDAO under the processor thread model
+'''
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from threading import Thread, current_thread
+from time import time
+from nose.plugins.attrib import attr
+
+from nxdrive.engine.dao.sqlite import EngineDAO, ConfigurationDAO, StateRow
+from nxdrive.logging_config import get_logger
+
+log = get_logger(__name__)
+
+# Settings used before the connection profile was introduced
+LEGACY_PROFILE = dict(journal_mode='MEMORY', synchronous='FULL', mmap_size=0, cache_size=-2000,
+                      temp_store='DEFAULT')
+BENCHMARK_DURATION = 2
+BENCHMARK_ROWS = 10000
+NUMBER_OF_PROCESSORS = 4
+MOVE_BENCHMARK_ROWS = 200000
+ROW_BENCHMARK_ROWS = 1000000
+FILTER_BENCHMARK_FILTERS = 500
+FILTER_BENCHMARK_PATHS = 10000
+
+
+class LegacyRow(sqlite3.Row):
+    # Row factory used before the slots: one instance dict and one overrides dict per row
+
+    def __init__(self, arg1, arg2):
+        super(LegacyRow, self).__init__(arg1, arg2)
+        self._custom = dict()
+
+    def __getattr__(self, name):
+        if name in self._custom:
+            return self._custom[name]
+        return self[name]
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            super(LegacyRow, self).__setattr__(name, value)
+        else:
+            self._custom[name] = value
+
+
+@attr(priority=2)
+class EngineDAOPerformanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='nxdrive-dao-bench-')
+        self._dao = None
+
+    def tearDown(self):
+        if self._dao is not None:
+            self._dao.dispose()
+        ConfigurationDAO.set_connection_profile()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _create_dao(self, name, rows=BENCHMARK_ROWS, folders=100):
+        self._dao = EngineDAO(os.path.join(self.tmpdir, name))
+        con = self._dao._get_write_connection()
+        con.executemany("INSERT INTO States(local_path, local_parent_path, local_name, remote_ref, remote_parent_ref,"
+                        " folderish, local_state, remote_state, pair_state) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        self._generate_rows(rows, folders))
+        con.commit()
+        return self._dao
+
+    def _generate_rows(self, rows, folders):
+        for i in xrange(rows):
+            parent = u'/folder_%d' % (i % folders)
+            yield (parent + u'/file_%d' % i, parent, u'file_%d' % i, 'ref_%d' % i, 'parent_ref_%d' % (i % folders),
+                   0, 'synchronized', 'modified', 'remotely_modified')
+
+    def _run_threads(self, targets, duration):
+        counters = dict()
+        deadline = time() + duration
+
+        def loop(name, target):
+            count = 0
+            try:
+                while time() < deadline:
+                    target(count)
+                    count = count + 1
+            finally:
+                counters[name] = count
+                self._dao.dispose_thread()
+
+        threads = [Thread(target=loop, args=(name, target)) for name, target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counters
+
+    def _processor(self, count):
+        # Same DAO calls than a Processor handling a remotely modified file
+        thread_id = current_thread().ident
+        row_id = (thread_id + count * 7) % BENCHMARK_ROWS + 1
+        doc_pair = self._dao.acquire_state(thread_id, row_id)
+        if doc_pair is None:
+            return
+        try:
+            self._dao.get_local_children(doc_pair.local_parent_path)
+            self._dao.update_last_transfer(row_id, 'download')
+        finally:
+            self._dao.release_state(thread_id)
+
+    def _reader(self, count):
+        # Polling done by the systray and the settings pages
+        self._dao.get_state_from_id(count % BENCHMARK_ROWS + 1)
+        self._dao.get_conflict_count()
+
+    def _benchmark(self, name, **profile):
+        ConfigurationDAO.set_connection_profile(**profile)
+        self._create_dao(name + '.db')
+        targets = [('processor_%d' % i, self._processor) for i in range(NUMBER_OF_PROCESSORS)]
+        targets.append(('reader', self._reader))
+        counters = self._run_threads(targets, BENCHMARK_DURATION)
+        self._dao.dispose()
+        self._dao = None
+        writes = sum([value for key, value in counters.items() if key.startswith('processor')])
+        log.info("%s profile: %d processor items/s, %d reads/s", name, writes / BENCHMARK_DURATION,
+                 counters['reader'] / BENCHMARK_DURATION)
+        return writes, counters['reader']
+
+    def _generate_tree(self, root, depth, width):
+        # Folders of width children on depth levels, each folder containing width files
+        rows = []
+        parents = [root]
+        for level in range(depth):
+            folders = []
+            for parent in parents:
+                for i in range(width):
+                    rows.append((parent + u'/file_%d' % i, parent, u'file_%d' % i, 0))
+                    if len(folders) < width * width:
+                        folders.append(parent + u'/folder_%d' % i)
+                        rows.append((folders[-1], parent, u'folder_%d' % i, 1))
+            parents = folders
+        return rows
+
+    def test_move_deep_tree(self):
+        dao = self._create_dao('move.db', rows=MOVE_BENCHMARK_ROWS)
+        con = dao._get_write_connection()
+        rows = [(u'/moved', u'', u'moved', 1)] + self._generate_tree(u'/moved', 10, 3)
+        con.executemany("INSERT INTO States(local_path, local_parent_path, local_name, folderish) VALUES(?, ?, ?, ?)",
+                        rows)
+        con.commit()
+        # Previous implementation, not able to use the local_parent_path index
+        start = time()
+        con.execute("UPDATE States SET local_parent_path='/renamed' || substr(local_parent_path,7),"
+                    " local_path='/renamed' || substr(local_path,7)"
+                    " WHERE local_parent_path LIKE '/moved/%' OR local_parent_path = '/moved'")
+        like_time = time() - start
+        con.rollback()
+        doc_pair = dao.get_state_from_local(u'/moved')
+        start = time()
+        dao.update_local_parent_path(doc_pair, u'renamed', u'/')
+        range_time = time() - start
+        log.info("Move of %d descendants in a %d rows table: %.3fs with LIKE, %.3fs with range",
+                 len(rows) - 1, len(rows) + MOVE_BENCHMARK_ROWS, like_time, range_time)
+        self.assertEquals(len(dao.get_states_from_partial_local(u'/renamed/')), len(rows) - 1)
+        self.assertEquals(len(dao.get_states_from_partial_local(u'/moved/')), 0)
+
+    def _fetch_rows(self, row_factory):
+        con = self._dao._get_read_connection()
+        con.row_factory = row_factory
+        try:
+            start = time()
+            rows = con.execute("SELECT * FROM States").fetchall()
+            for row in rows:
+                row.local_path, row.remote_ref, row.pair_state
+            elapsed = time() - start
+        finally:
+            con.row_factory = StateRow
+        row = rows[0]
+        size = sys.getsizeof(row)
+        if hasattr(row, '__dict__'):
+            size += sys.getsizeof(row.__dict__)
+        if isinstance(row._custom, dict):
+            size += sys.getsizeof(row._custom)
+        return elapsed, size
+
+    def test_row_factory(self):
+        self._create_dao('rows.db', rows=ROW_BENCHMARK_ROWS)
+        legacy_time, legacy_size = self._fetch_rows(LegacyRow)
+        state_time, state_size = self._fetch_rows(StateRow)
+        log.info("Fetch of %d rows: %.3fs and %d bytes per row with LegacyRow, %.3fs and %d bytes per row with "
+                 "StateRow", ROW_BENCHMARK_ROWS, legacy_time, legacy_size, state_time, state_size)
+        self.assertLess(state_size, legacy_size)
+
+    def _legacy_acquire_release(self, thread_id, row_id):
+        # acquire_state and release_state before the single statement claim
+        if self._dao.acquire_processor(thread_id, row_id):
+            self._dao.get_state_from_id(row_id, from_write=True)
+        self._dao.release_processor(thread_id)
+
+    def _acquire_release(self, thread_id, row_id):
+        doc_pair = self._dao.acquire_state(thread_id, row_id)
+        if doc_pair is not None:
+            self._dao.release_state(thread_id, doc_pair.id)
+
+    def test_empty_handler_throughput(self):
+        self._create_dao('acquire.db')
+        thread_id = current_thread().ident
+        rates = dict()
+        for name, handler in (('legacy', self._legacy_acquire_release), ('single', self._acquire_release)):
+            start = time()
+            for row_id in xrange(1, BENCHMARK_ROWS + 1):
+                handler(thread_id, row_id)
+            rates[name] = BENCHMARK_ROWS / (time() - start)
+        log.info("Empty handler: %d items/s with acquire_processor/get_state_from_id/release_processor, %d items/s"
+                 " with acquire_state/release_state", rates['legacy'], rates['single'])
+        self.assertEquals(self._dao.get_count("processor != 0"), 0)
+
+    def test_is_filter(self):
+        dao = self._create_dao('filters.db', rows=0)
+        for i in xrange(FILTER_BENCHMARK_FILTERS):
+            dao.add_filter(u'/workspace_%d/folder_%d' % (i % 50, i))
+        filters = dao.get_filters()
+        paths = [u'/workspace_%d/folder_%d/file_%d' % (i % 50, i % (FILTER_BENCHMARK_FILTERS * 2), i)
+                 for i in xrange(FILTER_BENCHMARK_PATHS)]
+        # Previous implementation
+        start = time()
+        expected = [any([(path + '/').startswith(filter_obj.path) for filter_obj in filters]) for path in paths]
+        legacy_time = time() - start
+        start = time()
+        result = [dao.is_filter(path) for path in paths]
+        matcher_time = time() - start
+        log.info("is_filter of %d paths with %d filters: %.3fs with a scan of the filters, %.3fs with FilterMatcher",
+                 FILTER_BENCHMARK_PATHS, FILTER_BENCHMARK_FILTERS, legacy_time, matcher_time)
+        self.assertEquals(result, expected)
+        self.assertEquals(sum(result), FILTER_BENCHMARK_PATHS / 2)
+
+    def test_connection_profile(self):
+        dao = self._create_dao('profile.db', rows=0)
+        con = dao._get_read_connection()
+        self.assertEquals(con.execute("PRAGMA journal_mode").fetchone()[0].upper(), 'WAL')
+        self.assertEquals(con.execute("PRAGMA synchronous").fetchone()[0], 1)
+        self.assertEquals(con.execute("PRAGMA temp_store").fetchone()[0], 2)
+
+    def test_invalid_connection_profile(self):
+        ConfigurationDAO.set_connection_profile(journal_mode='WAL; DROP TABLE States', cache_size='big',
+                                                synchronous='full')
+        self.assertEquals(ConfigurationDAO.connection_profile['journal_mode'], 'WAL')
+        self.assertEquals(ConfigurationDAO.connection_profile['cache_size'], -8192)
+        self.assertEquals(ConfigurationDAO.connection_profile['synchronous'], 'FULL')
+
+    def test_concurrent_throughput(self):
+        legacy_writes, legacy_reads = self._benchmark('legacy', **LEGACY_PROFILE)
+        writes, reads = self._benchmark('default')
+        self.assertGreater(legacy_writes, 0)
+        self.assertGreater(legacy_reads, 0)
+        self.assertGreater(writes, 0)
+        self.assertGreater(reads, 0)
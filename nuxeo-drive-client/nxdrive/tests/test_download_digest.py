@@ -0,0 +1,75 @@
+import hashlib
+import shutil
+import tempfile
+import unittest
+from mock import Mock, patch
+from nxdrive.client import LocalClient
+from nxdrive.client.base_automation_client import BaseAutomationClient, NO_LIMIT
+from nxdrive.client.local_client import FileInfo
+from nxdrive.engine.processor import Processor
+from nxdrive.tests.stub_automation_server import StubAutomationServer
+
+
+class DownloadDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self._download_token_bucket = BaseAutomationClient.download_token_bucket
+        # As set by the Manager
+        BaseAutomationClient.set_download_rate_limit(NO_LIMIT)
+        self.server = StubAutomationServer()
+        self.server.start()
+        self.remote_client = self.server.get_remote_client()
+        self.folder = tempfile.mkdtemp(u'-nxdrive-tests')
+        self.local_client = LocalClient(self.folder)
+        engine = Mock()
+        engine.get_dao().get_valid_duplicate_file.return_value = None
+        self.processor = Processor(engine, Mock())
+        # Set by the processing loop
+        self.processor._current_metrics = dict()
+
+    def tearDown(self):
+        BaseAutomationClient.download_token_bucket = self._download_token_bucket
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def _get_pair(self, item):
+        return Mock(id=1, local_path=u'/file.txt', local_name=u'file.txt', remote_name=item['name'],
+                    remote_ref=item['id'], remote_parent_ref=item['parentId'], remote_digest=item['digest'],
+                    local_digest=None, folderish=False)
+
+    def test_stream_content_with_digest(self):
+        item = self.server.add_file('root', 'file.txt', 'content')
+        tmp_file, digest_algorithm, digest = self.remote_client.stream_content_with_digest(
+            item['id'], self.local_client._abspath(u'/file.txt'))
+        self.assertEquals(digest_algorithm, 'md5')
+        self.assertEquals(digest, hashlib.md5('content').hexdigest())
+        with open(tmp_file, 'rb') as f:
+            self.assertEquals(f.read(), 'content')
+        self.assertEquals(self.remote_client.stream_content(item['id'], self.local_client._abspath(u'/file.txt')),
+                          tmp_file)
+
+    def test_update_remotely(self):
+        self.local_client.make_file(u'/', u'file.txt', 'previous content')
+        doc_pair = self._get_pair(self.server.add_file('root', 'file.txt', 'content'))
+        with patch.object(FileInfo, 'get_digest') as get_digest:
+            self.processor._update_remotely(doc_pair, self.local_client, self.remote_client, False)
+        self.assertEquals(get_digest.call_count, 0)
+        self.assertEquals(doc_pair.local_digest, hashlib.md5('content').hexdigest())
+        self.assertEquals(self.local_client.get_content(u'/file.txt'), 'content')
+
+    def test_create_remotely(self):
+        doc_pair = self._get_pair(self.server.add_file('root', 'file.txt', 'content'))
+        with patch.object(FileInfo, 'get_digest') as get_digest:
+            path = self.processor._create_remotely(self.local_client, self.remote_client, doc_pair,
+                                                   Mock(local_path=u'/'), u'file.txt')
+            self.processor._refresh_local_state(doc_pair, self.local_client.get_info(path))
+        self.assertEquals(get_digest.call_count, 0)
+        self.assertEquals(doc_pair.local_digest, hashlib.md5('content').hexdigest())
+
+    def test_other_digest_algorithm(self):
+        # Computed again with the local digest algorithm
+        local_client = LocalClient(self.folder, digest_func='sha1')
+        local_client.make_file(u'/', u'file.txt', 'previous content')
+        doc_pair = self._get_pair(self.server.add_file('root', 'file.txt', 'content'))
+        self.processor._update_remotely(doc_pair, local_client, self.remote_client, False)
+        self.assertEquals(doc_pair.local_digest, hashlib.sha1('content').hexdigest())
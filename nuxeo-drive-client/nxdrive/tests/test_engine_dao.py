@@ -5,11 +5,17 @@ Created on 31 mars 2015
 '''
 import unittest
 import os
+import re
 import sys
+import sqlite3
 import nxdrive
-from nxdrive.engine.dao.sqlite import EngineDAO
+from nxdrive.engine.dao import sqlite as dao_module
+from nxdrive.engine.dao.sqlite import EngineDAO, ConfigurationDAO
 from nxdrive.engine.engine import Engine
 import tempfile
+from threading import Thread, Timer
+from time import time
+from mock import Mock, patch
 
 
 class EngineDAOTest(unittest.TestCase):
@@ -29,6 +35,14 @@ class EngineDAOTest(unittest.TestCase):
             tmp_db.close()
         return tmp_db
 
+    def _get_info(self, row):
+        info = Mock()
+        info.path = row.local_path
+        info.last_modification_time = row.last_local_updated
+        info.size = row.size
+        info.folderish = row.folderish
+        return info
+
     def setUp(self):
         self.build_workspace = os.environ.get('WORKSPACE')
         self.tmpdir = None
@@ -212,6 +226,138 @@ class EngineDAOTest(unittest.TestCase):
         self._dao.synchronize_state(row)
         self.assertFalse(self._dao.release_processor(666))
 
+    def test_state_row_overrides(self):
+        row = self._dao.get_state_from_id(1)
+        self.assertFalse(hasattr(row, '__dict__'))
+        pair_state = row.pair_state
+        row.pair_state = 'overridden'
+        self.assertEquals(row.pair_state, 'overridden')
+        self.assertEquals(row['pair_state'], pair_state)
+        row.update_state(local_state='modified')
+        self.assertEquals(row.local_state, 'modified')
+        del row.pair_state
+        self.assertEquals(row.pair_state, pair_state)
+        self.assertRaises(AttributeError, delattr, row, 'pair_state')
+
+    def test_register_queue_manager(self):
+        con = self._dao._get_write_connection()
+        con.execute("UPDATE States SET local_state='bad', pair_state='bad' WHERE id=50")
+        con.execute("UPDATE States SET remote_state=NULL WHERE id=47")
+        for i in range(5):
+            con.execute("INSERT INTO States(local_path, local_parent_path, folderish, pair_state) VALUES(?, ?, 0, ?)",
+                        (u'/Other_%d' % i, u'/', 'locally_created' if i else 'bad'))
+        con.commit()
+        manager = Mock()
+        chunk_size = dao_module.QUEUE_BOOTSTRAP_CHUNK_SIZE
+        dao_module.QUEUE_BOOTSTRAP_CHUNK_SIZE = 2
+        try:
+            self._dao.register_queue_manager(manager)
+        finally:
+            dao_module.QUEUE_BOOTSTRAP_CHUNK_SIZE = chunk_size
+        # Children of /SmallFolder are handled with their parent
+        pushed = [call[0] for call in manager.push_ref.call_args_list]
+        self.assertEquals(len(pushed), 6)
+        self.assertEquals(pushed[0][2], 'unknown')
+        self.assertEquals(pushed[1][2], 'locally_created')
+        self.assertEquals(pushed[5], (2, 1, 'remotely_created'))
+        # Invalid states are fixed in the database
+        state = self._dao.get_state_from_id(50)
+        self.assertEquals(state.local_state, 'unknown')
+        self.assertEquals(state.remote_state, 'synchronized')
+        self.assertEquals(self._dao.get_state_from_id(47).remote_state, 'unknown')
+
+    def test_register_queue_manager_concurrent_push(self):
+        con = self._dao._get_write_connection()
+        for i in range(4):
+            con.execute("INSERT INTO States(local_path, local_parent_path, folderish, pair_state) VALUES(?, ?, 0, ?)",
+                        (u'/Other_%d' % i, u'/', 'locally_created'))
+        con.commit()
+        manager = Mock()
+
+        def push_ref(row_id, folderish, pair_state, size=None):
+            if manager.push_ref.call_count == 1:
+                # A writer between two chunks, the bootstrap has read the previous state
+                self._dao._queue_pair_state(2, True, 'locally_deleted')
+
+        manager.push_ref.side_effect = push_ref
+        chunk_size = dao_module.QUEUE_BOOTSTRAP_CHUNK_SIZE
+        dao_module.QUEUE_BOOTSTRAP_CHUNK_SIZE = 2
+        try:
+            self._dao.register_queue_manager(manager)
+        finally:
+            dao_module.QUEUE_BOOTSTRAP_CHUNK_SIZE = chunk_size
+        pushed = [call[0] for call in manager.push_ref.call_args_list if call[0][0] == 2]
+        self.assertEquals(pushed, [(2, True, 'locally_deleted', None)])
+        self.assertIsNone(self._dao._bootstrap_queued)
+
+    def _assert_state_counters(self):
+        dao = self._dao
+        self.assertEquals(dao.get_syncing_count(),
+                          dao.get_count("error_count < 3 AND pair_state NOT IN ('synchronized', 'conflicted',"
+                                        " 'unsynchronized')"))
+        self.assertEquals(dao.get_error_count(), dao.get_count("error_count > 3"))
+        self.assertEquals(dao.get_conflict_count(), dao.get_count("pair_state='conflicted'"))
+        self.assertEquals(dao.get_unsynchronized_count(), dao.get_count("pair_state='unsynchronized'"))
+        self.assertEquals(dao.get_sync_count(), dao.get_count("pair_state='synchronized'"))
+        self.assertEquals(dao.get_sync_count("file"), dao.get_count("pair_state='synchronized' AND folderish=0"))
+        self.assertEquals(dao.get_sync_count("folder"), dao.get_count("pair_state='synchronized' AND folderish=1"))
+        size = dao._get_read_connection().execute("SELECT SUM(size) FROM States"
+                                                  " WHERE pair_state='synchronized'").fetchone()[0]
+        self.assertEquals(dao.get_global_size(), size or 0)
+
+    def test_state_counters(self):
+        self._assert_state_counters()
+        self.assertTrue(self._dao.check_state_counters())
+        info = Mock()
+        info.path = u'/Counted.txt'
+        info.last_modification_time = None
+        info.size = 42
+        info.folderish = False
+        info.get_digest.return_value = 'digest'
+        syncing = self._dao.get_syncing_count()
+        row_id = self._dao.insert_local_state(info, u'/')
+        self.assertEquals(self._dao.get_syncing_count(), syncing + 1)
+        self._assert_state_counters()
+        row = self._dao.get_state_from_id(row_id)
+        self.assertTrue(self._dao.synchronize_state(row))
+        self.assertEquals(self._dao.get_syncing_count(), syncing)
+        self._assert_state_counters()
+        self._dao.set_conflict_state(self._dao.get_state_from_id(row_id))
+        self._assert_state_counters()
+        self._dao.unsynchronize_state(self._dao.get_state_from_id(row_id))
+        self._assert_state_counters()
+        # Rollback also reverts the counters
+        con = self._dao._get_write_connection()
+        con.execute("UPDATE States SET pair_state='remotely_modified'")
+        con.rollback()
+        self._assert_state_counters()
+        self._dao.remove_state(self._dao.get_state_from_id(row_id))
+        self._assert_state_counters()
+        # Drift is fixed by the consistency check
+        con.execute("UPDATE StatesCounters SET syncing=1000")
+        con.commit()
+        self.assertFalse(self._dao.check_state_counters())
+        self.assertEquals(self._dao.get_metrics()["db_counters_resets"], 1)
+        self._assert_state_counters()
+        self.assertTrue(self._dao.check_state_counters())
+        self.assertIsNone(self._dao.check_state_counters_if_needed())
+
+    def test_acquire_state(self):
+        state = self._dao.acquire_state(666, 2)
+        self.assertIsNotNone(state)
+        self.assertEquals(state.id, 2)
+        self.assertEquals(state.processor, 666)
+        self.assertIsNone(self._dao.acquire_state(777, 2))
+        self.assertIsNotNone(self._dao.acquire_state(666, 2))
+        self.assertIsNone(self._dao.acquire_state(666, 10000))
+        # Release only the given row
+        self.assertIsNotNone(self._dao.acquire_state(666, 3))
+        self.assertFalse(self._dao.release_state(777, 2))
+        self.assertTrue(self._dao.release_state(666, 2))
+        self.assertFalse(self._dao.release_state(666, 2))
+        self.assertEquals(self._dao.get_state_from_id(3).processor, 666)
+        self.assertTrue(self._dao.release_state(666))
+
     def test_configuration(self):
         result = self._dao.get_config("empty", "DefaultValue")
         self.assertEquals(result, "DefaultValue")
@@ -239,3 +385,304 @@ class EngineDAOTest(unittest.TestCase):
         self.assertEquals(len(self._dao.get_filters()), 1)
         self._dao.add_filter(u"/otherFilter")
         self.assertEquals(len(self._dao.get_filters()), 2)
+        self.assertTrue(self._dao.is_filter(u"/fakeFilter"))
+        self.assertTrue(self._dao.is_filter(u"/fakeFilter/Retest/child"))
+        self.assertTrue(self._dao.is_filter(u"/otherFilter/"))
+        self.assertFalse(self._dao.is_filter(u"/fakeFilterBis"))
+        self.assertFalse(self._dao.is_filter(u"/other"))
+        self.assertFalse(self._dao.is_filter(u"/"))
+        self._dao.remove_filter(u"/fakeFilter")
+        self.assertFalse(self._dao.is_filter(u"/fakeFilter/Retest"))
+        self.assertTrue(self._dao.is_filter(u"/otherFilter/child"))
+
+    def _get_issued_queries(self, calls):
+        # Record the statements the DAO sends on the States table
+        queries = []
+        execute = dao_module.AutoRetryCursor.execute
+
+        def record(cursor, query, params=()):
+            if re.search(r"\b(FROM|UPDATE) States\b", query):
+                queries.append((query, params))
+            return execute(cursor, query, params)
+
+        with patch.object(dao_module.AutoRetryCursor, 'execute', record):
+            for call in calls:
+                call()
+        return queries
+
+    def test_hot_queries_use_indexes(self):
+        folder = self._dao.get_state_from_local(u'/SmallFolder')
+        doc_pair = self._dao.get_state_from_id(3)
+        calls = [
+            lambda: self._dao.get_state_from_local(u'/'),
+            lambda: self._dao.get_local_children(u'/'),
+            lambda: self._dao.get_remote_children(folder.remote_ref),
+            lambda: self._dao.get_states_from_remote(folder.remote_ref),
+            lambda: self._dao.get_valid_duplicate_file('digest'),
+            lambda: self._dao.get_next_folder_file(doc_pair.remote_ref),
+            lambda: self._dao.get_previous_folder_file(doc_pair.remote_ref),
+            lambda: self._dao.release_processor(666),
+            lambda: self._dao.get_last_files(5),
+            lambda: self._dao.get_next_sync_file(doc_pair.remote_ref),
+            lambda: self._dao.get_previous_sync_file(doc_pair.remote_ref),
+            lambda: self._dao.get_error_count(threshold=4),
+            lambda: self._dao.get_syncing_count(threshold=4),
+            lambda: self._dao.update_local_parent_path(folder, u'SmallFolder renamed', u'/'),
+        ]
+        queries = self._get_issued_queries(calls)
+        self.assertTrue(len(queries) >= len(calls))
+        c = self._dao._get_read_connection().cursor()
+        for query, params in queries:
+            plan = [row[-1] for row in c.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()]
+            for detail in plan:
+                self.assertFalse(detail.startswith("SCAN"), "%s: %s" % (query, detail))
+
+    def test_batch_writer(self):
+        pushed = []
+
+        class FakeQueueManager(object):
+            def push_ref(self, row_id, folderish, pair_state, size=None):
+                pushed.append(row_id)
+
+        self._dao._queue_manager = FakeQueueManager()
+        row = self._dao.get_state_from_id(2)
+        other_con = sqlite3.connect(self._dao.get_db())
+        count_query = "SELECT COUNT(*) FROM RemoteScan"
+        scanned = other_con.execute(count_query).fetchone()[0]
+        with self._dao.batch_writer(max_size=100, max_delay=60) as batch:
+            self._dao.add_path_scanned("/Batch")
+            self._dao.add_path_scanned("/Batch2")
+            self._dao.update_last_transfer(row.id, "upload")
+            row.local_state = 'modified'
+            self._dao.update_local_state(row, self._get_info(row))
+            # Visible from the batch thread only
+            self.assertTrue(self._dao.is_path_scanned("/Batch2"))
+            self.assertEquals(self._dao.get_state_from_id(row.id).last_transfer, "upload")
+            self.assertEquals(other_con.execute(count_query).fetchone()[0], scanned)
+            # Queue push is delayed until the commit
+            self.assertEquals(len(pushed), 0)
+            batch.flush()
+            self.assertEquals(other_con.execute(count_query).fetchone()[0], scanned + 2)
+            self.assertEquals(pushed, [row.id])
+            self._dao.add_path_scanned("/Batch3")
+        self.assertEquals(other_con.execute(count_query).fetchone()[0], scanned + 3)
+        self.assertEquals(batch.get_metrics()['batch_flushes'], 2)
+        self.assertTrue(self._dao.auto_commit)
+        other_con.close()
+
+    def test_batch_writer_integrity_error(self):
+        pushed = []
+
+        class FakeQueueManager(object):
+            def push_ref(self, row_id, folderish, pair_state, size=None):
+                pushed.append(row_id)
+
+        self._dao._queue_manager = FakeQueueManager()
+        info = Mock(uid='batch-uid', parent_uid='batch-parent', digest=None, folderish=False,
+                    last_modification_time=None, last_contributor='Administrator', can_rename=True,
+                    can_delete=True, can_update=True, can_create_child=False, size=7)
+        info.name = u'Batch.txt'
+        with self._dao.batch_writer(max_size=100, max_delay=60):
+            self._dao.add_path_scanned("/Batch")
+            row_id = self._dao.insert_remote_state(info, u'/batch-parent', u'/Batch.txt', u'')
+            # Ignored duplicate, the rest of the batch is kept
+            self.assertIsNone(self._dao.insert_remote_state(info, u'/batch-parent', u'/Batch.txt', u''))
+            self._dao.add_path_scanned("/Batch2")
+        self.assertIsNotNone(self._dao.get_state_from_id(row_id))
+        self.assertTrue(self._dao.is_path_scanned("/Batch"))
+        self.assertTrue(self._dao.is_path_scanned("/Batch2"))
+        self.assertEquals(pushed, [row_id])
+        self.assertEquals(self._dao.get_metrics()["db_vacuum_requests"], 0)
+
+    def _get_batch_info(self, name):
+        info = Mock(uid=name + '-uid', parent_uid='batch-parent', digest=None, folderish=False,
+                    last_modification_time=None, last_contributor='Administrator', can_rename=True,
+                    can_delete=True, can_update=True, can_create_child=False, size=7)
+        info.name = name
+        return info
+
+    def test_batch_writer_concurrent_commit(self):
+        pushed = []
+
+        class FakeQueueManager(object):
+            def push_ref(self, row_id, folderish, pair_state, size=None):
+                pushed.append(row_id)
+
+        def rollback():
+            # Like a failed acquire_state of a processor
+            with self._dao._lock:
+                self._dao._get_write_connection().rollback()
+
+        self._dao._queue_manager = FakeQueueManager()
+        other_con = sqlite3.connect(self._dao.get_db())
+        with self._dao.batch_writer(max_size=100, max_delay=60) as batch:
+            row_id = self._dao.insert_remote_state(self._get_batch_info(u'Batch.txt'), u'/batch-parent',
+                                                   u'/Batch.txt', u'')
+            self._dao.add_path_scanned("/Batch")
+            threads = [Thread(target=self._dao.add_path_scanned, args=("/Other",)), Thread(target=rollback)]
+            for thread in threads:
+                thread.start()
+                # Waiting for the batch to commit
+                thread.join(0.2)
+                self.assertTrue(thread.is_alive())
+            self.assertFalse(self._dao.is_path_scanned("/Other"))
+            self.assertIsNone(other_con.execute("SELECT id FROM States WHERE id=?", (row_id,)).fetchone())
+            batch.flush()
+            for thread in threads:
+                thread.join()
+        self.assertIsNotNone(other_con.execute("SELECT id FROM States WHERE id=?", (row_id,)).fetchone())
+        self.assertTrue(self._dao.is_path_scanned("/Batch"))
+        self.assertTrue(self._dao.is_path_scanned("/Other"))
+        self.assertEquals(pushed, [row_id])
+        other_con.close()
+
+    def test_batch_writer_rollback(self):
+        pushed = []
+
+        class FakeQueueManager(object):
+            def push_ref(self, row_id, folderish, pair_state, size=None):
+                pushed.append(row_id)
+
+        self._dao._queue_manager = FakeQueueManager()
+        with self._dao.batch_writer(max_size=100, max_delay=60) as batch:
+            self._dao.insert_remote_state(self._get_batch_info(u'Lost.txt'), u'/batch-parent', u'/Lost.txt', u'')
+            self._dao.add_path_scanned("/Lost")
+            # Like the corruption path of AutoRetryCursor
+            with self._dao._lock:
+                self._dao._get_write_connection().rollback()
+            # The lock is released with the transaction
+            thread = Thread(target=self._dao.add_path_scanned, args=("/Other",))
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            kept_id = self._dao.insert_remote_state(self._get_batch_info(u'Kept.txt'), u'/batch-parent',
+                                                    u'/Kept.txt', u'')
+        self.assertIsNone(self._dao.get_state_from_local(u'/Lost.txt'))
+        self.assertFalse(self._dao.is_path_scanned("/Lost"))
+        self.assertTrue(self._dao.is_path_scanned("/Other"))
+        self.assertEquals(pushed, [kept_id])
+        self.assertEquals(batch.get_metrics()['batch_rollbacks'], 1)
+
+    def test_remote_size_queued(self):
+        # The lane of a file to download depends on its remote size
+        queue_manager = Mock()
+        self._dao._queue_manager = queue_manager
+        info = Mock(uid='large-uid', parent_uid='large-parent', digest=None, folderish=False,
+                    last_modification_time=None, last_contributor='Administrator', can_rename=True,
+                    can_delete=True, can_update=True, can_create_child=False, size=20 * 1024 ** 3)
+        info.name = u'Large.iso'
+        row_id = self._dao.insert_remote_state(info, u'/large-parent', u'/Large.iso', u'')
+        queue_manager.push_ref.assert_called_once_with(row_id, False, 'remotely_created', info.size)
+        self.assertEquals(self._dao.get_state_from_id(row_id).size, info.size)
+        row = self._dao.get_state_from_id(row_id)
+        row.remote_state = 'modified'
+        info.size = 10
+        info.digest = 'changed'
+        self._dao.update_remote_state(row, info)
+        self.assertEquals(queue_manager.push_ref.call_args[0][3], 10)
+
+    def _get_locked_dao(self, busy_timeout):
+        ConfigurationDAO.set_connection_profile(busy_timeout=busy_timeout)
+        try:
+            dao = EngineDAO(self.tmp_db.name)
+        finally:
+            ConfigurationDAO.set_connection_profile()
+        other_con = sqlite3.connect(self.tmp_db.name, isolation_level=None, check_same_thread=False)
+        other_con.execute("BEGIN EXCLUSIVE")
+        return dao, other_con
+
+    def test_lock_retry_metrics(self):
+        dao, other_con = self._get_locked_dao(5000)
+        timer = Timer(0.3, other_con.execute, ("COMMIT",))
+        timer.start()
+        try:
+            dao.update_config("locked", "value")
+        finally:
+            timer.join()
+            other_con.close()
+        self.assertEquals(dao.get_config("locked"), "value")
+        metrics = dao.get_metrics()
+        self.assertGreater(metrics["db_lock_retries"], 0)
+        self.assertGreaterEqual(metrics["db_lock_wait_time"], 250)
+        self.assertEquals(metrics["db_lock_errors"], 0)
+        self.assertFalse(dao.vacuum_if_needed())
+        self._clean_dao(dao)
+
+    def test_lock_wait(self):
+        # The wait is capped by the busy_timeout and the DAO lock is free meanwhile
+        dao, other_con = self._get_locked_dao(500)
+        acquired = []
+
+        def acquire():
+            dao._lock.acquire()
+            acquired.append(True)
+            dao._lock.release()
+
+        timer = Timer(0.2, acquire)
+        timer.start()
+        start = time()
+        try:
+            self.assertRaises(sqlite3.OperationalError, dao.update_config, "locked", "value")
+        finally:
+            timer.join()
+            other_con.execute("ROLLBACK")
+            other_con.close()
+        self.assertLess(time() - start, 2)
+        self.assertEquals(acquired, [True])
+        metrics = dao.get_metrics()
+        self.assertEquals(metrics["db_lock_errors"], 1)
+        self.assertGreaterEqual(metrics["db_lock_wait_time"], 450)
+        self._clean_dao(dao)
+
+    def test_lock_wait_batch(self):
+        # The flush of a batch waits as well
+        dao, other_con = self._get_locked_dao(5000)
+        timer = Timer(0.3, other_con.execute, ("COMMIT",))
+        timer.start()
+        try:
+            with dao.batch_writer(max_size=100, max_delay=60):
+                dao.add_path_scanned("/Locked")
+        finally:
+            timer.join()
+            other_con.close()
+        self.assertTrue(dao.is_path_scanned("/Locked"))
+        self.assertGreater(dao.get_metrics()["db_lock_retries"], 0)
+        self._clean_dao(dao)
+
+    def test_vacuum_requests(self):
+        # Constraint violations are expected by the DAO, only corruptions need a compaction
+        con = self._dao._get_write_connection()
+        self.assertRaises(sqlite3.IntegrityError, con.cursor().execute,
+                          "INSERT INTO Configuration(name, value) VALUES(?, ?)", (dao_module.SCHEMA_VERSION, "0"))
+        self.assertFalse(self._dao.vacuum_if_needed())
+        self.assertFalse(dao_module._is_corruption_error(sqlite3.IntegrityError("UNIQUE constraint failed")))
+        self.assertTrue(dao_module._is_corruption_error(sqlite3.DatabaseError("database disk image is malformed")))
+        vacuums = self._dao.get_metrics()["db_vacuums"]
+        self._dao._stats.last_vacuum = None
+        self._dao._stats.request_vacuum()
+        self.assertTrue(self._dao.vacuum_if_needed())
+        # At most one compaction per interval
+        self._dao._stats.request_vacuum()
+        self.assertFalse(self._dao.vacuum_if_needed())
+        self._dao._stats.last_vacuum = self._dao._stats.last_vacuum - dao_module.VACUUM_MIN_INTERVAL
+        self.assertTrue(self._dao.vacuum_if_needed())
+        self.assertEquals(self._dao.get_metrics()["db_vacuums"], vacuums + 2)
+
+    def test_update_local_parent_path(self):
+        con = self._dao._get_write_connection()
+        rows = [(u'/Folder_1', u'', 1), (u'/Folder_1/Sub', u'/Folder_1', 1), (u'/Folder_1/Sub/File', u'/Folder_1/Sub', 0),
+                (u'/FolderX1', u'', 1), (u'/FolderX1/File', u'/FolderX1', 0), (u'/Folder_1 bis/File', u'/Folder_1 bis', 0)]
+        for path, parent_path, folderish in rows:
+            con.execute("INSERT INTO States(local_path, local_parent_path, local_name, folderish) VALUES(?, ?, ?, ?)",
+                        (path, parent_path, os.path.basename(path), folderish))
+        con.commit()
+        folder = self._dao.get_state_from_local(u'/Folder_1')
+        self._dao.update_local_parent_path(folder, u"Renamed 'quoted'", u'/')
+        self.assertIsNotNone(self._dao.get_state_from_local(u"/Renamed 'quoted'/Sub"))
+        child = self._dao.get_state_from_local(u"/Renamed 'quoted'/Sub/File")
+        self.assertIsNotNone(child)
+        self.assertEquals(child.local_parent_path, u"/Renamed 'quoted'/Sub")
+        # LIKE used to match the _ and the siblings sharing the same prefix
+        self.assertIsNotNone(self._dao.get_state_from_local(u'/FolderX1/File'))
+        self.assertIsNotNone(self._dao.get_state_from_local(u'/Folder_1 bis/File'))
+        self.assertIsNone(self._dao.get_state_from_local(u'/Folder_1/Sub/File'))
@@ -0,0 +1,180 @@
+import unittest
+from mock import Mock, patch
+from time import time
+from nose.plugins.attrib import attr
+from nxdrive.engine.folder_pipeline import FolderPipeline
+from nxdrive.engine.processor import Processor
+from nxdrive.engine.queue_manager import QueueItem
+from nxdrive.tests.common_unit_test import log
+from nxdrive.tests.stub_automation_server import StubAutomationServer
+
+BENCHMARK_FOLDERS = 200
+BENCHMARK_LATENCY = 0.02
+PIPELINE_THREADS = 4
+
+
+class FolderPipelineTest(unittest.TestCase):
+
+    def _create_remote_client(self):
+        remote_client = Mock()
+        remote_client.make_folder.side_effect = lambda parent_ref, name: Mock(uid=name + '_ref', parent_uid=parent_ref)
+        return remote_client
+
+    def test_get(self):
+        remote_client = self._create_remote_client()
+        pipeline = FolderPipeline(2, depth=2)
+        self.assertTrue(pipeline.start(1, remote_client, 'root', 'folder_1'))
+        self.assertTrue(pipeline.start(2, remote_client, 'root', 'folder_2'))
+        self.assertFalse(pipeline.start(3, remote_client, 'root', 'folder_3'))
+        self.assertTrue(pipeline.is_full())
+        self.assertEquals(pipeline.get(1, remote_client, 'root', 'folder_1').uid, 'folder_1_ref')
+        # Not started
+        self.assertIsNone(pipeline.get(3, remote_client, 'root', 'folder_3'))
+        # Renamed since the creation started
+        self.assertIsNone(pipeline.get(2, remote_client, 'root', 'renamed'))
+        remote_client.delete.assert_called_once_with('folder_2_ref', parent_fs_item_id='root')
+        self.assertFalse(pipeline.has(2))
+        pipeline.stop()
+        metrics = pipeline.get_metrics()
+        self.assertEquals(metrics["pipelined_folders"], 0)
+        self.assertEquals(metrics["pipelined_folders_used"], 1)
+        self.assertEquals(metrics["pipelined_folders_cancelled"], 1)
+
+    def test_cancel(self):
+        remote_client = self._create_remote_client()
+        pipeline = FolderPipeline(1)
+        pipeline.start(1, remote_client, 'root', 'folder_1')
+        pipeline.cancel(1, remote_client)
+        remote_client.delete.assert_called_once_with('folder_1_ref', parent_fs_item_id='root')
+        # Failed creations are left to the processor
+        remote_client.make_folder.side_effect = IOError
+        pipeline.start(2, remote_client, 'root', 'folder_2')
+        self.assertIsNone(pipeline.get(2, remote_client, 'root', 'folder_2'))
+        pipeline.stop()
+
+    def test_cancel_bound(self):
+        remote_client = self._create_remote_client()
+        dao = Mock()
+        pipeline = FolderPipeline(1, dao=dao)
+        pipeline.start(1, remote_client, 'root', 'folder_1')
+        pipeline.start(2, remote_client, 'root', 'folder_2')
+        # Bound by the remote watcher before the processor got to it
+        dao.get_normal_state_from_remote.return_value = Mock(id=1)
+        pipeline.cancel(1, remote_client)
+        self.assertIsNone(pipeline.get(2, remote_client, 'root', 'renamed'))
+        dao.get_normal_state_from_remote.assert_called_with('folder_2_ref')
+        self.assertEquals(remote_client.delete.call_count, 0)
+        self.assertEquals(pipeline.get_metrics()["pipelined_folders_cancelled"], 0)
+        pipeline.stop()
+
+    def _get_processor(self, pipeline, remote_client):
+        # Processing loop over the row 1 only
+        engine = Mock()
+        engine.get_queue_manager().get_folder_pipeline.return_value = pipeline
+        engine.get_remote_client.return_value = remote_client
+        processor = Processor(engine, Mock(return_value=None))
+        processor._continue = True
+        processor._get_next_item = Mock(side_effect=[QueueItem(1, True, 'locally_created'), None])
+        processor._hold_for_parent = Mock(return_value=False)
+        return processor
+
+    def _execute(self, pipeline, doc_pair, remote_client):
+        processor = self._get_processor(pipeline, remote_client)
+        processor._dao.acquire_state.return_value = doc_pair
+        with patch.object(Processor, '_synchronize_locally_created') as handler:
+            processor._execute()
+        return handler
+
+    def _execute_dropped(self, pipeline, remote_client, row=None):
+        # The processor could not acquire the row
+        processor = self._get_processor(pipeline, remote_client)
+        processor._dao.acquire_state.return_value = None
+        processor._dao.get_state_from_id.return_value = row
+        processor._execute()
+
+    def _get_pair(self, pair_state):
+        return Mock(id=1, pair_state=pair_state, folderish=True, local_path=u'/folder_1', local_parent_path=u'',
+                    remote_ref=None, last_remote_modifier=None, version=0)
+
+    def test_processor_skip(self):
+        remote_client = self._create_remote_client()
+        dao = Mock()
+        dao.get_normal_state_from_remote.return_value = None
+        pipeline = FolderPipeline(1, dao=dao)
+        pipeline.start(1, remote_client, 'root', 'folder_1')
+        # The remote watcher bound the pair to the pipelined folder
+        handler = self._execute(pipeline, self._get_pair('synchronized'), remote_client)
+        self.assertEquals(handler.call_count, 0)
+        self.assertFalse(pipeline.has(1))
+        self.assertEquals(remote_client.delete.call_count, 0)
+        pipeline.stop()
+
+    def test_processor_unused(self):
+        remote_client = self._create_remote_client()
+        dao = Mock()
+        pipeline = FolderPipeline(1, dao=dao)
+        pipeline.start(1, remote_client, 'root', 'folder_1')
+        dao.get_normal_state_from_remote.return_value = Mock(id=1)
+        self.assertEquals(self._execute(pipeline, self._get_pair('locally_created'), remote_client).call_count, 1)
+        self.assertFalse(pipeline.has(1))
+        self.assertEquals(remote_client.delete.call_count, 0)
+        # Nothing bound to it
+        pipeline.start(1, remote_client, 'root', 'folder_1')
+        dao.get_normal_state_from_remote.return_value = None
+        self._execute(pipeline, self._get_pair('locally_created'), remote_client)
+        remote_client.delete.assert_called_once_with('folder_1_ref', parent_fs_item_id='root')
+        pipeline.stop()
+
+    def test_processor_dropped(self):
+        remote_client = self._create_remote_client()
+        dao = Mock()
+        dao.get_normal_state_from_remote.return_value = None
+        pipeline = FolderPipeline(1, dao=dao)
+        pipeline.start(1, remote_client, 'root', 'folder_1')
+        # Processed by another processor
+        self._execute_dropped(pipeline, remote_client, row=Mock(id=1))
+        self.assertTrue(pipeline.has(1))
+        # Deleted before the processor reached it
+        self._execute_dropped(pipeline, remote_client)
+        self.assertFalse(pipeline.has(1))
+        remote_client.delete.assert_called_once_with('folder_1_ref', parent_fs_item_id='root')
+        pipeline.stop()
+
+
+@attr(priority=2)
+class FolderPipelinePerformanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubAutomationServer(latency=BENCHMARK_LATENCY)
+        self.server.start()
+        self.remote_client = self.server.get_remote_client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _create_folders(self, pipeline):
+        # Sibling folders in the order of the LocalFolderProcessor, starting the next ones ahead
+        names = ['folder_%d' % i for i in range(BENCHMARK_FOLDERS)]
+        start = time()
+        for i, name in enumerate(names):
+            info = None
+            if pipeline is not None:
+                for j in range(i, min(i + pipeline.depth, len(names))):
+                    if not pipeline.has(j) and not pipeline.is_full():
+                        pipeline.start(j, self.remote_client, 'root', names[j])
+                info = pipeline.get(i, self.remote_client, 'root', name)
+            if info is None:
+                info = self.remote_client.make_folder('root', name)
+            self.assertEquals(info.name, name)
+        return time() - start
+
+    def test_remote_folder_creation(self):
+        sequential = self._create_folders(None)
+        pipeline = FolderPipeline(PIPELINE_THREADS)
+        pipelined = self._create_folders(pipeline)
+        pipeline.stop()
+        log.info("Creation of %d remote folders with %dms of latency: %.2fs sequential, %.2fs with %d threads",
+                 BENCHMARK_FOLDERS, BENCHMARK_LATENCY * 1000, sequential, pipelined, PIPELINE_THREADS)
+        self.assertEquals(self.server.calls['NuxeoDrive.CreateFolder'], 2 * BENCHMARK_FOLDERS)
+        self.assertEquals(self.server.calls['NuxeoDrive.Delete'], 0)
+        self.assertLess(pipelined, sequential / 2)
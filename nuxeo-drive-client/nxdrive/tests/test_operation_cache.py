@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+from time import time
+from mock import patch
+from nose.plugins.attrib import attr
+from nxdrive.client.base_automation_client import BaseAutomationClient
+from nxdrive.client.operation_cache import OperationCache
+from nxdrive.tests.common_unit_test import log
+from nxdrive.tests.stub_automation_server import StubAutomationServer
+
+LISTING = [{'id': 'NuxeoDrive.CreateFolder', 'aliases': ['Drive.CreateFolder'], 'params': []}]
+SERVER_URL = 'http://localhost:8080/nuxeo'
+BENCHMARK_CLIENTS = 50
+BENCHMARK_OPERATIONS = 1000
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class OperationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(u'-nxdrive-tests')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = OperationCache(ttl=60, clock=clock)
+        self.assertIsNone(cache.get(SERVER_URL))
+        cache.put(SERVER_URL, LISTING)
+        operations = cache.get(SERVER_URL + '/')
+        self.assertIs(operations['Drive.CreateFolder'], operations['NuxeoDrive.CreateFolder'])
+        clock.now += 60
+        self.assertIsNone(cache.get(SERVER_URL))
+        self.assertEquals(cache.get_metrics(), {"operation_cache_hits": 1, "operation_cache_misses": 2})
+
+    def test_server_version(self):
+        cache = OperationCache()
+        cache.set_server_version(SERVER_URL, '7.10')
+        cache.put(SERVER_URL, LISTING)
+        cache.set_server_version(SERVER_URL, '7.10')
+        self.assertIsNotNone(cache.get(SERVER_URL))
+        # Upgraded
+        cache.set_server_version(SERVER_URL, '8.1')
+        self.assertIsNone(cache.get(SERVER_URL))
+        cache.put(SERVER_URL, LISTING)
+        cache.invalidate(SERVER_URL)
+        self.assertIsNone(cache.get(SERVER_URL))
+
+    def test_persistence(self):
+        path = os.path.join(self.folder, 'operations.json')
+        cache = OperationCache(path=path)
+        cache.set_server_version(SERVER_URL, '7.10')
+        cache.put(SERVER_URL, LISTING)
+        self.assertIn('NuxeoDrive.CreateFolder', OperationCache(path=path).get(SERVER_URL))
+        # Expired
+        self.assertIsNone(OperationCache(ttl=60, path=path, clock=lambda: time() + 60).get(SERVER_URL))
+        with open(path, 'wb') as f:
+            f.write('{')
+        self.assertIsNone(OperationCache(path=path).get(SERVER_URL))
+
+    def test_save_on_change(self):
+        path = os.path.join(self.folder, 'operations.json')
+        cache = OperationCache(path=path)
+        with patch.object(OperationCache, '_save') as save:
+            cache.put(SERVER_URL, LISTING)
+            cache.put(SERVER_URL, list(LISTING))
+            cache.set_server_version(SERVER_URL, None)
+            self.assertEquals(save.call_count, 1)
+            cache.invalidate(SERVER_URL)
+            cache.invalidate(SERVER_URL)
+            self.assertEquals(save.call_count, 2)
+        # Disabled
+        cache = OperationCache(ttl=0, path=path)
+        self.assertIn('NuxeoDrive.CreateFolder', cache.put(SERVER_URL, LISTING))
+        cache.set_server_version(SERVER_URL, '7.10')
+        self.assertIsNone(cache.get(SERVER_URL))
+        self.assertFalse(os.path.exists(path))
+
+
+class OperationCacheClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self._default_cache = BaseAutomationClient.operation_cache
+        BaseAutomationClient.operation_cache = OperationCache()
+        self.server = StubAutomationServer()
+        self.server.start()
+
+    def tearDown(self):
+        BaseAutomationClient.operation_cache = self._default_cache
+        self.server.stop()
+
+    def test_clients(self):
+        remote_client = self.server.get_remote_client()
+        self.assertEquals(self.server.get_remote_client().make_folder('root', 'folder').name, 'folder')
+        self.assertEquals(self.server.calls['operations'], 1)
+        self.assertTrue(remote_client.is_event_log_id_available())
+        # Checking the server is still online
+        remote_client.fetch_api(use_cache=False)
+        self.assertEquals(self.server.calls['operations'], 2)
+
+    def test_unknown_operation(self):
+        self.server.get_remote_client()
+        remote_client = self.server.get_remote_client()
+        self.assertRaises(ValueError, remote_client.execute, 'Stub.Operation0')
+        # Fetched again in case of a new deployment
+        self.assertEquals(self.server.calls['operations'], 2)
+        self.server.extra_operations = 1
+        self.server.get_remote_client().execute('Stub.Operation0')
+        self.assertEquals(self.server.calls['operations'], 3)
+
+
+@attr(priority=2)
+class OperationCachePerformanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._default_cache = BaseAutomationClient.operation_cache
+        self.server = StubAutomationServer(extra_operations=BENCHMARK_OPERATIONS)
+        self.server.start()
+
+    def tearDown(self):
+        BaseAutomationClient.operation_cache = self._default_cache
+        self.server.stop()
+
+    def _create_clients(self, ttl):
+        BaseAutomationClient.operation_cache = OperationCache(ttl=ttl)
+        start = time()
+        for _ in range(BENCHMARK_CLIENTS):
+            self.server.get_remote_client()
+        return time() - start
+
+    def test_client_creation(self):
+        uncached = self._create_clients(0)
+        self.assertEquals(self.server.calls['operations'], BENCHMARK_CLIENTS)
+        cached = self._create_clients(3600)
+        self.assertEquals(self.server.calls['operations'], BENCHMARK_CLIENTS + 1)
+        log.info("Creation of %d clients with %d operations: %.2fs fetching them each time, %.2fs cached",
+                 BENCHMARK_CLIENTS, BENCHMARK_OPERATIONS, uncached, cached)
+        self.assertLess(cached, uncached / 5)
@@ -0,0 +1,130 @@
+import unittest
+from mock import Mock, patch
+from time import sleep
+from nxdrive.engine.blacklist_queue import BlacklistQueue
+from nxdrive.engine.processor import Processor
+from nxdrive.engine.queue_manager import QueueManager, QueueItem
+from nxdrive.tests.common_unit_test import log
+
+# Remotely created tree: TREE_LEVELS levels of NODES_PER_LEVEL nodes, the last level being files
+TREE_LEVELS = 10
+NODES_PER_LEVEL = 1000
+ROOT_ID = 0
+
+
+class ParentSchedulingTest(unittest.TestCase):
+
+    def _create_tree(self):
+        # Node id to parent id, and the nodes from the deepest level as the remote watcher could push them
+        parents = dict()
+        previous = [ROOT_ID]
+        levels = []
+        for level in range(TREE_LEVELS):
+            nodes = range(level * NODES_PER_LEVEL + 1, (level + 1) * NODES_PER_LEVEL + 1)
+            for i, node in enumerate(nodes):
+                parents[node] = previous[i % len(previous)]
+            levels.append(nodes)
+            previous = nodes
+        order = []
+        for level, nodes in reversed(list(enumerate(levels))):
+            order.extend([(node, level < TREE_LEVELS - 1) for node in nodes])
+        return parents, order
+
+    def _synchronize(self, hold):
+        # Single processor creating the tree, return the number of requeued items
+        manager = QueueManager(Mock(), Mock())
+        parents, order = self._create_tree()
+        for node, folderish in order:
+            manager.push_ref(node, folderish, 'remotely_created')
+        created = set([ROOT_ID])
+        requeues = 0
+        while True:
+            item = manager._get_remote_folder() or manager._get_remote_file()
+            if item is None:
+                break
+            if parents[item.id] not in created:
+                if hold and manager.hold_for_parent(item, parents[item.id]):
+                    continue
+                # Previously blacklisted with NO_PARENT then retried
+                requeues += 1
+                manager.push(item)
+                continue
+            created.add(item.id)
+            if item.folderish:
+                manager.release_children(item.id)
+        self.assertEquals(len(created), len(parents) + 1)
+        self.assertEquals(manager.get_overall_size(), 0)
+        self.assertFalse(manager.has_pending_folders())
+        return requeues + manager.get_metrics()["released_items"]
+
+    def test_tree_requeues(self):
+        legacy = self._synchronize(False)
+        requeues = self._synchronize(True)
+        log.info("Creation of a %d levels, %d nodes tree: %d requeues with retries, %d with parent dependencies",
+                 TREE_LEVELS, TREE_LEVELS * NODES_PER_LEVEL, legacy, requeues)
+        self.assertGreater(legacy, 3 * TREE_LEVELS * NODES_PER_LEVEL)
+        # Each child waits at most once for its parent
+        self.assertLessEqual(requeues, (TREE_LEVELS - 1) * NODES_PER_LEVEL)
+
+    def test_parent_never_created(self):
+        manager = QueueManager(Mock(), Mock())
+        manager._on_hold_queue = BlacklistQueue(delay=0)
+        manager.push_ref(1, True, 'locally_created')
+        self.assertEquals(manager._get_local_folder().id, 1)
+        child = QueueItem(2, False, 'locally_created')
+        self.assertTrue(manager.hold_for_parent(child, 1))
+        self.assertFalse(manager.hold_for_parent(QueueItem(3, False, 'locally_created'), 4))
+        self.assertEquals(manager.get_overall_size(), 1)
+        self.assertEquals(manager.get_metrics()["held_items"], 1)
+        # Retried anyway once the delay expires
+        sleep(1.1)
+        manager._on_error_timer()
+        self.assertEquals(manager._get_local_file().id, 2)
+        self.assertEquals(manager.get_overall_size(), 0)
+        manager.release_children(1)
+        self.assertEquals(manager.get_metrics()["released_items"], 0)
+        self.assertFalse(manager.has_pending_folders())
+
+    def _get_processor(self, manager, items):
+        # Processing loop over the given items only
+        engine = Mock()
+        engine.get_queue_manager.return_value = manager
+        processor = Processor(engine, Mock(return_value=None))
+        processor._continue = True
+        processor._get_next_item = Mock(side_effect=items + [None])
+        processor.increase_error = Mock()
+        return processor
+
+    def test_parent_not_created(self):
+        for pair_state in ('locally_created', 'synchronized'):
+            manager = QueueManager(Mock(), Mock())
+            manager.push_ref(1, True, 'locally_created')
+            item = manager._get_local_folder()
+            processor = self._get_processor(manager, [item])
+            parent = Mock(id=1, pair_state='locally_created', folderish=True, local_path=u'/Folder',
+                          local_parent_path=u'', remote_ref=None, last_remote_modifier=None, version=0)
+            processor._dao.get_state_from_local.return_value = parent
+            child = Mock(id=2, pair_state='locally_created', folderish=False, size=0, local_parent_path=u'/Folder')
+            self.assertTrue(processor._hold_for_parent(child))
+            # The parent creation fails, or the pair is skipped
+            parent.pair_state = pair_state
+            processor._dao.acquire_state.return_value = parent
+            with patch.object(Processor, '_synchronize_locally_created', side_effect=ValueError):
+                processor._execute()
+            self.assertFalse(manager.has_pending_folders())
+            self.assertEquals(manager._get_local_file().id, 2)
+            self.assertFalse(processor._hold_for_parent(child))
+
+    def test_parent_gone(self):
+        manager = QueueManager(Mock(), Mock())
+        manager.push_ref(1, True, 'locally_created')
+        processor = self._get_processor(manager, [manager._get_local_folder()])
+        processor._dao.get_state_from_local.return_value = Mock(id=1, pair_state='locally_created')
+        child = Mock(id=2, pair_state='locally_created', folderish=False, size=0, local_parent_path=u'/Folder')
+        self.assertTrue(processor._hold_for_parent(child))
+        # Deleted before the processor reached it
+        processor._dao.acquire_state.return_value = None
+        processor._dao.get_state_from_id.return_value = None
+        processor._execute()
+        self.assertFalse(manager.has_pending_folders())
+        self.assertEquals(manager._get_local_file().id, 2)
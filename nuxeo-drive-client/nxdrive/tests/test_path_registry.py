@@ -0,0 +1,63 @@
+import unittest
+from mock import Mock, patch
+from nxdrive.engine.path_registry import PathRegistry
+from nxdrive.engine.processor import Processor
+from nxdrive.engine.queue_manager import QueueManager
+
+
+class PathRegistryTest(unittest.TestCase):
+
+    def test_lookups(self):
+        registry = PathRegistry()
+        registry.register('folder', u'/a', file_worker=False)
+        registry.register('file_1', u'/a/b/file.txt')
+        registry.register('file_2', u'/ab')
+        self.assertEquals(registry.get_workers(u'/a'), ['folder'])
+        self.assertEquals(sorted(registry.get_workers(u'/a', exact_match=False)), ['file_1', 'file_2', 'folder'])
+        self.assertEquals(registry.get_workers(u'/a/', exact_match=False), ['file_1'])
+        self.assertEquals(sorted(registry.get_workers(u'/a', exact_match=False, file_workers_only=True)),
+                          ['file_1', 'file_2'])
+        self.assertEquals(registry.get_workers(u'/b', exact_match=False), [])
+        # A worker handles one pair at a time
+        registry.register('file_1', u'/c')
+        self.assertEquals(registry.get_workers(u'/a/', exact_match=False), [])
+        self.assertEquals(registry.get_path('file_1'), u'/c')
+        registry.unregister('file_1')
+        registry.unregister('unknown')
+        self.assertIsNone(registry.get_path('file_1'))
+        self.assertEquals(len(registry), 2)
+
+    def test_queue_manager(self):
+        manager = QueueManager(Mock(), Mock())
+        manager._local_folder_thread = Mock()
+        folder_worker = manager._local_folder_thread.worker
+        file_worker = Mock()
+        manager.set_processing(folder_worker, Mock(local_path=u'/folder'))
+        manager.set_processing(file_worker, Mock(local_path=u'/folder/file.txt'))
+        self.assertEquals(manager.get_processors_on(u'/folder'), [folder_worker])
+        self.assertEquals(len(manager.get_processors_on(u'/', exact_match=False)), 2)
+        self.assertTrue(manager.has_file_processors_on(u'/folder'))
+        self.assertTrue(manager.is_processing_file(file_worker, u'/folder/'))
+        self.assertTrue(manager.is_processing_file(folder_worker, u'/folder', exact_match=True))
+        manager.set_processing(file_worker, None)
+        self.assertFalse(manager.has_file_processors_on(u'/folder'))
+        self.assertFalse(manager.is_processing_file(file_worker, u'/folder/'))
+
+    def test_processor_pair_gone(self):
+        manager = QueueManager(Mock(), Mock())
+        engine = Mock()
+        engine.get_queue_manager.return_value = manager
+        processor = Processor(engine, Mock(return_value=None))
+        processor._continue = True
+        processor._get_next_item = Mock(side_effect=[Mock(id=1), None])
+        doc_pair = Mock(id=1, pair_state='locally_modified', folderish=False, local_path=u'/folder/file.txt',
+                        local_parent_path=u'/folder', remote_ref='ref', remote_digest='digest',
+                        last_remote_modifier=None, version=0)
+        processor._dao.acquire_state.return_value = doc_pair
+        engine.get_remote_client().get_info.return_value = Mock(digest='digest')
+        # Deleted while its remote info was refreshed
+        processor._dao.get_state_from_id.return_value = None
+        with patch.object(Processor, '_refresh_remote'):
+            processor._execute()
+        self.assertFalse(manager.has_file_processors_on(u'/folder'))
+        self.assertEquals(manager.get_processors_on(u'/folder/file.txt'), [])
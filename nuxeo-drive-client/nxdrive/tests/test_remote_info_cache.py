@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock
+from time import time
+from nose.plugins.attrib import attr
+from nxdrive.client import RemoteFileSystemClient
+from nxdrive.client.base_automation_client import BaseAutomationClient, NO_LIMIT
+from nxdrive.client.remote_info_cache import RemoteInfoCache
+from nxdrive.tests.common_unit_test import log
+from nxdrive.tests.stub_automation_server import StubAutomationServer
+
+SERVER_URL = 'http://localhost:8080/nuxeo/'
+BENCHMARK_FILES = 10000
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class RemoteInfoCacheTest(unittest.TestCase):
+
+    def test_get(self):
+        clock = Clock()
+        cache = RemoteInfoCache(ttl=60, size=2, clock=clock)
+        info = Mock(uid='file_1', digest='digest_1')
+        cache.put(SERVER_URL, info)
+        self.assertIs(cache.get(SERVER_URL, 'file_1', 'digest_1'), info)
+        # Modified since
+        self.assertIsNone(cache.get(SERVER_URL, 'file_1', 'digest_2'))
+        self.assertIsNone(cache.get(SERVER_URL, 'file_1', None))
+        self.assertIsNone(cache.get('http://other:8080/nuxeo/', 'file_1', 'digest_1'))
+        clock.now += 60
+        self.assertIsNone(cache.get(SERVER_URL, 'file_1', 'digest_1'))
+        self.assertEquals(cache.get_metrics(), {"info_cache_hits": 1, "info_cache_misses": 4})
+
+    def test_size(self):
+        cache = RemoteInfoCache(size=2)
+        for i in range(3):
+            cache.put(SERVER_URL, Mock(uid='file_%d' % i, digest='digest'))
+        # Received again
+        cache.put(SERVER_URL, Mock(uid='file_1', digest='digest'))
+        cache.put(SERVER_URL, Mock(uid='file_3', digest='digest'))
+        self.assertEquals(len(cache), 2)
+        self.assertIsNone(cache.get(SERVER_URL, 'file_2', 'digest'))
+        self.assertIsNotNone(cache.get(SERVER_URL, 'file_1', 'digest'))
+
+
+class RemoteInfoCacheClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self._default_cache = RemoteFileSystemClient.info_cache
+        self._download_token_bucket = BaseAutomationClient.download_token_bucket
+        # As set by the Manager
+        BaseAutomationClient.set_download_rate_limit(NO_LIMIT)
+        RemoteFileSystemClient.info_cache = RemoteInfoCache()
+        self.server = StubAutomationServer()
+        self.server.start()
+        self.remote_client = self.server.get_remote_client()
+        self.folder = tempfile.mkdtemp(u'-nxdrive-tests')
+
+    def tearDown(self):
+        RemoteFileSystemClient.info_cache = self._default_cache
+        BaseAutomationClient.download_token_bucket = self._download_token_bucket
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def _download(self, info):
+        return self.remote_client.stream_content(
+            info.uid, os.path.join(self.folder, info.name), parent_fs_item_id='root',
+            fs_item_info=self.remote_client.get_cached_info(info.uid, info.digest))
+
+    def test_stream_content(self):
+        item = self.server.add_file('root', 'file.txt', 'content')
+        info = self.remote_client.get_children_info('root')[0]
+        with open(self._download(info), 'rb') as f:
+            self.assertEquals(f.read(), 'content')
+        self.assertEquals(self.server.calls['NuxeoDrive.GetFileSystemItem'], 0)
+        # Not received by this process
+        RemoteFileSystemClient.info_cache = RemoteInfoCache()
+        self._download(info)
+        self.assertEquals(self.server.calls['NuxeoDrive.GetFileSystemItem'], 1)
+        self.assertEquals(self.server.calls['download'], 2)
+        self.assertEquals(item['digest'], info.digest)
+
+
+@attr(priority=2)
+class RemoteInfoCachePerformanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._default_cache = RemoteFileSystemClient.info_cache
+        self._download_token_bucket = BaseAutomationClient.download_token_bucket
+        # As set by the Manager
+        BaseAutomationClient.set_download_rate_limit(NO_LIMIT)
+        self.server = StubAutomationServer()
+        self.server.start()
+        self.remote_client = self.server.get_remote_client()
+        self.folder = tempfile.mkdtemp(u'-nxdrive-tests')
+        for i in range(BENCHMARK_FILES):
+            self.server.add_file('root', 'file_%d.txt' % i, 'content %d' % i)
+
+    def tearDown(self):
+        RemoteFileSystemClient.info_cache = self._default_cache
+        BaseAutomationClient.download_token_bucket = self._download_token_bucket
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def _download_files(self, info_cache):
+        # As the processors after the remote watcher got the infos
+        RemoteFileSystemClient.info_cache = info_cache
+        infos = self.remote_client.get_children_info('root')
+        calls = self.server.calls['NuxeoDrive.GetFileSystemItem']
+        start = time()
+        for info in infos:
+            tmp_file = self.remote_client.stream_content(
+                info.uid, os.path.join(self.folder, info.name), parent_fs_item_id='root',
+                fs_item_info=self.remote_client.get_cached_info(info.uid, info.digest))
+            os.remove(tmp_file)
+        return time() - start, self.server.calls['NuxeoDrive.GetFileSystemItem'] - calls
+
+    def test_downloads(self):
+        uncached, uncached_calls = self._download_files(RemoteInfoCache(ttl=0))
+        cached, cached_calls = self._download_files(RemoteInfoCache())
+        log.info("Download of %d small files: %.2fs with %d GetFileSystemItem calls, %.2fs with %d",
+                 BENCHMARK_FILES, uncached, uncached_calls, cached, cached_calls)
+        self.assertEquals(uncached_calls, BENCHMARK_FILES)
+        self.assertEquals(cached_calls, 0)
+        self.assertEquals(self.server.calls['download'], 2 * BENCHMARK_FILES)
+        self.assertLess(cached, uncached)
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from mock import Mock
+from nose.plugins.attrib import attr
+from nxdrive.client.base_automation_client import BaseAutomationClient, CorruptedFile, NO_LIMIT
+from nxdrive.logging_config import get_logger
+from nxdrive.tests.stub_automation_server import StubAutomationServer
+
+log = get_logger(__name__)
+
+
+class SegmentedDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self._download_token_bucket = BaseAutomationClient.download_token_bucket
+        self._download_segments = BaseAutomationClient.download_segments
+        self._segmented_download_threshold = BaseAutomationClient.segmented_download_threshold
+        # As set by the Manager
+        BaseAutomationClient.set_download_rate_limit(NO_LIMIT)
+        BaseAutomationClient.download_segments = 4
+        BaseAutomationClient.segmented_download_threshold = 1024
+        self.folder = tempfile.mkdtemp(u'-nxdrive-tests')
+        self.servers = []
+        self.content = os.urandom(100003)
+
+    def tearDown(self):
+        BaseAutomationClient.download_token_bucket = self._download_token_bucket
+        BaseAutomationClient.download_segments = self._download_segments
+        BaseAutomationClient.segmented_download_threshold = self._segmented_download_threshold
+        for server in self.servers:
+            server.stop()
+        shutil.rmtree(self.folder)
+
+    def _start_server(self, **kwargs):
+        server = StubAutomationServer(**kwargs)
+        server.start()
+        self.servers.append(server)
+        return server
+
+    def _download(self, server, item):
+        remote_client = server.get_remote_client()
+        file_out = os.path.join(self.folder, item['name'])
+        tmp_file, _, digest = remote_client.stream_content_with_digest(item['id'], file_out)
+        with open(tmp_file, 'rb') as f:
+            return f.read(), digest
+
+    def test_segments(self):
+        server = self._start_server(accept_ranges=True)
+        item = server.add_file('root', 'file.bin', self.content)
+        content, digest = self._download(server, item)
+        self.assertEquals(content, self.content)
+        self.assertEquals(digest, hashlib.md5(self.content).hexdigest())
+        self.assertEquals(server.calls['download'], 1)
+        self.assertEquals(server.calls['range'], 3)
+
+    def test_no_ranges(self):
+        # Also below the threshold or when disabled
+        server = self._start_server()
+        item = server.add_file('root', 'file.bin', self.content)
+        self.assertEquals(self._download(server, item)[0], self.content)
+        BaseAutomationClient.download_segments = 1
+        server.accept_ranges = True
+        self.assertEquals(self._download(server, item)[0], self.content)
+        BaseAutomationClient.download_segments = 4
+        BaseAutomationClient.segmented_download_threshold = len(self.content) + 1
+        self.assertEquals(self._download(server, item)[0], self.content)
+        self.assertEquals(server.calls['download'], 3)
+        self.assertEquals(server.calls['range'], 0)
+
+    def test_corrupted(self):
+        server = self._start_server(accept_ranges=True)
+        item = server.add_file('root', 'file.bin', self.content, digest=hashlib.md5('other').hexdigest())
+        self.assertRaises(CorruptedFile, self._download, server, item)
+        self.assertEquals(server.calls['range'], 3)
+        self.assertEquals([name for name in os.listdir(self.folder) if name.endswith('.part')], [])
+
+    def test_rate_limit(self):
+        # Each segment consumes its tokens
+        BaseAutomationClient.download_token_bucket = Mock()
+        BaseAutomationClient.download_token_bucket.get_fill_rate.return_value = NO_LIMIT + 1
+        BaseAutomationClient.download_token_bucket.consume.return_value = 0
+        server = self._start_server(accept_ranges=True)
+        item = server.add_file('root', 'file.bin', self.content)
+        self.assertEquals(self._download(server, item)[0], self.content)
+        consumed = sum(call[0][0] for call in BaseAutomationClient.download_token_bucket.consume.call_args_list)
+        self.assertTrue(consumed >= len(self.content) / 1000)
+
+    @attr(priority=2)
+    def test_benchmark(self):
+        # Connections each limited to 1MB/s
+        server = self._start_server(accept_ranges=True, bandwidth=1024 * 1024)
+        content = os.urandom(4 * 1024 * 1024)
+        item = server.add_file('root', 'file.bin', content)
+        durations = dict()
+        for segments in (1, 4):
+            BaseAutomationClient.download_segments = segments
+            start = time.time()
+            self.assertEquals(self._download(server, item)[0], content)
+            durations[segments] = time.time() - start
+        log.info("Download of 4MB at 1MB/s per connection: %.2fs in one stream, %.2fs in 4 segments",
+                 durations[1], durations[4])
+        self.assertTrue(durations[4] < durations[1] / 2)
@@ -0,0 +1,77 @@
+import json
+import unittest
+from mock import Mock
+from nxdrive.engine.queue_manager import QueueManager
+from nxdrive.engine.tracing import Span, LatencyHistogram, TraceStats
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TracingTest(unittest.TestCase):
+
+    def test_span(self):
+        clock = Clock()
+        span = Span(1, clock=clock)
+        with span.phase('acquire'):
+            clock.now += 0.010
+        with span.phase('transfer'):
+            clock.now += 0.100
+            # Only counted for itself
+            with span.phase('xattr'):
+                clock.now += 0.005
+        with span.phase('dao'):
+            clock.now += 0.002
+        clock.now += 0.003
+        span.finish()
+        self.assertEquals(span.get_phases(), {'acquire': 10, 'transfer': 100, 'xattr': 5, 'dao': 2, 'other': 3})
+        self.assertEquals(span.to_dict()['duration'], 120)
+        # An exception ends the phase
+        try:
+            with span.phase('digest'):
+                clock.now += 0.001
+                raise IOError
+        except IOError:
+            pass
+        self.assertEquals(span.get_phases()['digest'], 1)
+
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        for duration in [1] * 50 + [15] * 40 + [700] * 9 + [90000]:
+            histogram.add(duration)
+        self.assertEquals(histogram.count, 100)
+        self.assertEquals(histogram.get_percentile(50), 1)
+        self.assertEquals(histogram.get_percentile(90), 20)
+        self.assertEquals(histogram.get_percentile(99), 1000)
+        self.assertEquals(histogram.get_percentile(100), 90000)
+        self.assertEquals(LatencyHistogram().get_percentile(50), 0)
+
+    def test_trace_stats(self):
+        clock = Clock()
+        stats = TraceStats(max_spans=2)
+        for i in range(3):
+            span = Span(i, clock=clock)
+            span.handler = '_synchronize_remotely_created'
+            with span.phase('transfer'):
+                clock.now += 0.5
+            stats.add(span.finish())
+        # Items not reaching a handler
+        stats.add(Span(4, clock=clock).finish())
+        traces = json.loads(json.dumps(stats.to_dict()))
+        handler = traces['handlers']['_synchronize_remotely_created']
+        self.assertEquals(handler['total']['count'], 3)
+        self.assertEquals(handler['phases']['transfer']['p50'], 500)
+        self.assertEquals([span['id'] for span in traces['spans']], [1, 2])
+
+    def test_queue_manager(self):
+        manager = QueueManager(Mock(), Mock())
+        span = Span(1)
+        span.handler = '_synchronize_locally_modified'
+        manager.add_span(span.finish())
+        self.assertEquals(manager.get_traces()['handlers']['_synchronize_locally_modified']['total']['count'], 1)
@@ -0,0 +1,111 @@
+import unittest
+from Queue import Queue
+from time import sleep, time
+from PyQt4.QtCore import QCoreApplication
+from nxdrive.engine.workers import PollWorker, Worker
+from nxdrive.tests.common_unit_test import log
+
+IDLE_DURATION = 2
+
+
+class CountingPollWorker(PollWorker):
+
+    def __init__(self, check_interval):
+        super(CountingPollWorker, self).__init__(check_interval)
+        self.polls = 0
+
+    def _poll(self):
+        self.polls += 1
+        return True
+
+
+class LegacyPollWorker(CountingPollWorker):
+    # Wait of the workers before the event driven loop
+
+    def _wait(self, timeout=None, pending=None):
+        QCoreApplication.processEvents()
+        sleep(0.01)
+        self._wakeups += 1
+
+
+class QueueWorker(Worker):
+    # Loop of the watchers: an item is queued and its wakeup processed before the wait
+
+    def __init__(self):
+        super(QueueWorker, self).__init__()
+        self.queue = Queue()
+        self.handled = []
+        self._late_item = True
+
+    def _execute(self):
+        while (1):
+            self._interact()
+            while not self.queue.empty():
+                self.handled.append(self.queue.get())
+            if self._late_item:
+                self._late_item = False
+                self.queue.put('late')
+                self.wakeup()
+                QCoreApplication.processEvents()
+            self._wait(pending=lambda: not self.queue.empty())
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = QCoreApplication.instance()
+        if self.app is None:
+            self.app = QCoreApplication([])
+
+    def _wait_for(self, condition, timeout=5):
+        deadline = time() + timeout
+        while not condition() and time() < deadline:
+            sleep(0.01)
+
+    def _get_idle_wakeups(self, worker):
+        worker.start()
+        self._wait_for(lambda: worker.polls > 0)
+        start = worker.get_metrics()['wakeups']
+        sleep(IDLE_DURATION)
+        wakeups = worker.get_metrics()['wakeups'] - start
+        worker.stop()
+        self.assertFalse(worker.get_thread().isRunning())
+        return wakeups / float(IDLE_DURATION)
+
+    def test_idle_wakeups(self):
+        legacy = self._get_idle_wakeups(LegacyPollWorker(3600))
+        current = self._get_idle_wakeups(CountingPollWorker(3600))
+        log.info("Idle poll worker: %.1f wakeups/s with sleep polling, %.1f wakeups/s with the event driven loop",
+                 legacy, current)
+        self.assertGreater(legacy, 10)
+        self.assertLess(current, 1)
+
+    def test_wakeup(self):
+        worker = CountingPollWorker(3600)
+        worker.start()
+        try:
+            self._wait_for(lambda: worker.polls > 0)
+            self.assertEquals(worker.polls, 1)
+            worker.force_poll()
+            self._wait_for(lambda: worker.polls > 1)
+            self.assertEquals(worker.polls, 2)
+            # Paused workers only wake up to resume or stop
+            worker.suspend()
+            worker.force_poll()
+            sleep(0.5)
+            worker.resume()
+            self._wait_for(lambda: worker.polls > 2)
+            self.assertEquals(worker.polls, 3)
+        finally:
+            worker.stop()
+        self.assertFalse(worker.get_thread().isRunning())
+
+    def test_wakeup_before_wait(self):
+        worker = QueueWorker()
+        worker.start()
+        try:
+            self._wait_for(lambda: worker.handled)
+            self.assertEquals(worker.handled, ['late'])
+        finally:
+            worker.stop()
+        self.assertFalse(worker.get_thread().isRunning())